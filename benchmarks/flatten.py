@@ -0,0 +1,68 @@
+"""
+Benchmark flattening activities into the rows of _raw_objects.
+
+The activities in the test fixture are decoded, then flattened repeatedly by
+create_rows, which is what raw_objects does for every activity in the registry.
+The IATI standard needs to have been downloaded first, e.g. by running
+iati_tables.run_all once, or:
+
+    python -c 'from iati_tables.extract import download_standard; download_standard()'
+
+Codelist names are only added if the codelists have been downloaded too. Then run:
+
+    python benchmarks/flatten.py --copies 2000
+"""
+
+import argparse
+import json
+import time
+
+import iatikit
+from validation import FIXTURES_DIR
+
+from iati_tables import modelling
+from iati_tables.load import parse_dataset
+
+
+def time_flatten(object_jsons: list[str], copies: int) -> tuple[float, int, int]:
+    # create_rows changes the objects it is given, so decode fresh copies
+    objects = [
+        json.loads(object_json) for _ in range(copies) for object_json in object_jsons
+    ]
+    rows = 0
+    start = time.perf_counter()
+    for id, obj in enumerate(objects):
+        for _ in modelling.create_rows(id, "dataset", "prefix", obj, "activity"):
+            rows += 1
+    return time.perf_counter() - start, len(objects), rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--copies", type=int, default=1000, help="Number of copies of each activity"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        modelling.get_codelists_lookup()
+    except FileNotFoundError:
+        print("Codelists not downloaded, flattening without codelist names")
+
+    dataset = iatikit.Dataset(str(FIXTURES_DIR / "test_activity.xml"))
+    object_jsons = [json.dumps(obj) for obj, _ in parse_dataset(dataset)]
+    # Compile the flattening plan before timing
+    time_flatten(object_jsons, 1)
+
+    seconds, objects, rows = min(
+        time_flatten(object_jsons, args.copies) for _ in range(args.repeat)
+    )
+    print(
+        f"{objects} activities, {rows} rows: {seconds:.3f}s, "
+        f"{objects / seconds:.0f} objects/s, {rows / seconds:.0f} rows/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the parse and ingest stages of a staged load separately.
+
+The test fixtures are repeated to make larger datasets, which are parsed into a
+staging directory without a database. With --ingest, the staged datasets are
+then copied into the database configured by DATABASE_URL, which replaces the
+raw tables. The IATI standard needs to have been downloaded first, e.g. by
+running iati_tables.run_all once, or:
+
+    python -c 'from iati_tables.extract import download_standard; download_standard()'
+
+Then run:
+
+    python benchmarks/staging.py --scale 200 --copies 20 --ingest
+"""
+
+import argparse
+import pathlib
+import tempfile
+import time
+
+import iatikit
+from validation import FIXTURES_DIR, scale_fixture
+
+from iati_tables import load
+from iati_tables.staging import write_staged_metadata
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scale", type=int, default=100, help="Number of copies of each fixture"
+    )
+    parser.add_argument(
+        "--copies", type=int, default=10, help="Number of datasets of each fixture"
+    )
+    parser.add_argument("--decoder", default="fast", choices=load.DECODERS)
+    parser.add_argument(
+        "--ingest", action="store_true", help="Also copy into the database"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=5, help="Database connections for ingest"
+    )
+    args = parser.parse_args()
+    # Parse every time, rather than reading from the parse cache
+    load.PARSE_CACHE_BYTES = 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prefix_dir = pathlib.Path(tmp_dir) / "benchmark"
+        prefix_dir.mkdir()
+        staging_dir = pathlib.Path(tmp_dir) / "staging"
+        datasets = []
+        for fixture_path in sorted(FIXTURES_DIR.glob("*.xml")):
+            for copy in range(args.copies):
+                output_path = prefix_dir / f"{fixture_path.stem}-{copy}.xml"
+                scale_fixture(fixture_path, args.scale, output_path)
+                datasets.append(iatikit.Dataset(str(output_path)))
+        input_bytes = sum(load.dataset_size(dataset) for dataset in datasets)
+
+        # Build the schema state before timing
+        load.get_schema_order()
+        for filetype in ["activity", "organisation"]:
+            load.get_schema_decoder(filetype)
+
+        start = time.perf_counter()
+        rows = sum(
+            load.load_dataset(dataset, decoder=args.decoder, staging_dir=staging_dir)
+            for dataset in datasets
+        )
+        seconds = time.perf_counter() - start
+        staged_bytes = sum(
+            path.stat().st_size for path in staging_dir.glob("datasets/*/*.gz")
+        )
+        print(
+            f"parse:  {len(datasets)} datasets, {rows} rows, {input_bytes / 1e6:.1f} MB "
+            f"in {seconds:.2f}s, {rows / seconds:.0f} rows/s, "
+            f"{input_bytes / 1e6 / seconds:.1f} MB/s, staged {staged_bytes / 1e6:.1f} MB"
+        )
+
+        if args.ingest:
+            write_staged_metadata(
+                staging_dir, {"decoder": args.decoder, "validated": True}
+            )
+            start = time.perf_counter()
+            load.load_staged_datasets([staging_dir], processes=args.processes)
+            seconds = time.perf_counter() - start
+            print(
+                f"ingest: {rows} rows in {seconds:.2f}s, {rows / seconds:.0f} rows/s "
+                f"with {args.processes} processes"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark parsing datasets with and without schema validation.
+
+The test fixtures are repeated to make larger datasets. The IATI standard needs
+to have been downloaded first, e.g. by running iati_tables.run_all once, or:
+
+    python -c 'from iati_tables.extract import download_standard; download_standard()'
+
+Then run:
+
+    python benchmarks/validation.py --scale 200
+"""
+
+import argparse
+import copy
+import pathlib
+import tempfile
+import time
+
+import iatikit
+from lxml import etree
+
+from iati_tables.load import parse_dataset
+
+FIXTURES_DIR = (
+    pathlib.Path(__file__).parent.parent / "tests" / "fixtures" / "test_prefix"
+)
+
+
+def scale_fixture(
+    fixture_path: pathlib.Path, scale: int, output_path: pathlib.Path
+) -> None:
+    tree = etree.parse(str(fixture_path))
+    root = tree.getroot()
+    children = list(root)
+    for _ in range(scale - 1):
+        for child in children:
+            root.append(copy.deepcopy(child))
+    tree.write(str(output_path), encoding="utf-8", xml_declaration=True)
+
+
+def time_parse(
+    dataset: iatikit.Dataset, decoder: str, validate: bool
+) -> tuple[float, int]:
+    start = time.perf_counter()
+    count = sum(1 for _ in parse_dataset(dataset, decoder=decoder, validate=validate))
+    return time.perf_counter() - start, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scale", type=int, default=100, help="Number of copies of each fixture"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs of each mode, the best is reported"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prefix_dir = pathlib.Path(tmp_dir) / "benchmark"
+        prefix_dir.mkdir()
+        for fixture_path in sorted(FIXTURES_DIR.glob("*.xml")):
+            output_path = prefix_dir / fixture_path.name
+            scale_fixture(fixture_path, args.scale, output_path)
+            dataset = iatikit.Dataset(str(output_path))
+            # Build the schema state before timing
+            time_parse(dataset, "fast", True)
+
+            print(f"{fixture_path.name} x {args.scale}")
+            baseline = None
+            for decoder in ["xmlschema", "fast"]:
+                for validate in [True, False]:
+                    seconds, count = min(
+                        time_parse(dataset, decoder, validate)
+                        for _ in range(args.repeat)
+                    )
+                    baseline = baseline or seconds
+                    print(
+                        f"  decoder={decoder:<9} validate={str(validate):<5} "
+                        f"{seconds:7.3f}s {count / seconds:8.0f}/s {baseline / seconds:5.1f}x"
+                    )
+
+
+if __name__ == "__main__":
+    main()
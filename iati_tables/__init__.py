@@ -31,10 +31,19 @@ def run_all(
     refresh_standard: bool = False,
     refresh_registry: bool = False,
     processes: int = 5,
+    incremental: bool = False,
+    validate: bool = True,
+    resume: bool = False,
 ) -> None:
     download_standard(refresh=(refresh_standard or refresh))
     download_registry(refresh=(refresh_registry or refresh))
-    load_datasets(processes=processes, sample=sample)
-    process_registry()
+    load_datasets(
+        processes=processes,
+        sample=sample,
+        incremental=incremental,
+        validate=validate,
+        resume=resume,
+    )
+    process_registry(processes=processes)
     export_all()
     upload_all()
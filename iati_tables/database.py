@@ -1,8 +1,9 @@
 import logging
 import os
-from typing import Any
+from io import StringIO
+from typing import Any, Optional, Sequence
 
-from sqlalchemy import Engine, create_engine, text
+from sqlalchemy import Connection, Engine, create_engine, text
 
 logger = logging.getLogger(__name__)
 
@@ -70,3 +71,83 @@ def create_table(table, sql, **params):
     engine = get_engine()
     with engine.begin() as con:
         _create_table(table.lower(), con, sql, **params)
+
+
+def copy_text_value(value: Any) -> str:
+    """
+    Encode a single value for PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\t", "\\t")
+    )
+
+
+def copy_text_row(row: Sequence[Any]) -> str:
+    """
+    Encode a row as a line of PostgreSQL's COPY text format.
+    """
+    return "\t".join([copy_text_value(value) for value in row]) + "\n"
+
+
+class CopyWriter:
+    """
+    Buffer rows and stream them into a table using COPY ... FROM STDIN.
+
+    The buffer is flushed every ``flush_size`` rows (or sooner if it grows past
+    ``flush_bytes``), so memory use stays bounded however many rows are written.
+    Rows are written within the transaction of the given connection.
+    """
+
+    def __init__(
+        self,
+        connection: Connection,
+        table_name: str,
+        columns: Sequence[str],
+        flush_size: int = 1000,
+        flush_bytes: Optional[int] = 16 * 1024 * 1024,
+    ) -> None:
+        self.cursor = connection.connection.cursor()
+        self.copy_sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN"
+        self.flush_size = flush_size
+        self.flush_bytes = flush_bytes
+        self.buffer = StringIO()
+        self.buffered_rows = 0
+        self.rows_written = 0
+
+    def write(self, row: Sequence[Any]) -> None:
+        self.write_line(copy_text_row(row))
+
+    def write_line(self, line: str) -> None:
+        """
+        Write a row that has already been encoded with copy_text_row.
+        """
+        self.buffer.write(line)
+        self.buffered_rows += 1
+        if self.buffered_rows >= self.flush_size or (
+            self.flush_bytes and self.buffer.tell() >= self.flush_bytes
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffered_rows:
+            self.buffer.seek(0)
+            self.cursor.copy_expert(self.copy_sql, self.buffer)
+            self.rows_written += self.buffered_rows
+        self.buffer = StringIO()
+        self.buffered_rows = 0
+
+    def __enter__(self) -> "CopyWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.cursor.close()
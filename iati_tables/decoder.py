@@ -0,0 +1,392 @@
+"""
+A fast decoder for IATI XML elements, used in place of xmlschema.to_dict on the
+per-activity hot path.
+
+Decoding plans are compiled from the same XSD that xmlschema uses, and produce the
+same dicts as xmlschema's default converter: "@" prefixed attributes, "$" for text
+alongside attributes, lists for repeatable elements and floats for decimals.
+
+Only elements that are valid against the schema are decoded. Anything invalid, or
+using features the plans don't cover (e.g. namespaced extension elements), raises
+FallbackRequired, so the caller can decode it with xmlschema instead, which also
+collects the validation errors.
+"""
+
+import datetime
+import re
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Callable, Optional
+
+import xmlschema
+from elementpath.datatypes import AbstractBinary, AbstractDateTime, Duration
+from lxml import etree
+from xmlschema.validators import (
+    XsdAnyElement,
+    XsdAtomicBuiltin,
+    XsdElement,
+    XsdGroup,
+    XsdSimpleType,
+)
+
+XSD_NAMESPACE = "{http://www.w3.org/2001/XMLSchema}"
+XML_WHITESPACE = " \t\n\r"
+
+DECIMAL_RE = re.compile(r"[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)")
+INT_RE = re.compile(r"[+-]?[0-9]+")
+DATE_RE = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})")
+
+Decoder = Callable[[str], Any]
+
+
+class FallbackRequired(Exception):
+    """
+    Raised when an element can't be decoded by the fast decoder, either because it
+    is invalid or because it uses something the decoder doesn't support.
+    """
+
+
+def decode_string(text: str) -> str:
+    return text
+
+
+def decode_boolean(text: str) -> bool:
+    text = text.strip(XML_WHITESPACE)
+    if text == "true" or text == "1":
+        return True
+    if text == "false" or text == "0":
+        return False
+    raise FallbackRequired(f"invalid boolean {text!r}")
+
+
+def decode_decimal(text: str) -> float:
+    text = text.strip(XML_WHITESPACE)
+    if DECIMAL_RE.fullmatch(text) is None:
+        raise FallbackRequired(f"invalid decimal {text!r}")
+    return float(Decimal(text))
+
+
+def decode_int(text: str) -> int:
+    text = text.strip(XML_WHITESPACE)
+    if INT_RE.fullmatch(text) is None:
+        raise FallbackRequired(f"invalid int {text!r}")
+    value = int(text)
+    if not -(2**31) <= value < 2**31:
+        raise FallbackRequired(f"int {text!r} is out of range")
+    return value
+
+
+def simple_type_decoder(xsd_type: XsdSimpleType) -> Decoder:
+    """
+    Return a function decoding text for the given simple type the same way xmlschema
+    does (with decimal_type=float), raising FallbackRequired for invalid values.
+    """
+    if xsd_type.is_qname() or xsd_type.is_notation():
+        raise FallbackRequired(f"{xsd_type} is not supported")
+
+    def decode_generic(text: str) -> Any:
+        value = None
+        for result in xsd_type.iter_decode(text, "lax"):
+            if isinstance(result, xmlschema.XMLSchemaValidationError):
+                raise FallbackRequired(result.reason)
+            value = result
+        if isinstance(value, Decimal):
+            return float(value)
+        if isinstance(value, (AbstractDateTime, Duration)):
+            return text.strip()
+        if isinstance(value, AbstractBinary):
+            return str(value)
+        return value
+
+    if isinstance(xsd_type, XsdAtomicBuiltin):
+        if xsd_type.name == f"{XSD_NAMESPACE}string":
+            return decode_string
+        if xsd_type.name == f"{XSD_NAMESPACE}boolean":
+            return decode_boolean
+        if xsd_type.name == f"{XSD_NAMESPACE}decimal":
+            return decode_decimal
+        if xsd_type.name == f"{XSD_NAMESPACE}int":
+            return decode_int
+        if xsd_type.name == f"{XSD_NAMESPACE}date":
+
+            def decode_date(text: str) -> Any:
+                stripped = text.strip(XML_WHITESPACE)
+                match = DATE_RE.fullmatch(stripped)
+                if match is None:
+                    # Time zones, large years etc.
+                    return decode_generic(text)
+                try:
+                    datetime.date(*(int(part) for part in match.groups()))
+                except ValueError:
+                    raise FallbackRequired(f"invalid date {text!r}")
+                return stripped
+
+            return decode_date
+
+    return decode_generic
+
+
+class ChildPlan:
+    __slots__ = ("key", "type_plan", "as_list", "default")
+
+    def __init__(
+        self, key: str, type_plan: "TypePlan", as_list: bool, default: Optional[str]
+    ) -> None:
+        self.key = key
+        self.type_plan = type_plan
+        self.as_list = as_list
+        self.default = default
+
+
+class Slot:
+    """
+    A position in a flattened content model, matching one or more child tags.
+    """
+
+    __slots__ = ("children", "min_occurs", "max_occurs")
+
+    def __init__(
+        self, children: dict[str, ChildPlan], min_occurs: int, max_occurs: Optional[int]
+    ) -> None:
+        self.children = children
+        self.min_occurs = min_occurs
+        self.max_occurs = max_occurs
+
+
+class TypePlan:
+    """
+    How to decode elements of a single XSD type.
+    """
+
+    __slots__ = (
+        "attributes",
+        "required_attributes",
+        "fixed_attributes",
+        "extra_attributes",
+        "simple_content",
+        "slots",
+        "unsupported",
+    )
+
+    def __init__(self) -> None:
+        self.attributes: dict[str, tuple[str, Decoder]] = {}
+        self.required_attributes: tuple[str, ...] = ()
+        self.fixed_attributes: dict[str, Any] = {}
+        self.extra_attributes: list[tuple[str, str, Any]] = []
+        self.simple_content: Optional[Decoder] = None
+        self.slots: list[Slot] = []
+        self.unsupported: Optional[str] = None
+
+
+class SchemaDecoder:
+    """
+    Decode elements matching a global element declaration of an xmlschema schema.
+    """
+
+    def __init__(self, xml_schema: xmlschema.XMLSchema, element_name: str) -> None:
+        self.type_plans: dict[int, TypePlan] = {}
+        xsd_element = xml_schema.elements[element_name]
+        self.root = self.compile_child(xsd_element, None)
+
+    def compile_child(
+        self, xsd_element: XsdElement, model_group: Optional[XsdGroup]
+    ) -> ChildPlan:
+        as_list = model_group is not None and not (
+            model_group.is_single() and xsd_element.is_single()
+        )
+        type_plan = self.compile_type(xsd_element.type)
+        if (
+            xsd_element.abstract
+            or xsd_element.fixed is not None
+            or xsd_element.identities
+        ):
+            type_plan = TypePlan()
+            type_plan.unsupported = f"element {xsd_element.name} is not supported"
+        return ChildPlan(xsd_element.name, type_plan, as_list, xsd_element.default)
+
+    def compile_type(self, xsd_type: Any) -> TypePlan:
+        # Memoised by identity, which also stops recursive types recursing forever
+        try:
+            return self.type_plans[id(xsd_type)]
+        except KeyError:
+            pass
+        plan = self.type_plans[id(xsd_type)] = TypePlan()
+
+        try:
+            if xsd_type.is_simple():
+                plan.simple_content = simple_type_decoder(xsd_type)
+                return plan
+
+            if xsd_type.mixed or xsd_type.assertions or xsd_type.abstract:
+                raise FallbackRequired(f"{xsd_type} is not supported")
+
+            required_attributes = []
+            for name, xsd_attribute in xsd_type.attributes.items():
+                if name is None or xsd_attribute.use == "prohibited":
+                    # Wildcards only match namespaced attributes, which aren't
+                    # supported anyway
+                    continue
+                decode = simple_type_decoder(xsd_attribute.type)
+                plan.attributes[name] = (f"@{name}", decode)
+                if xsd_attribute.use == "required":
+                    required_attributes.append(name)
+                if xsd_attribute.fixed is not None:
+                    plan.fixed_attributes[name] = decode(xsd_attribute.fixed)
+            plan.required_attributes = tuple(required_attributes)
+            plan.extra_attributes = [
+                (name, f"@{name}", plan.attributes[name][1](value))
+                for name, value in xsd_type.attributes.iter_value_constraints(True)
+            ]
+
+            if xsd_type.has_simple_content():
+                content = xsd_type.content
+                if content.is_list():
+                    raise FallbackRequired(f"{xsd_type} is not supported")
+                plan.simple_content = simple_type_decoder(content)
+            else:
+                model_group = xsd_type.model_group
+                plan.slots = self.compile_group(model_group, model_group)
+        except FallbackRequired as e:
+            plan.unsupported = str(e)
+
+        return plan
+
+    def compile_group(self, group: XsdGroup, model_group: XsdGroup) -> list[Slot]:
+        """
+        Flatten a model group into a list of slots, for groups simple enough to be
+        matched greedily.
+        """
+        if group.model == "choice":
+            children = {}
+            for particle in group:
+                if not isinstance(particle, XsdElement) or (
+                    particle.min_occurs,
+                    particle.max_occurs,
+                ) != (1, 1):
+                    raise FallbackRequired(f"{group} is not supported")
+                children[particle.name] = self.compile_child(particle, model_group)
+            return [Slot(children, group.min_occurs, group.max_occurs)]
+
+        if group.model != "sequence" or (
+            group is not model_group and (group.min_occurs, group.max_occurs) != (1, 1)
+        ):
+            raise FallbackRequired(f"{group} is not supported")
+
+        slots = []
+        for particle in group:
+            if isinstance(particle, XsdElement):
+                slots.append(
+                    Slot(
+                        {particle.name: self.compile_child(particle, model_group)},
+                        particle.min_occurs,
+                        particle.max_occurs,
+                    )
+                )
+            elif isinstance(particle, XsdGroup):
+                slots.extend(self.compile_group(particle, model_group))
+            elif not isinstance(particle, XsdAnyElement):
+                raise FallbackRequired(f"{particle} is not supported")
+            # Wildcards are skipped, as they only match namespaced elements, which
+            # aren't supported
+        return slots
+
+    def decode(self, element: etree._Element) -> Any:
+        """
+        Decode the element, raising FallbackRequired if it can't be decoded.
+        """
+        if element.xpath("boolean(descendant-or-self::*/namespace::*[name()!='xml'])"):
+            raise FallbackRequired("namespace declarations are not supported")
+        return self.decode_element(element, self.root)
+
+    def decode_element(self, element: etree._Element, child_plan: ChildPlan) -> Any:
+        plan = child_plan.type_plan
+        if plan.unsupported:
+            raise FallbackRequired(plan.unsupported)
+
+        result: dict[str, Any] = {}
+        attrib = element.attrib
+        if attrib:
+            attributes = plan.attributes
+            for name, attribute_text in attrib.items():
+                try:
+                    key, decode = attributes[name]
+                except KeyError:
+                    raise FallbackRequired(f"attribute {name} is not allowed")
+                value = decode(attribute_text)
+                if name in plan.fixed_attributes and (
+                    value != plan.fixed_attributes[name]
+                ):
+                    raise FallbackRequired(f"attribute {name} has a fixed value")
+                result[key] = value
+        for name in plan.required_attributes:
+            if name not in attrib:
+                raise FallbackRequired(f"attribute {name} is required")
+        for name, key, value in plan.extra_attributes:
+            if name not in attrib:
+                result[key] = value
+
+        if plan.simple_content is not None:
+            if len(element):
+                raise FallbackRequired("simple content can't have child elements")
+            text = element.text
+            if not text and child_plan.default is not None:
+                text = child_plan.default
+            value = plan.simple_content(text or "")
+            if not text:
+                value = None
+            if not result:
+                return value
+            if value is not None:
+                result["$"] = value
+            return result
+
+        text = element.text
+        if text and text.strip(XML_WHITESPACE):
+            raise FallbackRequired("character data is not allowed")
+
+        slots = plan.slots
+        slot_count = len(slots)
+        slot_index = 0
+        occurs = 0
+        for child in element.iterchildren():
+            tail = child.tail
+            if tail and tail.strip(XML_WHITESPACE):
+                raise FallbackRequired("character data is not allowed")
+            tag = child.tag
+            if not isinstance(tag, str):
+                # Comments and processing instructions
+                continue
+            while True:
+                if slot_index == slot_count:
+                    raise FallbackRequired(f"unexpected child element {tag}")
+                slot = slots[slot_index]
+                grandchild_plan = slot.children.get(tag)
+                if grandchild_plan is not None and (
+                    slot.max_occurs is None or occurs < slot.max_occurs
+                ):
+                    occurs += 1
+                    break
+                if occurs < slot.min_occurs:
+                    raise FallbackRequired(f"unexpected child element {tag}")
+                slot_index += 1
+                occurs = 0
+
+            value = self.decode_element(child, grandchild_plan)
+            key = grandchild_plan.key
+            if grandchild_plan.as_list:
+                try:
+                    result[key].append(value)
+                except KeyError:
+                    result[key] = [value]
+            elif key in result:
+                raise FallbackRequired(f"unexpected child element {tag}")
+            else:
+                result[key] = value
+
+        if slot_index < slot_count and occurs < slots[slot_index].min_occurs:
+            raise FallbackRequired("missing child element")
+        for slot in islice(slots, slot_index + 1, None):
+            if slot.min_occurs:
+                raise FallbackRequired("missing child element")
+
+        return result or None
@@ -3,6 +3,8 @@ import pathlib
 
 import iatikit
 
+from iati_tables.registry import update_registry_index
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,5 +28,6 @@ def download_registry(refresh=False):
     ):
         logger.info("Downloading registry data")
         iatikit.download.data()
+        update_registry_index()
     else:
         logger.info("Not refreshing registry data")
@@ -1,18 +1,61 @@
+import collections
 import concurrent.futures
+import contextlib
+import datetime
 import functools
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import multiprocessing
+import multiprocessing.queues
+import os
 import pathlib
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import time
 from itertools import islice
-from typing import Any, Iterator, Optional, OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    OrderedDict,
+    TypeVar,
+    Union,
+)
 
 import iatikit
 import xmlschema
 from lxml import etree
-from sqlalchemy import column, insert, table, text
+from sqlalchemy import Connection, Engine, text
 
-from iati_tables import sort_iati
-from iati_tables.database import get_engine, schema
+from iati_tables import serialize, sort_iati
+from iati_tables.database import CopyWriter, copy_text_row, get_engine, schema
+from iati_tables.decoder import FallbackRequired, SchemaDecoder
+from iati_tables.parse_cache import CacheReadError, ParseCache
+from iati_tables.registry import (
+    RegistryDataset,
+    get_cache_dir,
+    get_dataset_version,
+    get_registry_index,
+)
+from iati_tables.staging import (
+    StagingWriter,
+    add_staged_failure,
+    clear_staging_dir,
+    iter_staged_datasets,
+    iter_staged_failures,
+    open_staged_rows,
+    read_staged_metadata,
+    write_staged_metadata,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,211 +68,2309 @@ VERSION_1_TRANSFORMS = {
 }
 
 
-def create_database_schema():
+def create_database_schema(drop: bool = True):
     if schema:
         engine = get_engine()
         with engine.begin() as connection:
-            connection.execute(
-                text(
-                    f"""
-                    DROP schema IF EXISTS {schema} CASCADE;
-                    CREATE schema {schema};
-                    """
+            if drop:
+                connection.execute(
+                    text(
+                        f"""
+                        DROP schema IF EXISTS {schema} CASCADE;
+                        CREATE schema {schema};
+                        """
+                    )
                 )
-            )
+            else:
+                connection.execute(text(f"CREATE schema IF NOT EXISTS {schema};"))
 
 
-def create_raw_tables():
+def create_raw_tables(drop: bool = True):
     engine = get_engine()
     with engine.begin() as connection:
         for filetype in ["activity", "organisation"]:
             table_name = f"_raw_{filetype}"
             logger.debug(f"Creating table: {table_name}")
+            if drop:
+                connection.execute(text(f"DROP TABLE IF EXISTS {table_name};"))
             connection.execute(
                 text(
                     f"""
-                    DROP TABLE IF EXISTS {table_name};
-                    CREATE TABLE {table_name}(
+                    CREATE TABLE IF NOT EXISTS {table_name}(
                         id SERIAL, prefix TEXT, dataset TEXT, filename TEXT, error TEXT, version TEXT, object JSONB
                     );
+                    CREATE INDEX IF NOT EXISTS {table_name}_prefix_filename ON {table_name}(prefix, filename);
                     """
                 )
             )
 
 
-class IATISchemaWalker(sort_iati.IATISchemaWalker):
-    def __init__(self):
-        self.tree = etree.parse(
-            str(
-                pathlib.Path()
-                / "__iatikitcache__/standard/schemas/203/iati-activities-schema.xsd"
+def create_dataset_manifest(drop: bool = True):
+    """
+    Create the table recording which version of each file is loaded in the raw
+    tables, so that unchanged files can be skipped by an incremental load.
+    """
+    engine = get_engine()
+    with engine.begin() as connection:
+        logger.debug("Creating table: _dataset_manifest")
+        if drop:
+            connection.execute(text("DROP TABLE IF EXISTS _dataset_manifest;"))
+        connection.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS _dataset_manifest(
+                    prefix TEXT, filename TEXT, dataset TEXT, filetype TEXT, sha1 TEXT, size BIGINT,
+                    mtime DOUBLE PRECISION, row_count INTEGER, loaded_at TIMESTAMP,
+                    load_settings TEXT, PRIMARY KEY (prefix, filename)
+                );
+                """
+            )
+        )
+        # Manifests from before load settings were recorded are treated as loaded
+        # with different settings, so every file is parsed again
+        connection.execute(
+            text(
+                "ALTER TABLE _dataset_manifest ADD COLUMN IF NOT EXISTS load_settings TEXT;"
+            )
+        )
+
+
+def create_load_metadata(drop: bool = True):
+    """
+    Create the table recording how each load was run, e.g. whether validation
+    errors were collected.
+    """
+    engine = get_engine()
+    with engine.begin() as connection:
+        logger.debug("Creating table: _load_metadata")
+        if drop:
+            connection.execute(text("DROP TABLE IF EXISTS _load_metadata;"))
+        connection.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS _load_metadata(
+                    started_at TIMESTAMP, finished_at TIMESTAMP, datasets INTEGER,
+                    incremental BOOLEAN, decoder TEXT, validated BOOLEAN
+                );
+                """
+            )
+        )
+
+
+def create_load_failures(drop: bool = True):
+    """
+    Create the table recording datasets that went over the time or memory limits
+    for loading a dataset, even after being retried.
+    """
+    engine = get_engine()
+    with engine.begin() as connection:
+        logger.debug("Creating table: _load_failures")
+        if drop:
+            connection.execute(text("DROP TABLE IF EXISTS _load_failures;"))
+        connection.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS _load_failures(
+                    prefix TEXT, filename TEXT, dataset TEXT, reason TEXT, attempts INTEGER,
+                    seconds DOUBLE PRECISION, failed_at TIMESTAMP,
+                    PRIMARY KEY (prefix, filename)
+                );
+                """
             )
         )
-        self.tree2 = etree.parse(
-            str(
-                pathlib.Path() / "__iatikitcache__/standard/schemas/203/iati-common.xsd"
+
+
+def write_load_failure(connection: Connection, failure: dict[str, Any]) -> None:
+    connection.execute(
+        text(
+            """
+            INSERT INTO _load_failures
+            VALUES (:prefix, :filename, :dataset, :reason, :attempts, :seconds, now())
+            ON CONFLICT (prefix, filename) DO UPDATE SET
+                dataset = excluded.dataset, reason = excluded.reason,
+                attempts = excluded.attempts, seconds = excluded.seconds,
+                failed_at = excluded.failed_at
+            """
+        ),
+        failure,
+    )
+
+
+def record_load_failure(
+    dataset: iatikit.Dataset,
+    reason: str,
+    attempts: int,
+    seconds: float,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> None:
+    logger.error(f"Dataset '{dataset.name}' failed after {attempts} attempts: {reason}")
+    prefix, filename = dataset_key(dataset.data_path)
+    failure = {
+        "prefix": prefix,
+        "filename": filename,
+        "dataset": dataset.name,
+        "reason": reason,
+        "attempts": attempts,
+        "seconds": seconds,
+    }
+    if staging_dir:
+        add_staged_failure(staging_dir, failure)
+        return
+    engine = get_engine()
+    with engine.begin() as connection:
+        write_load_failure(connection, failure)
+
+
+def start_load_metadata(
+    incremental: bool, decoder: str, validate: bool
+) -> datetime.datetime:
+    """
+    Record the start of a load, which is left unfinished until record_load_metadata
+    is called, so that an interrupted load can be resumed.
+    """
+    started_at = datetime.datetime.utcnow()
+    engine = get_engine()
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                """
+                INSERT INTO _load_metadata
+                VALUES (:started_at, NULL, NULL, :incremental, :decoder, :validated)
+                """
+            ),
+            {
+                "started_at": started_at,
+                "incremental": incremental,
+                "decoder": decoder,
+                "validated": validate,
+            },
+        )
+    return started_at
+
+
+def get_unfinished_load() -> Optional[tuple[datetime.datetime, bool]]:
+    """
+    Return when the latest load started and whether it was validated, if it didn't
+    finish, or None if it did (or there hasn't been one). An older load that didn't
+    finish has been replaced by the latest one, so it isn't resumed.
+    """
+    engine = get_engine()
+    with engine.begin() as connection:
+        result = connection.execute(
+            text(
+                """
+                SELECT started_at, validated, finished_at FROM _load_metadata
+                ORDER BY started_at DESC
+                LIMIT 1
+                """
             )
+        ).first()
+    if result is None or result.finished_at is not None:
+        return None
+    return result.started_at, result.validated
+
+
+def record_load_metadata(
+    started_at: datetime.datetime,
+    datasets: int,
+    validate: bool,
+) -> None:
+    if not validate:
+        logger.info("Validation was skipped, so the error column is empty")
+    engine = get_engine()
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                """
+                UPDATE _load_metadata SET finished_at = :finished_at, datasets = :datasets
+                WHERE started_at = :started_at
+                """
+            ),
+            {
+                "started_at": started_at,
+                "finished_at": datetime.datetime.utcnow(),
+                "datasets": datasets,
+            },
         )
 
 
-def get_sorted_schema_dict():
+SCHEMA_DIR = pathlib.Path() / "__iatikitcache__/standard/schemas/203"
+ACTIVITY_SCHEMA_PATH = SCHEMA_DIR / "iati-activities-schema.xsd"
+ORGANISATION_SCHEMA_PATH = SCHEMA_DIR / "iati-organisations-schema.xsd"
+COMMON_SCHEMA_PATH = SCHEMA_DIR / "iati-common.xsd"
+
+
+class IATISchemaWalker(sort_iati.IATISchemaWalker):
+    def __init__(self):
+        self.tree = etree.parse(str(ACTIVITY_SCHEMA_PATH))
+        self.tree2 = etree.parse(str(COMMON_SCHEMA_PATH))
+
+
+@functools.lru_cache
+def get_sorted_schema_dict(persist: bool = True) -> OrderedDict[str, OrderedDict]:
+    """
+    Return the nested order of elements within iati-activity, building it at most
+    once per process.
+
+    If ``persist`` is set, the result is also saved in the cache directory under a
+    hash of the schema files, so it is only walked again when the standard changes.
+    """
+    if not persist:
+        return IATISchemaWalker().create_schema_dict("iati-activity")
+
+    schema_hash = hashlib.sha1(
+        ACTIVITY_SCHEMA_PATH.read_bytes() + COMMON_SCHEMA_PATH.read_bytes()
+    ).hexdigest()
+    cache_file = get_cache_dir() / f"schema-order-{schema_hash}.json"
+    if cache_file.exists():
+        return json.loads(cache_file.read_text(), object_pairs_hook=OrderedDict)
+
+    logger.debug("Building schema order for iati-activity")
     schema_dict = IATISchemaWalker().create_schema_dict("iati-activity")
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, as several workers may be building this at once
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(schema_dict))
+    tmp_file.replace(cache_file)
     return schema_dict
 
 
+@functools.lru_cache
+def get_schema_order() -> sort_iati.SchemaOrder:
+    return sort_iati.compile_schema_order(get_sorted_schema_dict())
+
+
+# Rank for elements not in the schema, making sure they go to the end
+NON_SCHEMA_ELEMENT: tuple[int, sort_iati.SchemaOrder] = (9999, {})
+
+
 def sort_iati_element(
-    element: etree._Element, schema_subdict: OrderedDict[str, OrderedDict]
+    element: etree._Element, schema_order: sort_iati.SchemaOrder
 ) -> None:
     """
-    Sort the given elements children according to the order of schema_subdict.
+    Sort the given elements children according to the compiled schema_order.
+
+    Children that are already in schema order (the usual case for 2.0x data) are
+    left where they are.
     """
+    ranked_children = []
+    in_order = True
+    previous_rank = -1
+    for child in element.iterchildren():
+        rank, child_order = schema_order.get(child.tag, NON_SCHEMA_ELEMENT)
+        if rank < previous_rank:
+            in_order = False
+        previous_rank = rank
+        ranked_children.append((rank, child, child_order))
 
-    def sort(x: etree._Element) -> int:
-        try:
-            return list(schema_subdict.keys()).index(x.tag)
-        except ValueError:
-            # make sure non schema elements go to the end
-            return 9999
+    if not in_order:
+        ranked_children.sort(key=lambda x: x[0])
+        for _, child, _ in ranked_children:
+            element.append(child)
 
-    children = list(element)
-    for child in children:
-        element.remove(child)
-    for child in sorted(children, key=sort):
-        element.append(child)
-        subdict = schema_subdict.get(child.tag)
-        if subdict:
-            sort_iati_element(child, subdict)
+    for _, child, child_order in ranked_children:
+        if child_order:
+            sort_iati_element(child, child_order)
 
 
 @functools.lru_cache
 def get_xml_schema(filetype: str) -> xmlschema.XMLSchema10:
     if filetype == "activity":
-        return xmlschema.XMLSchema(
-            str(
-                pathlib.Path()
-                / "__iatikitcache__/standard/schemas/203/iati-activities-schema.xsd"
-            )
-        )
+        return xmlschema.XMLSchema(str(ACTIVITY_SCHEMA_PATH))
     else:
-        return xmlschema.XMLSchema(
-            str(
-                pathlib.Path()
-                / "__iatikitcache__/standard/schemas/203/iati-organisations-schema.xsd"
-            )
+        return xmlschema.XMLSchema(str(ORGANISATION_SCHEMA_PATH))
+
+
+@functools.lru_cache
+def get_schema_decoder(filetype: str) -> SchemaDecoder:
+    return SchemaDecoder(get_xml_schema(filetype), f"iati-{filetype}")
+
+
+# Counts of cache hits and misses in this process, which are sent back to the
+# parent process with the result of each task and logged at the end of the load
+cache_counts: collections.Counter[str] = collections.Counter()
+
+
+def take_cache_counts() -> dict[str, int]:
+    counts = dict(cache_counts)
+    cache_counts.clear()
+    return counts
+
+
+def get_transform_cache_dir() -> pathlib.Path:
+    return get_cache_dir() / "transformed"
+
+
+@functools.lru_cache
+def get_transform_version() -> str:
+    sha1 = hashlib.sha1()
+    for path in [this_dir / "iati-activities.xsl", this_dir / "iati-organisations.xsl"]:
+        sha1.update(path.read_bytes())
+    return sha1.hexdigest()
+
+
+def get_transformed_path(
+    dataset: iatikit.Dataset, sha1: Optional[str] = None
+) -> pathlib.Path:
+    """
+    Return the path of the cached 2.0x version of a version 1 dataset, which is
+    keyed by the hash of the file and of the stylesheets used to transform it.
+
+    ``sha1`` is the hash of the file, if the caller already knows it.
+    """
+    prefix, filename = dataset_key(dataset.data_path)
+    if sha1 is None:
+        sha1 = file_sha1(pathlib.Path(dataset.data_path))
+    key = hashlib.sha1(f"{sha1}:{get_transform_version()}".encode()).hexdigest()
+    return get_transform_cache_dir() / prefix / filename / f"{key}.xml"
+
+
+def transform_version_1(
+    dataset: iatikit.Dataset, transformed_path: pathlib.Path
+) -> etree._Element:
+    """
+    Return the root of the dataset transformed to 2.0x, reading it from the
+    transform cache if possible, and otherwise adding it to the cache.
+    """
+    if transformed_path.exists():
+        cache_counts["transform cache hits"] += 1
+        return etree.parse(
+            str(transformed_path), etree.XMLParser(huge_tree=True)
+        ).getroot()
+    cache_counts["transform cache misses"] += 1
+
+    logger.debug(f"Transforming v1 {dataset.filetype} file")
+    transformed = VERSION_1_TRANSFORMS[dataset.filetype](dataset.etree.getroot())
+    # Only keep the latest version of each dataset
+    if transformed_path.parent.is_dir():
+        for path in transformed_path.parent.iterdir():
+            path.unlink(missing_ok=True)
+    transformed_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = transformed_path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        transformed.write(str(tmp_path), encoding="utf-8")
+        tmp_path.replace(transformed_path)
+    except OSError as e:
+        logger.warning(f"Couldn't cache transformed dataset '{dataset.name}': {e}")
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return transformed.getroot()
+
+
+def iter_root_children(
+    path: str, child_element_name: str, remove_blank_text: bool = True
+) -> Iterator[tuple[str, etree._Element]]:
+    """
+    Yield the version of the file along with each of the child elements of its
+    root with the given name, dropping them from the tree once they have been
+    processed.
+    """
+    for _, element in etree.iterparse(
+        path,
+        events=("end",),
+        tag=child_element_name,
+        remove_blank_text=remove_blank_text,
+        huge_tree=True,
+    ):
+        root = element.getparent()
+        if root is None or root.getparent() is not None:
+            continue
+        # Anything before this element has already been processed (or isn't an
+        # activity/organisation), so we don't need to keep it in memory
+        while element.getprevious() is not None:
+            del root[0]
+        yield root.get("version", "1.01"), element
+
+
+def iter_dataset_elements(
+    dataset: iatikit.Dataset, stream: bool = True, sha1: Optional[str] = None
+) -> Iterator[tuple[str, etree._Element]]:
+    """
+    Yield the version of the dataset along with each of its top-level iati-activity
+    or iati-organisation elements, transformed to 2.0x if necessary.
+
+    If ``stream`` is set the file is read with iterparse, and elements are dropped
+    from the tree once they have been processed, so memory use is bounded by the
+    largest element rather than the whole file. Version 1 files still need the whole
+    tree for the XSLT transform, unless the transformed file is already cached.
+
+    ``sha1`` is the hash of the file, if the caller already knows it, which saves
+    hashing it again to look up the transform cache.
+    """
+    child_element_name = f"iati-{dataset.filetype}"
+
+    if stream:
+        for version, element in iter_root_children(
+            dataset.data_path, child_element_name
+        ):
+            if version.startswith("1"):
+                break
+            yield version, element
+        else:
+            return
+
+        transformed_path = get_transformed_path(dataset, sha1)
+        if transformed_path.exists():
+            cache_counts["transform cache hits"] += 1
+            # The cached file is exactly what the transform produced, so blank text
+            # is kept, as it would be in the transformed tree
+            for _, element in iter_root_children(
+                str(transformed_path), child_element_name, remove_blank_text=False
+            ):
+                yield version, element
+            return
+    else:
+        version = get_dataset_version(dataset.data_path)
+
+    if version.startswith("1"):
+        # Only parses the original file if the transform isn't already cached
+        dataset_etree = transform_version_1(
+            dataset, get_transformed_path(dataset, sha1)
         )
+    else:
+        dataset_etree = dataset.etree.getroot()
+
+    for child_element in dataset_etree.findall(child_element_name):
+        yield version, child_element
+
+
+DECODERS = ("fast", "xmlschema", "differential")
+
+DECODER = os.environ.get("IATI_TABLES_DECODER", "fast")
+
+
+# Activities are split between the chunks of a large dataset in blocks of this
+# size, e.g. with 3 chunks the second gets activities 1000-1999, 4000-4999, ...
+CHUNK_BLOCK_SIZE = 1000
 
 
 def parse_dataset(
     dataset: iatikit.Dataset,
+    stream: bool = True,
+    decoder: str = DECODER,
+    chunk: Optional[tuple[int, int]] = None,
+    validate: bool = True,
+    sha1: Optional[str] = None,
 ) -> Iterator[tuple[dict[str, Any], list[xmlschema.XMLSchemaValidationError]]]:
-    try:
-        dataset_etree = dataset.etree.getroot()
-    except Exception:
-        logger.debug(f"Error parsing XML for dataset '{dataset.name}'")
-        return
+    """
+    Yield each activity or organisation in the dataset as a dict, along with any
+    schema validation errors.
 
-    version = dataset_etree.get("version", "1.01")
-    if version.startswith("1"):
-        logger.debug(f"Transforming v1 {dataset.filetype} file")
-        dataset_etree = VERSION_1_TRANSFORMS[dataset.filetype](dataset_etree).getroot()
+    If ``validate`` is not set, elements that the fast decoder can't handle are
+    decoded by xmlschema without validation, and no errors are returned.
+
+    If ``chunk`` is given as (chunk number, number of chunks), only the blocks of
+    activities belonging to that chunk are yielded.
 
+    ``sha1`` is the hash of the file, if the caller already knows it.
+
+    ``decoder`` is one of:
+
+    - "fast": use the SchemaDecoder, falling back to xmlschema for anything it can't
+      decode (which includes everything invalid, so errors are still reported).
+    - "xmlschema": always use xmlschema.
+    - "differential": decode with both, and log a warning if they differ. The
+      xmlschema result is the one yielded.
+
+    Raises an lxml error or OSError if the file can't be read or parsed.
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder '{decoder}'")
     parent_element_name = (
         "iati-organisations"
         if dataset.filetype == "organisation"
         else "iati-activities"
     )
     child_element_name = f"iati-{dataset.filetype}"
-    for child_element in dataset_etree.findall(child_element_name):
-        sort_iati_element(child_element, get_sorted_schema_dict())
+    for index, (version, child_element) in enumerate(
+        iter_dataset_elements(dataset, stream, sha1)
+    ):
+        if chunk and (index // CHUNK_BLOCK_SIZE) % chunk[1] != chunk[0]:
+            continue
+        sort_iati_element(child_element, get_schema_order())
         parent_element = etree.Element(parent_element_name, version=version)
         parent_element.append(child_element)
 
-        xmlschema_to_dict_result: tuple[dict[str, Any], list[Any]] = xmlschema.to_dict(
-            parent_element,  # type: ignore
-            schema=get_xml_schema(dataset.filetype),
-            validation="lax",
-            decimal_type=float,
-        )
-        parent_dict, error = xmlschema_to_dict_result
+        fast_dict = None
+        fallback_reason = None
+        if decoder != "xmlschema":
+            try:
+                fast_dict = get_schema_decoder(dataset.filetype).decode(child_element)
+            except FallbackRequired as e:
+                fallback_reason = str(e)
+            else:
+                if decoder == "fast":
+                    yield fast_dict, []
+                    continue
+
+        if validate:
+            xmlschema_to_dict_result: tuple[
+                dict[str, Any], list[Any]
+            ] = xmlschema.to_dict(
+                parent_element,  # type: ignore
+                schema=get_xml_schema(dataset.filetype),
+                validation="lax",
+                decimal_type=float,
+            )
+            parent_dict, error = xmlschema_to_dict_result
+        else:
+            # Without validation, only the dict is returned
+            parent_dict = xmlschema.to_dict(
+                parent_element,  # type: ignore
+                schema=get_xml_schema(dataset.filetype),
+                validation="skip",
+                decimal_type=float,
+            )
+            error = []
         child_dict = parent_dict.get(child_element_name, [{}])[0]
+
+        if decoder == "differential":
+            if fallback_reason is not None:
+                if not error:
+                    logger.debug(
+                        f"Fast decoder fell back for valid {dataset.filetype} in "
+                        f"dataset '{dataset.name}': {fallback_reason}"
+                    )
+            elif error or fast_dict != child_dict:
+                logger.warning(
+                    f"Fast decoder mismatch for {dataset.filetype} in dataset "
+                    f"'{dataset.name}': {json.dumps(fast_dict)} != {json.dumps(child_dict)}"
+                )
         yield child_dict, error
 
 
-def load_dataset(dataset: iatikit.Dataset) -> None:
-    if not dataset.data_path:
-        logger.warn(f"Dataset '{dataset}' not found")
-        return
+RAW_COLUMNS = ["prefix", "dataset", "filename", "error", "version", "object"]
 
-    path = pathlib.Path(dataset.data_path)
-    prefix, filename = path.parts[-2:]
 
-    engine = get_engine()
+T = TypeVar("T")
+
+
+class DatasetParseError(Exception):
+    """
+    Raised when a dataset, or a chunk of one, can't be read or parsed.
+    """
+
+
+@contextlib.contextmanager
+def raise_parse_errors() -> Iterator[None]:
+    """
+    Raise errors reading or parsing the XML in the block as DatasetParseError, so
+    that they can be told apart from errors writing the rows. Unlike lxml's errors,
+    it can also be pickled to send back to the parent process.
+    """
+    try:
+        yield
+    except (OSError, etree.XMLSyntaxError) as e:
+        raise DatasetParseError(str(e)) from None
+
+
+def iter_parse_errors_raised(objects: Iterator[T]) -> Iterator[T]:
+    """
+    Yield from ``objects``, raising its errors as in raise_parse_errors. Errors in
+    the code consuming the objects are raised as they are.
+    """
+    with raise_parse_errors():
+        yield from objects
+
+
+def iter_raw_rows(
+    dataset: iatikit.Dataset,
+    stream: bool = True,
+    decoder: str = DECODER,
+    chunk: Optional[tuple[int, int]] = None,
+    validate: bool = True,
+    cache_key: Optional[str] = None,
+    sha1: Optional[str] = None,
+) -> Iterator[tuple[Any, ...]]:
+    """
+    Yield the rows of the raw table for the dataset, with columns RAW_COLUMNS.
+
+    If ``cache_key`` is given, the rows are read from the parse cache if possible,
+    and otherwise written to it as the dataset is parsed. ``sha1`` is the hash of
+    the file, if the caller already knows it.
+    """
+    prefix, filename = dataset_key(dataset.data_path)
+    if cache_key:
+        with get_parse_cache().read(cache_key) as cached:
+            if cached:
+                logger.debug(f"Parse cache hit for dataset '{dataset.name}'")
+                cache_counts["parse cache hits"] += 1
+                version, cached_objects = cached
+                for error, object_json in cached_objects:
+                    yield prefix, dataset.name, filename, error, version, object_json
+                return
+        logger.debug(f"Parse cache miss for dataset '{dataset.name}'")
+        cache_counts["parse cache misses"] += 1
+
+    with raise_parse_errors():
+        version = get_dataset_version(dataset.data_path)
+    with contextlib.ExitStack() as stack:
+        cache_writer = (
+            stack.enter_context(get_parse_cache().write(cache_key, version))
+            if cache_key
+            else None
+        )
+        for object, errors in iter_parse_errors_raised(
+            parse_dataset(dataset, stream, decoder, chunk, validate, sha1)
+        ):
+            error_text = "\n".join(
+                [f"{error.reason} at {error.path}" for error in errors]
+            )
+            object_json = serialize.dumps(object)
+            if cache_writer:
+                cache_writer.write(error_text, object_json)
+            yield prefix, dataset.name, filename, error_text, version, object_json
+
+
+PARSE_CACHE_BYTES = int(
+    os.environ.get("IATI_TABLES_PARSE_CACHE_BYTES", 10 * 1024 * 1024 * 1024)
+)
+
+
+def get_parse_cache() -> ParseCache:
+    return ParseCache(get_cache_dir() / "parsed", PARSE_CACHE_BYTES)
+
+
+@functools.lru_cache
+def get_parse_cache_version() -> str:
+    """
+    Return a hash of everything besides the dataset itself that affects the output
+    of parse_dataset: the schemas, and the code and stylesheets used to parse it.
+    """
+    sha1 = hashlib.sha1(xmlschema.__version__.encode())
+    for path in [
+        ACTIVITY_SCHEMA_PATH,
+        ORGANISATION_SCHEMA_PATH,
+        COMMON_SCHEMA_PATH,
+        this_dir / "load.py",
+        this_dir / "decoder.py",
+        this_dir / "sort_iati.py",
+        this_dir / "iati-activities.xsl",
+        this_dir / "iati-organisations.xsl",
+    ]:
+        sha1.update(path.read_bytes())
+    return sha1.hexdigest()
+
+
+def get_parse_cache_key(
+    dataset: iatikit.Dataset, sha1: str, validate: bool
+) -> Optional[str]:
+    if not get_parse_cache().enabled:
+        return None
+    return hashlib.sha1(
+        f"{sha1}:{dataset.filetype}:{validate}:{get_parse_cache_version()}".encode()
+    ).hexdigest()
+
+
+def get_load_settings(decoder: str, validate: bool) -> str:
+    """
+    Return a description of everything besides the file itself that affects the
+    rows loaded for a dataset, to be recorded in the manifest alongside its hash.
+    """
+    return f"validate={validate} decoder={decoder} parser={get_parse_cache_version()}"
+
+
+# Manifest entries are (sha1, size, mtime, load_settings), keyed by (prefix, filename)
+Manifest = dict[tuple[str, str], tuple[str, int, float, Optional[str]]]
+
+
+def dataset_key(data_path: str) -> tuple[str, str]:
+    prefix, filename = pathlib.Path(data_path).parts[-2:]
+    return prefix, filename
+
+
+def file_sha1(path: pathlib.Path) -> str:
+    sha1 = hashlib.sha1()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
+
+def get_dataset_manifest() -> Manifest:
+    engine = get_engine()
     with engine.begin() as connection:
-        connection.execute(
-            insert(
-                table(
-                    f"_raw_{dataset.filetype}",
-                    column("prefix"),
-                    column("dataset"),
-                    column("filename"),
-                    column("error"),
-                    column("version"),
-                    column("object"),
-                )
-            ).values(
-                [
-                    {
-                        "prefix": prefix,
-                        "dataset": dataset.name,
-                        "filename": filename,
-                        "error": "\n".join(
-                            [f"{error.reason} at {error.path}" for error in errors]
-                        ),
-                        "version": dataset.version,
-                        "object": json.dumps(object),
-                    }
-                    for object, errors in parse_dataset(dataset)
-                ]
+        result = connection.execute(
+            text(
+                "SELECT prefix, filename, sha1, size, mtime, load_settings FROM _dataset_manifest"
             )
         )
+        return {
+            (row.prefix, row.filename): (
+                row.sha1,
+                row.size,
+                row.mtime,
+                row.load_settings,
+            )
+            for row in result
+        }
 
-    engine.dispose()
 
+def find_changed_datasets(
+    datasets: Iterable[iatikit.Dataset], manifest: Manifest, load_settings: str
+) -> tuple[list[tuple[iatikit.Dataset, Optional[str]]], set[tuple[str, str]]]:
+    """
+    Compare the datasets on disk with the manifest.
 
-def load_datasets(processes: int, sample: Optional[int] = None) -> None:
-    create_database_schema()
-    create_raw_tables()
+    Returns the datasets that need loading, each with the hash of its file in the
+    manifest (if any), and the keys of manifest entries whose files have gone.
 
-    logger.info(
-        f"Loading {len(list(islice(iatikit.data().datasets, sample)))} datasets into database"
+    Files loaded with different ``load_settings`` (see get_load_settings) are
+    loaded again. Otherwise files with the same size and mtime as in the manifest
+    are assumed unchanged, and others are returned with their manifest hash, so
+    that the worker can skip parsing them if only the mtime has changed.
+    """
+    changed: list[tuple[iatikit.Dataset, Optional[str]]] = []
+    seen = set()
+    for dataset in datasets:
+        if not dataset.data_path:
+            changed.append((dataset, None))
+            continue
+        key = dataset_key(dataset.data_path)
+        seen.add(key)
+        entry = manifest.get(key)
+        if entry:
+            sha1, size, mtime, entry_load_settings = entry
+            if entry_load_settings != load_settings:
+                changed.append((dataset, None))
+                continue
+            stat = os.stat(dataset.data_path)
+            if stat.st_size == size and stat.st_mtime == mtime:
+                continue
+            changed.append((dataset, sha1))
+        else:
+            changed.append((dataset, None))
+    return changed, set(manifest) - seen
+
+
+def delete_dataset_rows(connection: Connection, prefix: str, filename: str) -> None:
+    for filetype in ["activity", "organisation"]:
+        connection.execute(
+            text(
+                f"DELETE FROM _raw_{filetype} WHERE prefix = :prefix AND filename = :filename"
+            ),
+            {"prefix": prefix, "filename": filename},
+        )
+
+
+def get_manifest_entry(
+    dataset: iatikit.Dataset, sha1: str, stat: os.stat_result, load_settings: str
+) -> dict[str, Any]:
+    """
+    Return the manifest entry for the file, apart from its row count.
+    """
+    prefix, filename = dataset_key(dataset.data_path)
+    return {
+        "prefix": prefix,
+        "filename": filename,
+        "dataset": dataset.name,
+        "filetype": dataset.filetype,
+        "sha1": sha1,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "load_settings": load_settings,
+    }
+
+
+def write_manifest_entry(connection: Connection, entry: dict[str, Any]) -> None:
+    connection.execute(
+        text(
+            """
+            INSERT INTO _dataset_manifest(
+                prefix, filename, dataset, filetype, sha1, size, mtime, row_count, loaded_at,
+                load_settings
+            )
+            VALUES (
+                :prefix, :filename, :dataset, :filetype, :sha1, :size, :mtime, :row_count, now(),
+                :load_settings
+            )
+            ON CONFLICT (prefix, filename) DO UPDATE SET
+                dataset = excluded.dataset, filetype = excluded.filetype, sha1 = excluded.sha1,
+                size = excluded.size, mtime = excluded.mtime, row_count = excluded.row_count,
+                loaded_at = excluded.loaded_at, load_settings = excluded.load_settings
+            """
+        ),
+        entry,
+    )
+    connection.execute(
+        text(
+            "DELETE FROM _load_failures WHERE prefix = :prefix AND filename = :filename"
+        ),
+        {"prefix": entry["prefix"], "filename": entry["filename"]},
     )
-    datasets_sample = islice(iatikit.data().datasets, sample)
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
-        future_to_dataset = {
-            executor.submit(load_dataset, dataset): dataset
-            for dataset in datasets_sample
-        }
-        for future in concurrent.futures.as_completed(future_to_dataset):
-            # We have to get the result (even though we don't use it) in order to get the exceptions
-            try:
-                future.result()
-            except Exception as e:
-                dataset = future_to_dataset[future]
-                logger.error(f"Dataset '{dataset.name}' caused error {e}")
 
+def remove_datasets(keys: Iterable[tuple[str, str]]) -> None:
     engine = get_engine()
     with engine.begin() as connection:
-        activity_result = connection.execute(
-            text("SELECT COUNT(*) AS count FROM _raw_activity")
-        ).first()
-        logger.info(
-            f"Loaded {activity_result.count if activity_result else 0} activities into database"
-        )
-        organisation_result = connection.execute(
-            text("SELECT COUNT(*) AS count FROM _raw_organisation")
-        ).first()
-        logger.info(
-            f"Loaded {organisation_result.count if organisation_result else 0} organisations into database"
-        )
+        for prefix, filename in keys:
+            delete_dataset_rows(connection, prefix, filename)
+            connection.execute(
+                text(
+                    "DELETE FROM _dataset_manifest WHERE prefix = :prefix AND filename = :filename"
+                ),
+                {"prefix": prefix, "filename": filename},
+            )
+
+
+@functools.lru_cache
+def get_worker_engine() -> Engine:
+    """
+    Return an engine that is kept for the life of the process, so that the datasets
+    loaded by a worker share its pooled connection.
+    """
+    return get_engine()
+
+
+# Limits on the time taken to load each dataset, and on the memory used by each
+# worker process, so that a single pathological file can't hold up the load. 0
+# means no limit.
+DATASET_TIMEOUT = float(os.environ.get("IATI_TABLES_DATASET_TIMEOUT", 30 * 60))
+WORKER_MEMORY_BYTES = int(os.environ.get("IATI_TABLES_WORKER_MEMORY_BYTES", 0))
+# The alarm in a worker can't interrupt a long call into C, so the parent process
+# kills a worker that is still loading a dataset this long after DATASET_TIMEOUT
+DATASET_KILL_GRACE = 60
+# How often the parent process checks for workers to kill
+WATCHDOG_INTERVAL = 10
+
+# How long to wait for the workers of a broken pool to exit
+WORKER_JOIN_TIMEOUT = 10
+
+# Set in each worker process by init_worker, for report_dataset_start
+dataset_starts: Optional[
+    "multiprocessing.queues.SimpleQueue[tuple[int, int, int]]"
+] = None
+current_task_id: Optional[int] = None
+
+
+class DatasetTimeout(Exception):
+    """
+    Raised in a worker when loading a dataset takes longer than DATASET_TIMEOUT.
+    """
+
+
+@contextlib.contextmanager
+def dataset_time_limit(seconds: Optional[float] = None) -> Iterator[None]:
+    """
+    Raise DatasetTimeout in the block if it runs for longer than ``seconds``, which
+    defaults to DATASET_TIMEOUT.
+
+    The alarm is handled between Python bytecodes, so a single long call into lxml
+    (e.g. the XSLT transform) runs to completion before the timeout is raised. The
+    parent process kills workers that overrun for that reason (see DatasetWatchdog).
+    """
+    if seconds is None:
+        seconds = DATASET_TIMEOUT
+    if not seconds:
+        yield
+        return
+
+    def handle_alarm(signum: int, frame: Any) -> None:
+        raise DatasetTimeout(f"Timed out after {seconds:.0f}s")
+
+    previous_handler = signal.signal(signal.SIGALRM, handle_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def get_failure_reason(e: BaseException) -> str:
+    if isinstance(e, MemoryError):
+        return f"Ran out of memory (limit {WORKER_MEMORY_BYTES} bytes)"
+    return str(e)
+
+
+def init_worker(
+    connect: bool = True,
+    starts: Optional["multiprocessing.queues.SimpleQueue[tuple[int, int, int]]"] = None,
+) -> None:
+    """
+    Set up a worker process before it is given any datasets: limit its memory, open
+    its database connection (unless ``connect`` is False, for staged loads) and
+    build the schema state used to parse and sort them. ``starts`` is the queue of
+    the parent's DatasetWatchdog, if any.
+    """
+    global dataset_starts
+    dataset_starts = starts
+    if WORKER_MEMORY_BYTES:
+        # Going over the limit raises MemoryError in the dataset being loaded,
+        # rather than the worker being killed and breaking the pool
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (WORKER_MEMORY_BYTES, hard_limit))
+    # Connections can't be shared with the parent if the process was forked
+    get_worker_engine.cache_clear()
+    if connect:
+        with get_worker_engine().connect():
+            pass
+    get_schema_order()
+    for filetype in ["activity", "organisation"]:
+        get_xml_schema(filetype)
+        get_schema_decoder(filetype)
+
+
+def report_dataset_start(index: int) -> None:
+    """
+    Tell the parent process that the worker has started loading the dataset at
+    ``index`` in the current task (or the current chunk, which is always 0), so
+    that it can be killed if it takes too long.
+    """
+    if dataset_starts is not None and current_task_id is not None:
+        dataset_starts.put((current_task_id, index, os.getpid()))
+
+
+def reset_worker_engine() -> None:
+    """
+    Close the worker's database connections, so that the next dataset gets a new
+    one, after an error that may have been raised part way through a database call.
+    """
+    get_worker_engine().dispose()
+
+
+@contextlib.contextmanager
+def write_dataset_rows(
+    dataset: iatikit.Dataset,
+    sha1: str,
+    stat: os.stat_result,
+    load_settings: str,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> Iterator[Union[CopyWriter, StagingWriter]]:
+    """
+    Replace the rows for the dataset in the raw tables, or in ``staging_dir`` if it
+    is given, and record the file in the manifest when the block exits. Nothing is
+    kept if the block raises an exception.
+    """
+    entry = get_manifest_entry(dataset, sha1, stat, load_settings)
+    if staging_dir:
+        with StagingWriter(staging_dir, entry) as staging_writer:
+            yield staging_writer
+        return
+    with get_worker_engine().begin() as connection:
+        delete_dataset_rows(connection, entry["prefix"], entry["filename"])
+        with CopyWriter(connection, f"_raw_{dataset.filetype}", RAW_COLUMNS) as writer:
+            yield writer
+        write_manifest_entry(connection, {**entry, "row_count": writer.rows_written})
+
+
+def load_dataset(
+    dataset: iatikit.Dataset,
+    stream: bool = True,
+    decoder: str = DECODER,
+    manifest_sha1: Optional[str] = None,
+    validate: bool = True,
+    staging_dir: Optional[pathlib.Path] = None,
+    sha1: Optional[str] = None,
+) -> int:
+    """
+    Replace the rows for the dataset in the raw tables (or the staging directory),
+    and record the file in the manifest. Returns the number of rows loaded.
+
+    If ``manifest_sha1`` matches the hash of the file, it hasn't changed since it was
+    last loaded, so only its manifest entry is updated. The hash is worked out
+    unless it is given as ``sha1``.
+    """
+    if not dataset.data_path:
+        logger.warn(f"Dataset '{dataset}' not found")
+        return 0
+
+    path = pathlib.Path(dataset.data_path)
+    prefix, filename = dataset_key(dataset.data_path)
+    stat = path.stat()
+    if sha1 is None:
+        sha1 = file_sha1(path)
+    load_settings = get_load_settings(decoder, validate)
+
+    if sha1 == manifest_sha1:
+        logger.debug(f"Dataset '{dataset.name}' is unchanged")
+        with get_worker_engine().begin() as connection:
+            connection.execute(
+                text(
+                    """
+                    UPDATE _dataset_manifest SET size = :size, mtime = :mtime
+                    WHERE prefix = :prefix AND filename = :filename
+                    """
+                ),
+                {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "prefix": prefix,
+                    "filename": filename,
+                },
+            )
+        return 0
+
+    def write_rows() -> int:
+        # The dataset is loaded in a single transaction, so if the XML turns out to
+        # be invalid part way through (when streaming) none of it is kept
+        with write_dataset_rows(
+            dataset, sha1, stat, load_settings, staging_dir
+        ) as writer:
+            for row in iter_raw_rows(
+                dataset,
+                stream,
+                decoder,
+                validate=validate,
+                cache_key=get_parse_cache_key(dataset, sha1, validate),
+                sha1=sha1,
+            ):
+                writer.write(row)
+        return writer.rows_written
+
+    try:
+        try:
+            return write_rows()
+        except CacheReadError as e:
+            # The corrupt entry has been deleted, so this time the dataset is parsed
+            # and cached again
+            logger.warning(f"{e}, parsing dataset '{dataset.name}' again")
+            return write_rows()
+    except DatasetParseError:
+        record_parse_error(dataset, sha1, stat, load_settings, staging_dir)
+        return 0
+
+
+def record_parse_error(
+    dataset: iatikit.Dataset,
+    sha1: str,
+    stat: os.stat_result,
+    load_settings: str,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> None:
+    logger.debug(f"Error parsing XML for dataset '{dataset.name}'")
+    # Record the file anyway, so it isn't parsed again until it changes
+    with write_dataset_rows(dataset, sha1, stat, load_settings, staging_dir):
+        pass
+
+
+# Datasets smaller than this are packed together into tasks of about this size,
+# to spread the cost of sending work to a process over several files
+BATCH_BYTES = 4 * 1024 * 1024
+BATCH_MAX_DATASETS = 100
+
+DatasetTask = list[tuple[iatikit.Dataset, Optional[str]]]
+
+
+def dataset_size(dataset: iatikit.Dataset) -> int:
+    if isinstance(dataset, RegistryDataset):
+        return dataset.size
+    try:
+        return os.path.getsize(dataset.data_path) if dataset.data_path else 0
+    except OSError:
+        return 0
+
+
+def schedule_datasets(
+    datasets: Iterable[tuple[iatikit.Dataset, Optional[str]]],
+    batch_bytes: int = BATCH_BYTES,
+    batch_max_datasets: int = BATCH_MAX_DATASETS,
+) -> list[tuple[int, DatasetTask]]:
+    """
+    Group datasets (with their manifest hashes) into tasks, returned largest first
+    along with their total size in bytes.
+
+    Large datasets get a task each, so that the largest start first rather than
+    being left to run on their own at the end. Small datasets are batched.
+    """
+    sized_datasets = sorted(
+        ((dataset_size(dataset), dataset, sha1) for dataset, sha1 in datasets),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    tasks: list[tuple[int, DatasetTask]] = []
+    batch: DatasetTask = []
+    batch_size = 0
+    for size, dataset, sha1 in sized_datasets:
+        if size >= batch_bytes:
+            tasks.append((size, [(dataset, sha1)]))
+            continue
+        batch.append((dataset, sha1))
+        batch_size += size
+        if batch_size >= batch_bytes or len(batch) >= batch_max_datasets:
+            tasks.append((batch_size, batch))
+            batch = []
+            batch_size = 0
+    if batch:
+        tasks.append((batch_size, batch))
+    return tasks
+
+
+def expected_makespan(task_sizes: Iterable[int], processes: int) -> int:
+    """
+    The largest total size handled by any one process, if each task goes to the
+    least loaded process in order, which is how the process pool hands them out.
+    """
+    loads = [0] * processes
+    for size in task_sizes:
+        heapq.heapreplace(loads, loads[0] + size)
+    return max(loads)
+
+
+# A dataset that went over the time or memory limit: its position in the task,
+# the reason and the time taken in seconds
+TaskFailure = tuple[int, str, float]
+
+# The time taken by a task in seconds, the number of rows it loaded, the cache
+# hits and misses in the worker while it ran, and any datasets that failed
+TaskResult = tuple[float, int, dict[str, int], list[TaskFailure]]
+
+# The result of checking a dataset before splitting it, and its hash if it still
+# needs to be split
+SplitCheckResult = tuple[TaskResult, Optional[str]]
+
+
+def run_load_task(
+    task_id: int,
+    function: Callable[..., Union[TaskResult, SplitCheckResult]],
+    *args: Any,
+) -> Union[TaskResult, SplitCheckResult]:
+    """
+    Run a task in a worker process, with its ID set for report_dataset_start.
+    """
+    global current_task_id
+    current_task_id = task_id
+    try:
+        return function(*args)
+    finally:
+        current_task_id = None
+
+
+def load_dataset_task(
+    task: DatasetTask,
+    stream: bool = True,
+    decoder: str = DECODER,
+    validate: bool = True,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> TaskResult:
+    """
+    Load each dataset in the task, returning the time taken in seconds, the number
+    of rows loaded, the cache counts and the datasets that went over the limits.
+    """
+    start = time.perf_counter()
+    rows = 0
+    failures: list[TaskFailure] = []
+    for index, (dataset, manifest_sha1) in enumerate(task):
+        dataset_rows, failure = load_task_dataset(
+            index, dataset, manifest_sha1, stream, decoder, validate, staging_dir
+        )
+        rows += dataset_rows
+        if failure:
+            failures.append(failure)
+    return time.perf_counter() - start, rows, take_cache_counts(), failures
+
+
+def load_task_dataset(
+    index: int,
+    dataset: iatikit.Dataset,
+    manifest_sha1: Optional[str],
+    stream: bool,
+    decoder: str,
+    validate: bool,
+    staging_dir: Optional[pathlib.Path],
+    sha1: Optional[str] = None,
+) -> tuple[int, Optional[TaskFailure]]:
+    """
+    Load the dataset at ``index`` in a task within the time limit, returning the
+    number of rows loaded and its failure if it went over the limits.
+    """
+    report_dataset_start(index)
+    start = time.perf_counter()
+    try:
+        with dataset_time_limit():
+            return (
+                load_dataset(
+                    dataset,
+                    stream,
+                    decoder,
+                    manifest_sha1,
+                    validate=validate,
+                    staging_dir=staging_dir,
+                    sha1=sha1,
+                ),
+                None,
+            )
+    except (DatasetTimeout, MemoryError) as e:
+        reason = get_failure_reason(e)
+        logger.warning(f"Dataset '{dataset.name}' failed: {reason}")
+        if staging_dir is None:
+            reset_worker_engine()
+        return 0, (index, reason, time.perf_counter() - start)
+    except Exception as e:
+        logger.error(f"Dataset '{dataset.name}' caused error {e}")
+        if staging_dir is None:
+            reset_worker_engine()
+        return 0, None
+
+
+# Datasets at least this big are split into chunks of about SPLIT_CHUNK_BYTES, to
+# be parsed by several workers at once
+SPLIT_DATASET_BYTES = 64 * 1024 * 1024
+SPLIT_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def count_dataset_chunks(dataset: iatikit.Dataset, processes: int) -> int:
+    """
+    Return the number of chunks to split the dataset into, which is 1 if it
+    shouldn't be split.
+    """
+    size = dataset_size(dataset)
+    if processes < 2 or size < SPLIT_DATASET_BYTES:
+        return 1
+    if isinstance(dataset, RegistryDataset):
+        version = dataset.version
+    else:
+        try:
+            version = get_dataset_version(dataset.data_path)
+        except etree.XMLSyntaxError:
+            version = None
+    # Version 1 files are transformed as a whole
+    if not version or version.startswith("1"):
+        return 1
+    return min(processes, math.ceil(size / SPLIT_CHUNK_BYTES))
+
+
+def load_dataset_chunk(
+    dataset: iatikit.Dataset,
+    chunk: tuple[int, int],
+    chunk_path: str,
+    stream: bool = True,
+    decoder: str = DECODER,
+    validate: bool = True,
+    sha1: Optional[str] = None,
+) -> TaskResult:
+    """
+    Parse one chunk of a dataset into a file of COPY rows, returning the time taken
+    in seconds, the number of rows, the cache counts and the chunk's failure if it
+    went over the limits.
+    """
+    report_dataset_start(0)
+    start = time.perf_counter()
+    rows = 0
+    try:
+        with dataset_time_limit(), open(chunk_path, "w", encoding="utf-8") as f:
+            for row in iter_raw_rows(
+                dataset, stream, decoder, chunk, validate, sha1=sha1
+            ):
+                f.write(copy_text_row(row))
+                rows += 1
+    except (DatasetTimeout, MemoryError) as e:
+        reason = get_failure_reason(e)
+        logger.warning(f"Chunk {chunk[0]} of dataset '{dataset.name}' failed: {reason}")
+        seconds = time.perf_counter() - start
+        return seconds, 0, take_cache_counts(), [(0, reason, seconds)]
+    return time.perf_counter() - start, rows, take_cache_counts(), []
+
+
+def check_split_dataset(
+    dataset: iatikit.Dataset,
+    manifest_sha1: Optional[str],
+    stream: bool = True,
+    decoder: str = DECODER,
+    validate: bool = True,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> SplitCheckResult:
+    """
+    Hash a dataset that is to be split into chunks, in a worker rather than the
+    parent process. Unchanged datasets, and those already in the parse cache, are
+    quicker to load whole, so they are loaded here. Returns the result of loading
+    the dataset, and its hash if it still needs to be split instead.
+    """
+    start = time.perf_counter()
+    report_dataset_start(0)
+    sha1 = file_sha1(pathlib.Path(dataset.data_path))
+    cache_key = get_parse_cache_key(dataset, sha1, validate)
+    if sha1 != manifest_sha1 and not (
+        cache_key and get_parse_cache().get_path(cache_key).exists()
+    ):
+        return (time.perf_counter() - start, 0, take_cache_counts(), []), sha1
+    rows, failure = load_task_dataset(
+        0, dataset, manifest_sha1, stream, decoder, validate, staging_dir, sha1
+    )
+    return (
+        time.perf_counter() - start,
+        rows,
+        take_cache_counts(),
+        [failure] if failure else [],
+    ), None
+
+
+def iter_chunk_lines(chunk_paths: list[str]) -> Iterator[str]:
+    """
+    Yield the rows from the chunk files of a dataset, in the order of the
+    activities in the original file.
+    """
+    with contextlib.ExitStack() as stack:
+        chunk_files = [
+            stack.enter_context(open(path, encoding="utf-8")) for path in chunk_paths
+        ]
+        for block in itertools.count():
+            lines = list(
+                islice(chunk_files[block % len(chunk_files)], CHUNK_BLOCK_SIZE)
+            )
+            if not lines:
+                return
+            yield from lines
+
+
+def merge_dataset_chunks(
+    dataset: iatikit.Dataset,
+    sha1: str,
+    chunk_paths: list[str],
+    load_settings: str,
+    parse_failed: bool = False,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> TaskResult:
+    """
+    Replace the rows for the dataset with those from its chunk files, and record
+    the file, with hash ``sha1``, in the manifest. Returns the time taken in
+    seconds, and 0 rows, as the rows were counted when the chunks were parsed.
+    """
+    start = time.perf_counter()
+    stat = pathlib.Path(dataset.data_path).stat()
+    try:
+        if parse_failed:
+            record_parse_error(dataset, sha1, stat, load_settings, staging_dir)
+        else:
+            with write_dataset_rows(
+                dataset, sha1, stat, load_settings, staging_dir
+            ) as writer:
+                for line in iter_chunk_lines(chunk_paths):
+                    writer.write_line(line)
+    finally:
+        for chunk_path in chunk_paths:
+            pathlib.Path(chunk_path).unlink(missing_ok=True)
+    return time.perf_counter() - start, 0, take_cache_counts(), []
+
+
+class LoadTask:
+    """
+    A unit of work for a worker process: a function returning a TaskResult, along
+    with the size in bytes of the data it covers and the datasets that are finished
+    when it is.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        function: Callable[..., Union[TaskResult, SplitCheckResult]],
+        args: tuple[Any, ...],
+        datasets: list[iatikit.Dataset],
+        split: Optional["SplitDataset"] = None,
+        attempts: int = 1,
+    ) -> None:
+        self.size = size
+        self.function = function
+        self.args = args
+        self.datasets = datasets
+        self.split = split
+        self.attempts = attempts
+
+    def get_failed_datasets(self, failures: list[TaskFailure]) -> list[iatikit.Dataset]:
+        if self.split:
+            return [self.split.dataset]
+        return [self.datasets[index] for index, _, _ in failures]
+
+    def with_datasets(self, dataset_task: DatasetTask, attempts: int) -> "LoadTask":
+        _, *args = self.args
+        return LoadTask(
+            sum(dataset_size(dataset) for dataset, _ in dataset_task),
+            self.function,
+            (dataset_task, *args),
+            [dataset for dataset, _ in dataset_task],
+            attempts=attempts,
+        )
+
+    def retry_task(self, failures: list[TaskFailure]) -> "LoadTask":
+        """
+        Return a task to try the datasets that failed again.
+        """
+        if self.split:
+            return LoadTask(
+                self.size,
+                self.function,
+                self.args,
+                self.datasets,
+                self.split,
+                self.attempts + 1,
+            )
+        dataset_task = self.args[0]
+        return self.with_datasets(
+            [dataset_task[index] for index, _, _ in failures], self.attempts + 1
+        )
+
+    def partition(
+        self, index: int
+    ) -> tuple[Optional["LoadTask"], Optional["LoadTask"]]:
+        """
+        Return tasks for the datasets before ``index`` and for the rest, either of
+        which is None if it would have no datasets. Only tasks of whole datasets can
+        be split, so other tasks count as a single dataset.
+        """
+        if self.function is not load_dataset_task:
+            return (self, None) if index else (None, self)
+        dataset_task = self.args[0]
+        return (
+            self.with_datasets(dataset_task[:index], self.attempts) if index else None,
+            self.with_datasets(dataset_task[index:], self.attempts)
+            if index < len(dataset_task)
+            else None,
+        )
+
+
+class SplitDataset:
+    """
+    A large dataset being parsed in chunks by several workers, which is loaded
+    from the chunk files once they have all finished. It is hashed by a worker
+    first, which loads it whole instead if it doesn't need to be parsed again.
+    """
+
+    def __init__(
+        self,
+        dataset: iatikit.Dataset,
+        chunks: int,
+        chunk_dir: pathlib.Path,
+        stream: bool = True,
+        decoder: str = DECODER,
+        validate: bool = True,
+        staging_dir: Optional[pathlib.Path] = None,
+        manifest_sha1: Optional[str] = None,
+    ) -> None:
+        self.dataset = dataset
+        self.manifest_sha1 = manifest_sha1
+        self.sha1: Optional[str] = None
+        self.stream = stream
+        self.decoder = decoder
+        self.validate = validate
+        self.load_settings = get_load_settings(decoder, validate)
+        self.staging_dir = staging_dir
+        prefix, filename = dataset_key(dataset.data_path)
+        self.chunk_paths = [
+            str(chunk_dir / f"{prefix}-{filename}-{chunk}.copy")
+            for chunk in range(chunks)
+        ]
+        self.remaining = chunks
+        self.parse_failed = False
+        self.failed = False
+
+    def check_task(self) -> LoadTask:
+        return LoadTask(
+            dataset_size(self.dataset),
+            check_split_dataset,
+            (
+                self.dataset,
+                self.manifest_sha1,
+                self.stream,
+                self.decoder,
+                self.validate,
+                self.staging_dir,
+            ),
+            [self.dataset],
+            self,
+        )
+
+    def chunk_tasks(self, sha1: str) -> list[LoadTask]:
+        """
+        Return the tasks to parse the chunks of the dataset, once the check task
+        has found it needs parsing and returned its hash.
+        """
+        self.sha1 = sha1
+        chunks = len(self.chunk_paths)
+        return [
+            LoadTask(
+                dataset_size(self.dataset) // chunks,
+                load_dataset_chunk,
+                (
+                    self.dataset,
+                    (chunk, chunks),
+                    chunk_path,
+                    self.stream,
+                    self.decoder,
+                    self.validate,
+                    sha1,
+                ),
+                [],
+                self,
+            )
+            for chunk, chunk_path in enumerate(self.chunk_paths)
+        ]
+
+    def merge_task(self) -> LoadTask:
+        return LoadTask(
+            0,
+            merge_dataset_chunks,
+            (
+                self.dataset,
+                self.sha1,
+                self.chunk_paths,
+                self.load_settings,
+                self.parse_failed,
+                self.staging_dir,
+            ),
+            [self.dataset],
+        )
+
+
+class LoadProgress:
+    """
+    Keep track of how many datasets have been loaded, and periodically log the
+    throughput and an estimate of the time remaining.
+    """
+
+    def __init__(
+        self, total_datasets: int, total_bytes: int, interval: float = 30
+    ) -> None:
+        self.total_datasets = total_datasets
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.datasets = 0
+        self.bytes = 0
+        self.rows = 0
+        self.cache_counts: collections.Counter[str] = collections.Counter()
+        self.start = self.last_logged = time.perf_counter()
+
+    def update(
+        self,
+        datasets: int,
+        bytes: int,
+        rows: int,
+        cache_counts: Optional[dict[str, int]] = None,
+    ) -> None:
+        self.datasets += datasets
+        self.bytes += bytes
+        self.rows += rows
+        if cache_counts:
+            self.cache_counts.update(cache_counts)
+        if time.perf_counter() - self.last_logged >= self.interval:
+            self.log()
+
+    def log(self) -> None:
+        self.last_logged = time.perf_counter()
+        elapsed = self.last_logged - self.start
+        if not elapsed:
+            return
+        # Estimate the time remaining from the bytes left, as dataset sizes vary
+        # so widely
+        bytes_per_second = self.bytes / elapsed
+        remaining_bytes = self.total_bytes - self.bytes
+        eta = (
+            f"{remaining_bytes / bytes_per_second:.0f}s"
+            if bytes_per_second
+            else "unknown"
+        )
+        logger.info(
+            f"Loaded {self.datasets}/{self.total_datasets} datasets: "
+            f"{self.datasets / elapsed:.1f} datasets/s, {self.rows / elapsed:.0f} activities/s, "
+            f"{bytes_per_second / 1e6:.1f} MB/s, ETA {eta}"
+        )
+        if self.cache_counts:
+            logger.info(
+                "Cache counts: "
+                + ", ".join(
+                    f"{count} {name}"
+                    for name, count in sorted(self.cache_counts.items())
+                )
+            )
+
+
+# Workers are replaced after this many tasks, to stop memory held by lxml and
+# xmlschema growing over a long run
+MAX_TASKS_PER_CHILD = 50
+
+
+IN_FLIGHT_TASKS_PER_PROCESS = 2
+
+# Datasets that go over the time or memory limits are tried this many times before
+# being recorded in _load_failures
+MAX_DATASET_ATTEMPTS = 2
+
+
+def create_executor(
+    processes: int,
+    max_tasks_per_child: Optional[int] = MAX_TASKS_PER_CHILD,
+    connect: bool = True,
+    starts: Optional["multiprocessing.queues.SimpleQueue[tuple[int, int, int]]"] = None,
+) -> concurrent.futures.ProcessPoolExecutor:
+    if sys.version_info >= (3, 11):
+        if max_tasks_per_child:
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=init_worker,
+                initargs=(connect, starts),
+                max_tasks_per_child=max_tasks_per_child,
+            )
+    elif max_tasks_per_child:
+        logger.debug("Worker recycling needs Python 3.11 or later")
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, initializer=init_worker, initargs=(connect, starts)
+    )
+
+
+class DatasetWatchdog:
+    """
+    Keep track of the dataset that each running task is loading, and the worker
+    loading it, from the reports sent by report_dataset_start. The parent process
+    uses these to kill workers that are stuck on one for longer than ``timeout``
+    seconds (0 means no limit), and to find the tasks that a worker was running
+    when it died.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        # Reports are written straight to the pipe, rather than by a thread, so
+        # they aren't lost if the worker dies just after sending one
+        self.starts: "multiprocessing.queues.SimpleQueue[tuple[int, int, int]]" = (
+            multiprocessing.SimpleQueue()
+        )
+        self.running: set[int] = set()
+        # The index, start time and worker process ID of each task's current dataset
+        self.started: dict[int, tuple[int, float, int]] = {}
+        self.killed: set[int] = set()
+
+    def add(self, task_id: int) -> None:
+        self.running.add(task_id)
+
+    def update(self) -> None:
+        while not self.starts.empty():
+            task_id, index, pid = self.starts.get()
+            # Reports can arrive after the task's result
+            if task_id in self.running:
+                self.started[task_id] = (index, time.perf_counter(), pid)
+
+    def finish(self, task_id: int) -> Optional[tuple[int, float, int]]:
+        """
+        Stop tracking the task, returning the index of the dataset it was loading,
+        for how long and the ID of the worker process loading it, or None if it
+        hadn't reported starting one.
+        """
+        self.running.discard(task_id)
+        self.killed.discard(task_id)
+        started = self.started.pop(task_id, None)
+        if started is None:
+            return None
+        index, start, pid = started
+        return index, time.perf_counter() - start, pid
+
+    def find_tasks(self, pids: set[int]) -> set[int]:
+        """
+        Return the IDs of the tasks that were loading a dataset in the worker
+        processes with IDs in ``pids``.
+        """
+        return {task_id for task_id, (_, _, pid) in self.started.items() if pid in pids}
+
+    def wait_timeout(self) -> Optional[float]:
+        """
+        Return how long to wait for tasks to finish before checking them again.
+        """
+        if not self.timeout:
+            return None
+        now = time.perf_counter()
+        deadline = min(
+            [
+                start + self.timeout
+                for task_id, (_, start, _) in self.started.items()
+                if task_id not in self.killed
+            ],
+            default=now + WATCHDOG_INTERVAL,
+        )
+        return max(min(deadline - now, WATCHDOG_INTERVAL), 0)
+
+    def kill_overrunning(self) -> set[int]:
+        """
+        Kill the workers that have been loading a dataset for too long, returning
+        the IDs of their tasks.
+        """
+        killed = set()
+        now = time.perf_counter()
+        for task_id, (index, start, pid) in self.started.items():
+            if task_id in self.killed:
+                continue
+            if self.timeout and now - start >= self.timeout:
+                logger.warning(
+                    f"Killing worker {pid}, which has been loading dataset {index} of "
+                    f"a task for {now - start:.0f}s"
+                )
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                killed.add(task_id)
+        self.killed |= killed
+        return killed
+
+
+def get_dead_worker_pids(
+    executor: concurrent.futures.ProcessPoolExecutor,
+) -> set[int]:
+    """
+    Return the IDs of the worker processes that died and broke the pool. The pool
+    terminates the rest of them once it is broken, so those aren't included.
+    """
+    processes = list((executor._processes or {}).items())
+    for _, process in processes:
+        # A worker's exit code can't be read until it has been reaped, which may
+        # be just after the pool finds it has died
+        process.join(WORKER_JOIN_TIMEOUT)
+    return {
+        pid
+        for pid, process in processes
+        if process.exitcode not in (None, 0, -signal.SIGTERM)
+    }
+
+
+def run_load_tasks(
+    tasks: list[LoadTask],
+    processes: int,
+    progress: LoadProgress,
+    max_tasks_per_child: Optional[int] = MAX_TASKS_PER_CHILD,
+    staging_dir: Optional[pathlib.Path] = None,
+) -> list[float]:
+    """
+    Run the tasks on a pool of ``processes`` worker processes, retrying and then
+    recording the datasets that fail, and return the time taken by each task in
+    seconds.
+
+    Workers stuck on a dataset for DATASET_KILL_GRACE seconds after DATASET_TIMEOUT
+    are killed. That breaks the pool, as does a worker dying some other way, so it
+    is replaced. The dataset each dead worker was loading counts as a failed attempt,
+    and the datasets that the other tasks in flight hadn't finished are loaded again.
+    """
+    # Only keep a few tasks per process queued at once, rather than pickling and
+    # holding a future for every one of them up front
+    window = processes * IN_FLIGHT_TASKS_PER_PROCESS
+    pending_tasks = collections.deque(tasks)
+    in_flight: dict[concurrent.futures.Future, tuple[int, LoadTask]] = {}
+    task_ids = itertools.count()
+    watchdog = DatasetWatchdog(
+        DATASET_TIMEOUT + DATASET_KILL_GRACE if DATASET_TIMEOUT else 0
+    )
+    killed: set[int] = set()
+    # The tasks that were running on the workers that died, once the pool is broken
+    blamed: Optional[set[int]] = None
+    # How many times in a row the pool has broken without any task to blame
+    unexplained_breaks = 0
+    pool_broken = False
+    task_seconds = []
+    connect = staging_dir is None
+    executor = create_executor(processes, max_tasks_per_child, connect, watchdog.starts)
+    try:
+        while True:
+            if pool_broken and not in_flight:
+                # All the tasks lost with the broken pool have been requeued
+                executor.shutdown()
+                executor = create_executor(
+                    processes, max_tasks_per_child, connect, watchdog.starts
+                )
+                killed = set()
+                blamed = None
+                pool_broken = False
+            while not pool_broken and pending_tasks and len(in_flight) < window:
+                task = pending_tasks.popleft()
+                task_id = next(task_ids)
+                watchdog.add(task_id)
+                future = executor.submit(
+                    run_load_task, task_id, task.function, *task.args
+                )
+                in_flight[future] = task_id, task
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                timeout=watchdog.wait_timeout(),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            watchdog.update()
+            if not done:
+                # Killing a worker breaks the pool, so the results of all the tasks
+                # in flight come back as BrokenProcessPool errors
+                newly_killed = watchdog.kill_overrunning()
+                killed |= newly_killed
+                pool_broken = pool_broken or bool(newly_killed)
+                continue
+            for future in done:
+                task_id, task = in_flight.pop(future)
+                if blamed is None and isinstance(
+                    future.exception(), concurrent.futures.process.BrokenProcessPool
+                ):
+                    pool_broken = True
+                    blamed = killed | watchdog.find_tasks(
+                        get_dead_worker_pids(executor)
+                    )
+                    if blamed:
+                        unexplained_breaks = 0
+                    else:
+                        unexplained_breaks += 1
+                        logger.error(
+                            "A worker process died while not loading a dataset, so "
+                            "the tasks in flight will be loaded again"
+                        )
+                started = watchdog.finish(task_id)
+                rows = 0
+                counts: dict[str, int] = {}
+                failures: list[TaskFailure] = []
+                # We have to get the result in order to get the exceptions
+                try:
+                    result: Any = future.result()
+                    if task.split and task.function is check_split_dataset:
+                        result, sha1 = result
+                        if sha1 is not None:
+                            # The chunks and the merge count towards the progress
+                            task_seconds.append(result[0])
+                            logger.info(
+                                f"Splitting dataset '{task.split.dataset.name}' "
+                                f"into {len(task.split.chunk_paths)} chunks"
+                            )
+                            pending_tasks.extendleft(
+                                reversed(task.split.chunk_tasks(sha1))
+                            )
+                            continue
+                    seconds, rows, counts, failures = result
+                    task_seconds.append(seconds)
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    if started is None or task_id not in (blamed or set()):
+                        if unexplained_breaks > MAX_DATASET_ATTEMPTS:
+                            # Loading the same tasks again keeps breaking the pool
+                            for dataset in task.datasets:
+                                logger.error(
+                                    f"Dataset '{dataset.name}' caused error {e}"
+                                )
+                            if task.split:
+                                task.split.failed = True
+                        else:
+                            # Lost along with another worker, so load whatever it
+                            # hadn't finished again, without counting an attempt
+                            finished_task, rest = task.partition(
+                                started[0] if started else 0
+                            )
+                            if rest:
+                                pending_tasks.appendleft(rest)
+                            if finished_task:
+                                progress.update(
+                                    len(finished_task.datasets),
+                                    finished_task.size,
+                                    0,
+                                    {},
+                                )
+                            continue
+                    else:
+                        index, failed_seconds, _ = started
+                        reason = (
+                            f"Timed out after {failed_seconds:.0f}s, so the worker was killed"
+                            if task_id in killed
+                            else "Worker process died"
+                        )
+                        # Load the datasets after the failed one again
+                        failed_task, rest = task.partition(index + 1)
+                        if rest:
+                            pending_tasks.appendleft(rest)
+                        task = failed_task or task
+                        failures = [(index, reason, failed_seconds)]
+                except Exception as e:
+                    task_split = task.split
+                    if task_split is None:
+                        for dataset in task.datasets:
+                            logger.error(f"Dataset '{dataset.name}' caused error {e}")
+                    elif isinstance(e, DatasetParseError):
+                        task_split.parse_failed = True
+                    else:
+                        task_split.failed = True
+                        logger.error(
+                            f"Dataset '{task_split.dataset.name}' caused error {e}"
+                        )
+                if failures and task.attempts < MAX_DATASET_ATTEMPTS:
+                    # Retry at the back of the queue, so the rest of the pool
+                    # keeps making progress in the meantime
+                    retry_task = task.retry_task(failures)
+                    pending_tasks.append(retry_task)
+                    progress.update(
+                        len(task.datasets) - len(retry_task.datasets),
+                        task.size - retry_task.size,
+                        rows,
+                        counts,
+                    )
+                    continue
+                for dataset, (_, reason, failed_seconds) in zip(
+                    task.get_failed_datasets(failures), failures
+                ):
+                    record_load_failure(
+                        dataset, reason, task.attempts, failed_seconds, staging_dir
+                    )
+                    if task.split:
+                        task.split.failed = True
+                progress.update(len(task.datasets), task.size, rows, counts)
+                if task.split and task.function is not check_split_dataset:
+                    task.split.remaining -= 1
+                    # Load the dataset as soon as all its chunks are parsed
+                    if not task.split.remaining and not task.split.failed:
+                        pending_tasks.appendleft(task.split.merge_task())
+    finally:
+        executor.shutdown()
+    return task_seconds
+
+
+def in_shard(dataset: iatikit.Dataset, shard: tuple[int, int]) -> bool:
+    """
+    Return whether the dataset belongs to shard ``(index, count)``. Datasets are
+    assigned by a hash of their prefix and filename, so every node running a
+    shard of the same registry agrees on which datasets are in which shard.
+    """
+    index, count = shard
+    prefix, filename = dataset_key(dataset.data_path)
+    digest = hashlib.sha1(f"{prefix}/{filename}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index
+
+
+def prepare_database(
+    keep_tables: bool, resume: bool, decoder: str, validate: bool
+) -> datetime.datetime:
+    """
+    Create the tables for a load, dropping them first unless ``keep_tables`` is
+    set, and return when the load started, which is when the interrupted load
+    started if resuming one.
+    """
+    create_database_schema(drop=not keep_tables)
+    create_raw_tables(drop=not keep_tables)
+    create_dataset_manifest(drop=not keep_tables)
+    create_load_metadata(drop=not keep_tables)
+    create_load_failures(drop=not keep_tables)
+
+    unfinished_load = get_unfinished_load() if resume else None
+    if unfinished_load:
+        started_at, unfinished_validate = unfinished_load
+        logger.info(f"Resuming load started at {started_at}")
+        if unfinished_validate != validate:
+            logger.warning(
+                f"Resuming a load with validate={unfinished_validate} "
+                f"using validate={validate}"
+            )
+        # Remove chunks left behind by the interrupted load
+        for path in get_cache_dir().glob("chunks-*"):
+            shutil.rmtree(path, ignore_errors=True)
+        return started_at
+    if resume:
+        logger.info("No unfinished load to resume, loading changed datasets")
+    return start_load_metadata(keep_tables, decoder, validate)
+
+
+def load_datasets(
+    processes: int,
+    sample: Optional[int] = None,
+    stream: bool = True,
+    decoder: str = DECODER,
+    incremental: bool = False,
+    max_tasks_per_child: Optional[int] = MAX_TASKS_PER_CHILD,
+    split: bool = True,
+    validate: bool = True,
+    resume: bool = False,
+    shard: Optional[tuple[int, int]] = None,
+    staging_dir: Optional[Union[str, pathlib.Path]] = None,
+) -> None:
+    """
+    Load datasets from the registry into the raw tables.
+
+    If ``incremental`` is set, the existing raw tables are kept, and only datasets
+    that have been added, changed or removed since the last load are updated.
+    Otherwise everything is dropped and loaded from scratch.
+
+    If ``split`` is set, large datasets are parsed in chunks by several workers.
+
+    If ``validate`` is not set, schema validation errors aren't collected, which is
+    faster but leaves the error column empty. This is recorded in _load_metadata.
+
+    If ``resume`` is set, an interrupted load is carried on from where it stopped.
+    Each dataset is committed along with its manifest entry, so the manifest acts
+    as a checkpoint: the raw tables are kept, and only datasets that aren't in the
+    manifest (or have changed since) are loaded.
+
+    If ``staging_dir`` is given, rows are written to files there instead of the
+    database, to be loaded later with load_staged_datasets. ``shard`` is a pair
+    ``(index, count)`` which restricts the load to one of ``count`` shards of the
+    registry, numbered from 0, so that each can be staged on a different machine.
+    """
+    keep_tables = incremental or resume
+    if shard and not 0 <= shard[0] < shard[1]:
+        raise ValueError(f"Invalid shard {shard}")
+    if staging_dir is None:
+        if shard:
+            raise ValueError("Sharded loads must be written to a staging directory")
+        started_at = prepare_database(keep_tables, resume, decoder, validate)
+    else:
+        if keep_tables:
+            raise ValueError("Incremental and resumed loads can't be staged")
+        staging_dir = pathlib.Path(staging_dir)
+        clear_staging_dir(staging_dir)
+        started_at = datetime.datetime.utcnow()
+
+    datasets = get_registry_index().datasets[:sample]
+    if shard:
+        datasets = [dataset for dataset in datasets if in_shard(dataset, shard)]
+        logger.info(f"Shard {shard[0]} of {shard[1]} has {len(datasets)} datasets")
+    if keep_tables:
+        changed_datasets, removed_keys = find_changed_datasets(
+            datasets, get_dataset_manifest(), get_load_settings(decoder, validate)
+        )
+        # With a sample, datasets outside it haven't necessarily been removed
+        if sample is None:
+            logger.info(f"Removing {len(removed_keys)} datasets from database")
+            remove_datasets(removed_keys)
+        logger.info(
+            f"Loading {len(changed_datasets)} new or changed datasets of {len(datasets)} into database"
+        )
+    else:
+        changed_datasets = [(dataset, None) for dataset in datasets]
+        logger.info(f"Loading {len(datasets)} datasets into database")
+
+    chunk_dir = None
+    whole_datasets = []
+    tasks = []
+    for dataset, manifest_sha1 in changed_datasets:
+        chunks = count_dataset_chunks(dataset, processes) if split else 1
+        if chunks > 1:
+            if chunk_dir is None:
+                get_cache_dir().mkdir(parents=True, exist_ok=True)
+                chunk_dir = pathlib.Path(
+                    tempfile.mkdtemp(prefix="chunks-", dir=get_cache_dir())
+                )
+            # Hashed by a worker, which decides whether it still needs splitting
+            split_dataset = SplitDataset(
+                dataset,
+                chunks,
+                chunk_dir,
+                stream,
+                decoder,
+                validate,
+                staging_dir,
+                manifest_sha1,
+            )
+            tasks.append(split_dataset.check_task())
+        else:
+            whole_datasets.append((dataset, manifest_sha1))
+    tasks.extend(
+        LoadTask(
+            size,
+            load_dataset_task,
+            (task, stream, decoder, validate, staging_dir),
+            [dataset for dataset, _ in task],
+        )
+        for size, task in schedule_datasets(whole_datasets)
+    )
+    tasks.sort(key=lambda task: task.size, reverse=True)
+
+    total_bytes = sum(task.size for task in tasks)
+    expected_bytes = expected_makespan((task.size for task in tasks), processes)
+    ideal_bytes = total_bytes / processes
+    logger.info(
+        f"Scheduled {len(changed_datasets)} datasets ({total_bytes / 1e6:.0f} MB) as {len(tasks)} tasks, "
+        f"expected makespan is {expected_bytes / ideal_bytes if ideal_bytes else 1:.2f}x the ideal"
+    )
+
+    progress = LoadProgress(len(changed_datasets), total_bytes)
+    start = time.perf_counter()
+    try:
+        task_seconds = run_load_tasks(
+            tasks, processes, progress, max_tasks_per_child, staging_dir
+        )
+    finally:
+        if chunk_dir is not None:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+    progress.log()
+    parse_cache = get_parse_cache()
+    if parse_cache.enabled:
+        parse_cache.evict()
+
+    if task_seconds:
+        # Estimate the expected makespan in seconds from the overall throughput
+        busy_seconds = sum(task_seconds)
+        seconds_per_byte = busy_seconds / total_bytes if total_bytes else 0
+        logger.info(
+            f"Loaded datasets in {time.perf_counter() - start:.1f}s: "
+            f"expected makespan {expected_bytes * seconds_per_byte:.1f}s, "
+            f"ideal {busy_seconds / processes:.1f}s, "
+            f"longest task {max(task_seconds):.1f}s"
+        )
+
+    if staging_dir is not None:
+        write_staged_metadata(
+            staging_dir,
+            {
+                "started_at": started_at.isoformat(),
+                "finished_at": datetime.datetime.utcnow().isoformat(),
+                "datasets": len(changed_datasets),
+                "decoder": decoder,
+                "validated": validate,
+                "shard": shard,
+            },
+        )
+        logger.info(f"Staged {progress.rows} rows in {staging_dir}")
+        return
+
+    record_load_metadata(started_at, len(changed_datasets), validate)
+
+    engine = get_engine()
+    with engine.begin() as connection:
+        activity_result = connection.execute(
+            text("SELECT COUNT(*) AS count FROM _raw_activity")
+        ).first()
+        logger.info(
+            f"Loaded {activity_result.count if activity_result else 0} activities into database"
+        )
+        organisation_result = connection.execute(
+            text("SELECT COUNT(*) AS count FROM _raw_organisation")
+        ).first()
+        logger.info(
+            f"Loaded {organisation_result.count if organisation_result else 0} organisations into database"
+        )
+
+
+# Staged datasets are copied into the database in batches of about this many
+# compressed bytes, so that small files share a transaction
+STAGED_BATCH_BYTES = 16 * 1024 * 1024
+
+# The size of each read when streaming a staged file into COPY
+STAGED_COPY_BUFFER_BYTES = 1024 * 1024
+
+StagedBatch = list[tuple[dict[str, Any], pathlib.Path]]
+
+
+def batch_staged_datasets(staging_dirs: Iterable[pathlib.Path]) -> list[StagedBatch]:
+    """
+    Group the staged datasets into batches of about STAGED_BATCH_BYTES, with the
+    largest datasets first, so that they don't hold up the end of the load.
+    """
+    sized_datasets = []
+    for staging_dir in staging_dirs:
+        for entry, rows_path in iter_staged_datasets(staging_dir):
+            size = rows_path.stat().st_size if entry["row_count"] else 0
+            sized_datasets.append((size, entry, rows_path))
+    sized_datasets.sort(key=lambda sized_dataset: sized_dataset[0], reverse=True)
+
+    batches: list[StagedBatch] = []
+    batch: StagedBatch = []
+    batch_size = 0
+    for size, entry, rows_path in sized_datasets:
+        if batch and batch_size + size > STAGED_BATCH_BYTES:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append((entry, rows_path))
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def copy_staged_dataset(
+    connection: Connection,
+    entry: dict[str, Any],
+    rows_path: pathlib.Path,
+    replace: bool = True,
+) -> None:
+    """
+    Copy the rows of a staged dataset into its raw table, and record the file in
+    the manifest. The file is streamed into COPY as it is decompressed, without
+    being split into rows.
+
+    If ``replace`` is set, any existing rows for the file are deleted first.
+    """
+    if replace:
+        delete_dataset_rows(connection, entry["prefix"], entry["filename"])
+    if entry["row_count"]:
+        with contextlib.closing(
+            connection.connection.cursor()
+        ) as cursor, open_staged_rows(rows_path) as f:
+            cursor.copy_expert(
+                f"COPY _raw_{entry['filetype']} ({', '.join(RAW_COLUMNS)}) FROM STDIN",
+                f,
+                size=STAGED_COPY_BUFFER_BYTES,
+            )
+    write_manifest_entry(connection, entry)
+
+
+def load_staged_task(batch: StagedBatch, replace: bool) -> tuple[float, int]:
+    """
+    Copy a batch of staged datasets into the database in one transaction,
+    returning the time taken in seconds and the number of rows.
+    """
+    start = time.perf_counter()
+    with get_worker_engine().begin() as connection:
+        for entry, rows_path in batch:
+            copy_staged_dataset(connection, entry, rows_path, replace)
+    return time.perf_counter() - start, sum(entry["row_count"] for entry, _ in batch)
+
+
+def init_staged_worker() -> None:
+    # Connections can't be shared with the parent if the process was forked
+    get_worker_engine.cache_clear()
+
+
+def drop_raw_indexes() -> None:
+    engine = get_engine()
+    with engine.begin() as connection:
+        for filetype in ["activity", "organisation"]:
+            connection.execute(
+                text(f"DROP INDEX IF EXISTS _raw_{filetype}_prefix_filename")
+            )
+
+
+def load_staged_datasets(
+    staging_dirs: Iterable[Union[str, pathlib.Path]],
+    incremental: bool = False,
+    processes: int = 5,
+) -> None:
+    """
+    Load the datasets staged by load_datasets, e.g. a staging directory from each
+    shard, into the raw tables, using ``processes`` database connections at once.
+
+    If ``incremental`` is set, the existing raw tables are kept, and the staged
+    datasets replace the rows for those files. Otherwise the tables are created
+    afresh, and their indexes are built once all the rows have been copied.
+    """
+    staging_paths = [pathlib.Path(staging_dir) for staging_dir in staging_dirs]
+    metadata = []
+    for staging_dir in staging_paths:
+        staged_metadata = read_staged_metadata(staging_dir)
+        if staged_metadata is None:
+            raise ValueError(f"The load into {staging_dir} hasn't finished")
+        metadata.append(staged_metadata)
+    validate = all(staged_metadata["validated"] for staged_metadata in metadata)
+    decoder = ",".join(
+        sorted({staged_metadata["decoder"] for staged_metadata in metadata})
+    )
+    started_at = prepare_database(incremental, False, decoder, validate)
+    if not incremental:
+        drop_raw_indexes()
+
+    batches = batch_staged_datasets(staging_paths)
+    datasets = sum(len(batch) for batch in batches)
+    logger.info(
+        f"Loading {datasets} staged datasets from {len(staging_paths)} directories "
+        f"as {len(batches)} batches"
+    )
+    start = time.perf_counter()
+    rows = 0
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, initializer=init_staged_worker
+    ) as executor:
+        futures = [
+            executor.submit(load_staged_task, batch, incremental) for batch in batches
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            _, batch_rows = future.result()
+            rows += batch_rows
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Copied {rows} rows in {seconds:.1f}s "
+        f"({rows / seconds if seconds else 0:.0f} rows/s)"
+    )
+
+    if not incremental:
+        start = time.perf_counter()
+        create_raw_tables(drop=False)
+        logger.info(f"Built indexes in {time.perf_counter() - start:.1f}s")
+
+    engine = get_engine()
+    with engine.begin() as connection:
+        for staging_dir in staging_paths:
+            for failure in iter_staged_failures(staging_dir):
+                write_load_failure(connection, failure)
+    record_load_metadata(started_at, datasets, validate)
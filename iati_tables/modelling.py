@@ -1,28 +1,41 @@
+import concurrent.futures
 import functools
 import json
 import logging
+import math
+import os
 import pathlib
-from collections import defaultdict
+import re
+import time
+from collections import Counter, defaultdict
 from datetime import datetime
 from io import StringIO
-from typing import Any, Iterator
+from typing import Any, Iterator, Optional, Sequence
 
-import iatikit
 import requests
-from sqlalchemy import column, insert, table, text
+from sqlalchemy import Connection, column, insert, table, text
 
+from iati_tables import serialize
 from iati_tables.database import (
+    CopyWriter,
     _create_table,
+    copy_text_row,
     create_field_sql,
     create_table,
     get_engine,
 )
 from iati_tables.load import IATISchemaWalker
+from iati_tables.pipeline import run_pipeline
+from iati_tables.registry import get_registry_index
 
 logger = logging.getLogger(__name__)
 
+# The clock used to time the rate logging, patched in tests
+clock = time.perf_counter
 
-ALL_CODELIST_LOOKUP = {}
+
+# The names of codelist values, by the path of the field they are used in
+CODELIST_LOOKUP: dict[tuple[str, ...], dict[str, str]] = {}
 
 
 def get_codelists_lookup():
@@ -60,14 +73,31 @@ def get_codelists_lookup():
         for path in paths:
             for codelist_value, info in data.items():
                 value_name = info.get("name", codelist_value)
-                ALL_CODELIST_LOOKUP[(path, codelist_value)] = value_name
+                CODELIST_LOOKUP.setdefault(path, {})[codelist_value] = value_name
+
+    # Plans compiled before now won't have the codelists
+    get_flatten_plan.cache_clear()
+
+
+class KeyNames(dict[str, str]):
+    """
+    The keys of decoded objects with hyphens removed, memoised as there are only
+    as many distinct keys as there are elements and attributes in the standard.
+    """
+
+    def __missing__(self, key: str) -> str:
+        name = self[key] = key.replace("-", "")
+        return name
+
+
+KEY_NAMES = KeyNames()
 
 
 def traverse_object(
     obj: dict[str, Any], emit_object: bool, full_path=tuple(), no_index_path=tuple()
 ) -> Iterator[tuple[dict[str, Any], tuple[Any, ...], tuple[str, ...]]]:
     for original_key, value in list(obj.items()):
-        key = original_key.replace("-", "")
+        key = KEY_NAMES[original_key]
 
         if key == "narrative":
             # Old narrative format, kept for backwards compatibility reasons
@@ -114,59 +144,137 @@ def traverse_object(
             )
 
     if obj and emit_object:
-        new_object = {key.replace("-", ""): value for key, value in obj.items()}
+        new_object = {KEY_NAMES[key]: value for key, value in obj.items()}
         yield new_object, full_path, no_index_path
 
 
-@functools.lru_cache(1000)
+@functools.lru_cache(maxsize=None)
+def get_path_templates(
+    shape: tuple[Optional[str], ...], filetype: str
+) -> tuple[str, tuple[str, ...], tuple[str, ...], str]:
+    """
+    Return format strings for the object key and parent keys of paths with this
+    shape (a full path with its array indices replaced by None), along with the
+    parent keys without indices and the object type.
+
+    Shapes don't include indices, so there are only as many as there are paths
+    in the standard, and they are cached without a bound.
+    """
+    key_templates = []
+    keys_no_index = []
+    for num, part in enumerate(shape):
+        if part is None:
+            key_templates.append(
+                ".".join(
+                    "{}" if key is None else key.replace("{", "{{").replace("}", "}}")
+                    for key in shape[: num + 1]
+                )
+            )
+            keys_no_index.append(
+                "_".join(key for key in shape[: num + 1] if key is not None)
+            )
+    object_key_template = key_templates[-1] if key_templates else ""
+    object_type = "_".join(key for key in shape if key is not None) or filetype
+    return (
+        object_key_template,
+        tuple(key_templates[:-1]),
+        tuple(keys_no_index[:-1]),
+        object_type,
+    )
+
+
 def path_info(
-    full_path: tuple[str | int, ...], no_index_path: tuple[str, ...], filetype: str
+    full_path: tuple[str | int, ...], filetype: str
 ) -> tuple[str, list[str], list[str], str, tuple[dict[str, str], ...]]:
-    all_paths = []
-    for num, part in enumerate(full_path):
-        if isinstance(part, int):
-            all_paths.append(full_path[: num + 1])
+    """
+    Return the object key, parent keys, parent keys without indices, object type
+    and parent keys by name of an object at ``full_path``.
+
+    Full paths include array indices, so they aren't cached. The work is done by
+    get_path_templates, which caches by the shape of the path, and the indices are
+    then formatted into its templates.
+    """
+    shape = tuple([None if isinstance(part, int) else part for part in full_path])
+    indices = [part for part in full_path if isinstance(part, int)]
+    (
+        object_key_template,
+        parent_key_templates,
+        parent_keys_no_index,
+        object_type,
+    ) = get_path_templates(shape, filetype)
+
+    object_key = object_key_template.format(*indices)
+    parent_keys_list = [template.format(*indices) for template in parent_key_templates]
+    parent_keys = (dict(zip(parent_keys_no_index, parent_keys_list)),)
+    return (
+        object_key,
+        parent_keys_list,
+        list(parent_keys_no_index),
+        object_type,
+        parent_keys,
+    )
 
-    parent_paths = all_paths[:-1]
-    path_key = all_paths[-1] if all_paths else []
 
-    object_key = ".".join(str(key) for key in path_key)
-    parent_keys_list = [
-        ".".join(str(key) for key in parent_path) for parent_path in parent_paths
-    ]
-    parent_keys_no_index = [
-        "_".join(str(key) for key in parent_path if not isinstance(key, int))
-        for parent_path in parent_paths
-    ]
-    object_type = "_".join(str(key) for key in no_index_path) or filetype
-    parent_keys = (dict(zip(parent_keys_no_index, parent_keys_list)),)
-    return object_key, parent_keys_list, parent_keys_no_index, object_type, parent_keys
+# The column name, codelist name column, codelist and value plan of a key
+FlattenKey = tuple[str, str, Optional[dict[str, str]], "FlattenPlan"]
+
+
+class FlattenPlan(dict[str, FlattenKey]):
+    """
+    How to flatten the keys of objects at a path into columns. Each key maps to
+    its column name, the column for the names of its codelist values, its
+    codelist (if it has one), and the plan for its value if that is an object.
+
+    Keys are compiled the first time they are seen, so flattening an object is
+    mostly dict lookups rather than building strings for every key.
+    """
+
+    def __init__(self, prefix: str, no_index_path: tuple[str, ...]) -> None:
+        self.prefix = prefix
+        self.no_index_path = no_index_path
+
+    def __missing__(self, key: str) -> FlattenKey:
+        no_index_path = self.no_index_path + (key,)
+        name = key.replace("-", "")
+        name = name.replace("@{http://www.w3.org/XML/1998/namespace}", "")
+        name = name.replace("@", "")
+        if name != "$":
+            column = f"{self.prefix}{name}"
+        elif self.prefix:
+            column = self.prefix[:-1]
+        else:
+            column = "_"
+        entry = self[key] = (
+            column,
+            f"{self.prefix}{name}name",
+            CODELIST_LOOKUP.get(no_index_path),
+            FlattenPlan(f"{self.prefix}{name}_", no_index_path),
+        )
+        return entry
+
+
+@functools.lru_cache(maxsize=None)
+def get_flatten_plan(current_path: str, no_index_path: tuple[str, ...]) -> FlattenPlan:
+    return FlattenPlan(current_path, no_index_path)
 
 
 def flatten_object(obj, current_path="", no_index_path=tuple()):
-    for key, value in list(obj.items()):
-        new_no_index_path = no_index_path + (key,)
+    return flatten_with_plan(obj, get_flatten_plan(current_path, no_index_path))
 
-        key = key.replace("-", "")
-        key = key.replace("@{http://www.w3.org/XML/1998/namespace}", "")
-        key = key.replace("@", "")
+
+def flatten_with_plan(
+    obj: dict[str, Any], plan: FlattenPlan
+) -> Iterator[tuple[str, Any]]:
+    for key, value in obj.items():
+        column, codelist_column, codelist, value_plan = plan[key]
         if isinstance(value, dict):
-            yield from flatten_object(value, f"{current_path}{key}_", new_no_index_path)
+            yield from flatten_with_plan(value, value_plan)
         else:
-            if isinstance(value, str):
-                codelist_value_name = ALL_CODELIST_LOOKUP.get(
-                    (new_no_index_path, value)
-                )
+            if codelist is not None and isinstance(value, str):
+                codelist_value_name = codelist.get(value)
                 if codelist_value_name:
-                    yield f"{current_path}{key}name", codelist_value_name
-
-            if key == "$":
-                if current_path:
-                    yield f"{current_path}"[:-1], value
-                else:
-                    yield "_", value
-            else:
-                yield f"{current_path}{key}", value
+                    yield codelist_column, codelist_value_name
+            yield column, value
 
 
 DATE_MAP = {
@@ -179,23 +287,78 @@ DATE_MAP = {
 DATE_MAP_BY_FIELD = {value: int(key) for key, value in DATE_MAP.items()}
 
 
+DATE_RE = r"^(\d{4})-(\d{2})-(\d{2})$"
+DATETIME_RE = r"^(\d{4})-(\d{2})-(\d{2})([T ](\d{2}):(\d{2}):(\d{2}(?:\.\d*)?)((-(\d{2}):(\d{2})|Z)?))?$"
+
+
+# The same patterns for Python. They are matched against the whole string, as
+# "$" in Python would also match before a trailing newline, and with \d only
+# matching ASCII digits, as in PostgreSQL.
+DATE_PATTERN = re.compile(DATE_RE[1:-1], re.ASCII)
+DATETIME_PATTERN = re.compile(DATETIME_RE[1:-1], re.ASCII)
+
+
+def get_value_type(value: Any) -> str:
+    """
+    Return the type of a flattened value, as schema_analysis works it out in SQL
+    from its JSON: the jsonb_typeof, except for strings that look like dates or
+    datetimes.
+    """
+    if isinstance(value, str):
+        # Both patterns start with YYYY-MM-DD, so most strings can be ruled out
+        # without running them
+        if len(value) < 10 or value[4] != "-" or value[7] != "-":
+            return "string"
+        if DATE_PATTERN.fullmatch(value):
+            return "date"
+        if DATETIME_PATTERN.fullmatch(value):
+            return "datetime"
+        return "string"
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, float) and not math.isfinite(value):
+        # orjson writes these as null
+        return "null"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    return "object"
+
+
 def create_rows(
-    id: int, dataset: str, prefix: str, original_object: dict[str, Any], filetype: str
+    id: int,
+    dataset: str,
+    prefix: str,
+    original_object: dict[str, Any],
+    filetype: str,
+    field_types: Optional[list[tuple[str, str, str]]] = None,
 ) -> Iterator[dict[str, Any]]:
+    """
+    Yield a row of _raw_objects for the activity or organisation, and each of
+    the objects within it.
+
+    If ``field_types`` is given, the object type, field and value type of every
+    field of every row are added to it.
+    """
     if original_object is None:
         return []
 
     # get activity dates before traversal remove them
     activity_dates = original_object.get("activity-date", []) or []
 
-    for object, full_path, no_index_path in traverse_object(original_object, True):
+    for object_index, (object, full_path, no_index_path) in enumerate(
+        traverse_object(original_object, True)
+    ):
         (
             object_key,
             parent_keys_list,
             parent_keys_no_index,
             object_type,
             parent_keys,
-        ) = path_info(full_path, no_index_path, filetype)
+        ) = path_info(full_path, filetype)
 
         object["_link"] = f'{id}{"." if object_key else ""}{object_key}'
         object["dataset"] = dataset
@@ -223,41 +386,164 @@ def create_rows(
         for no_index, full in zip(parent_keys_no_index, parent_keys_list):
             object[f"_link_{no_index}"] = f"{id}.{full}"
 
+        flattened = dict(flatten_object(object, no_index_path=no_index_path))
+        if field_types is not None:
+            field_types.extend(
+                [
+                    (object_type, key, get_value_type(value))
+                    for key, value in flattened.items()
+                ]
+            )
+
         yield dict(
             id=id,
             object_key=object_key,
-            parent_keys=json.dumps(parent_keys),
+            parent_keys=serialize.dumps(parent_keys),
             object_type=object_type,
-            object=json.dumps(
-                dict(flatten_object(object, no_index_path=no_index_path))
-            ),
+            object=serialize.dumps(flattened),
             filetype=filetype,
+            object_index=object_index,
         )
 
 
-def raw_objects() -> None:
-    logger.info("Flattening activities and organisations into objects")
-    get_codelists_lookup()
+RAW_OBJECTS_COLUMNS = [
+    "id",
+    "object_key",
+    "parent_keys",
+    "object_type",
+    "object",
+    "filetype",
+    "object_index",
+]
+
+# The order the rows of _raw_objects are written in by one process, which the
+# tables of each object type are sorted by. The columns are qualified, as an
+# object may have fields with the same names.
+RAW_OBJECTS_ORDER_BY = (
+    "_raw_objects.filetype, _raw_objects.id, _raw_objects.object_index"
+)
 
-    logger.debug("Creating table: _raw_objects")
+# The number of rows buffered before they are copied into _raw_objects
+RAW_OBJECTS_FLUSH_SIZE = int(
+    os.environ.get("IATI_TABLES_RAW_OBJECTS_FLUSH_SIZE", 10000)
+)
+
+# Activities and organisations are flattened in this many id ranges per process,
+# so that processes which finish early can pick up more work
+RAW_OBJECTS_RANGES_PER_PROCESS = 4
+
+# With more than 0 threads, reading from the raw tables, flattening and copying
+# into _raw_objects run at the same time, with this many threads flattening
+RAW_OBJECTS_PIPELINE_THREADS = int(
+    os.environ.get("IATI_TABLES_RAW_OBJECTS_PIPELINE_THREADS", 0)
+)
+
+# The number of batches of activities or organisations held between each stage
+# of the pipeline
+RAW_OBJECTS_PIPELINE_QUEUE_SIZE = int(
+    os.environ.get("IATI_TABLES_RAW_OBJECTS_PIPELINE_QUEUE_SIZE", 8)
+)
+
+RAW_OBJECTS_PIPELINE_BATCH_SIZE = 100
+
+
+def create_raw_objects_table(table_name: str) -> None:
+    logger.debug(f"Creating table: {table_name}")
     engine = get_engine()
     with engine.begin() as connection:
         connection.execute(
             text(
-                """
-                DROP TABLE IF EXISTS _raw_objects;
-                CREATE TABLE _raw_objects(
+                f"""
+                DROP TABLE IF EXISTS {table_name};
+                CREATE TABLE {table_name}(
                     id bigint,
                     object_key TEXT,
                     parent_keys JSONB,
                     object_type TEXT,
                     object JSONB,
-                    filetype TEXT
+                    filetype TEXT,
+                    object_index INT
                 );
                 """
             )
         )
 
+
+def get_id_ranges(filetype: str, ranges: int) -> list[tuple[int, int]]:
+    """
+    Split the ids in the raw table for the filetype into up to ``ranges``
+    inclusive ranges, each with about the same number of rows.
+    """
+    with get_engine().begin() as connection:
+        result = connection.execute(
+            text(
+                f"""
+                SELECT min(id) AS min_id, max(id) AS max_id
+                FROM (
+                    SELECT id, ntile(:ranges) OVER (ORDER BY id) AS part
+                    FROM _raw_{filetype}
+                ) AS parts
+                GROUP BY part
+                ORDER BY part
+                """
+            ),
+            {"ranges": ranges},
+        )
+        return [(row.min_id, row.max_id) for row in result]
+
+
+def encode_raw_object_rows(
+    filetype: str, raw_row: Sequence[Any], count_types: bool = False
+) -> tuple[list[str], list[tuple[str, str, str]]]:
+    """
+    Flatten a row of a raw table into objects, encoded as lines of COPY text.
+    With ``count_types``, also return the object type, field and value type of
+    every field, to be counted by the caller.
+    """
+    id, dataset, prefix, original_object = raw_row
+    field_types: Optional[list[tuple[str, str, str]]] = [] if count_types else None
+    lines = [
+        copy_text_row([row[name] for name in RAW_OBJECTS_COLUMNS])
+        for row in create_rows(
+            id, dataset, prefix, original_object, filetype, field_types
+        )
+    ]
+    return lines, field_types or []
+
+
+def flatten_raw_objects(
+    filetype: str,
+    id_range: Optional[tuple[int, int]],
+    table_name: str,
+    flush_size: Optional[int] = None,
+    pipeline_threads: Optional[int] = None,
+    type_counts: Optional[Counter[tuple[str, str, str]]] = None,
+) -> tuple[int, int]:
+    """
+    Flatten the activities or organisations with ids in ``id_range``, or all of
+    them, into objects in ``table_name``, in id order. The rows are copied into
+    the table every ``flush_size`` rows, which defaults to RAW_OBJECTS_FLUSH_SIZE.
+
+    With ``pipeline_threads`` (default RAW_OBJECTS_PIPELINE_THREADS), the raw
+    table is read on one thread, the objects flattened on ``pipeline_threads``
+    threads and copied into the table on this one, all at the same time.
+
+    If ``type_counts`` is given, the number of values of each object type, field
+    and value type are added to it, for schema_analysis.
+
+    Returns the number of activities or organisations flattened, and the number
+    of rows written.
+    """
+    if pipeline_threads is None:
+        pipeline_threads = RAW_OBJECTS_PIPELINE_THREADS
+    start = clock()
+    engine = get_engine()
+    where_sql, params = "", {}
+    if id_range:
+        where_sql = "WHERE id BETWEEN :min_id AND :max_id"
+        params = {"min_id": id_range[0], "max_id": id_range[1]}
+    num = 0
+    rows = 0
     with engine.begin() as read_connection:
         with engine.begin() as write_connection:
             read_connection = read_connection.execution_options(
@@ -265,46 +551,183 @@ def raw_objects() -> None:
             )
             results = read_connection.execute(
                 text(
+                    f"""
+                    SELECT id, dataset, prefix, object FROM _raw_{filetype}
+                    {where_sql}
+                    ORDER BY id
                     """
-                    (SELECT id, dataset, prefix, object, 'activity' AS filetype FROM _raw_activity ORDER BY id)
-                    UNION ALL
-                    (SELECT id, dataset, prefix, object, 'organisation' AS filetype FROM _raw_organisation ORDER BY id)
-                    """
-                )
+                ),
+                params,
             )
 
-            for num, (id, dataset, prefix, original_object, filetype) in enumerate(
-                results
-            ):
-                if num % 10000 == 0:
-                    logger.info(f"Processed {num} objects so far")
-                write_connection.execute(
-                    insert(
-                        table(
-                            "_raw_objects",
-                            column("id"),
-                            column("object_key"),
-                            column("parent_keys"),
-                            column("object_type"),
-                            column("object"),
-                            column("filetype"),
+            with CopyWriter(
+                write_connection,
+                table_name,
+                RAW_OBJECTS_COLUMNS,
+                flush_size=flush_size or RAW_OBJECTS_FLUSH_SIZE,
+            ) as writer:
+
+                def write_object(
+                    encoded: tuple[list[str], list[tuple[str, str, str]]]
+                ) -> None:
+                    nonlocal num, rows
+                    lines, field_types = encoded
+                    if type_counts is not None:
+                        type_counts.update(field_types)
+                    num += 1
+                    rows += len(lines)
+                    if num % 10000 == 0:
+                        logger.info(
+                            f"Processed {num} {filetype} objects so far "
+                            f"({rows / (clock() - start):.0f} rows/s)"
                         )
-                    ).values(
-                        [
-                            {
-                                "id": row["id"],
-                                "object_key": row["object_key"],
-                                "parent_keys": row["parent_keys"],
-                                "object_type": row["object_type"],
-                                "object": row["object"],
-                                "filetype": row["filetype"],
-                            }
-                            for row in create_rows(
-                                id, dataset, prefix, original_object, filetype
-                            )
-                        ]
+                    for line in lines:
+                        writer.write_line(line)
+
+                if pipeline_threads > 0:
+                    stats = run_pipeline(
+                        results,
+                        functools.partial(
+                            encode_raw_object_rows,
+                            filetype,
+                            count_types=type_counts is not None,
+                        ),
+                        write_object,
+                        threads=pipeline_threads,
+                        batch_size=RAW_OBJECTS_PIPELINE_BATCH_SIZE,
+                        queue_size=RAW_OBJECTS_PIPELINE_QUEUE_SIZE,
                     )
-                )
+                    logger.info(f"Pipeline for {table_name} {filetype}: {stats}")
+                else:
+                    for raw_row in results:
+                        write_object(
+                            encode_raw_object_rows(
+                                filetype, raw_row, count_types=type_counts is not None
+                            )
+                        )
+    engine.dispose()
+    return num, rows
+
+
+# The caches used while flattening, by the name their hit rates are logged under
+PATH_CACHES: dict[str, "functools._lru_cache_wrapper[Any]"] = {
+    "path template": get_path_templates,
+    "flatten plan": get_flatten_plan,
+}
+
+path_cache_counts_taken: dict[str, int] = {}
+
+
+def take_path_cache_counts() -> dict[str, int]:
+    """
+    Return the hits and misses of the path caches in this process since the last
+    call.
+    """
+    counts = {}
+    for name, cached_function in PATH_CACHES.items():
+        info = cached_function.cache_info()
+        counts[f"{name} hits"] = info.hits
+        counts[f"{name} misses"] = info.misses
+    taken = {}
+    for key, count in counts.items():
+        previous = path_cache_counts_taken.get(key, 0)
+        # The count starts again from 0 if the cache has been cleared since
+        taken[key] = count - previous if count >= previous else count
+    path_cache_counts_taken.update(counts)
+    return taken
+
+
+def log_path_cache_counts(counts: Counter[str]) -> None:
+    rates = []
+    for name in PATH_CACHES:
+        hits, misses = counts[f"{name} hits"], counts[f"{name} misses"]
+        if hits + misses:
+            rates.append(f"{name} {hits / (hits + misses):.1%} ({misses} misses)")
+    if rates:
+        logger.info("Path cache hit rates: " + ", ".join(rates))
+
+
+def flatten_raw_objects_task(
+    filetype: str, id_range: tuple[int, int]
+) -> tuple[int, int, dict[str, int], Counter[tuple[str, str, str]]]:
+    type_counts: Counter[tuple[str, str, str]] = Counter()
+    objects, rows = flatten_raw_objects(
+        filetype, id_range, "_raw_objects", type_counts=type_counts
+    )
+    return objects, rows, take_path_cache_counts(), type_counts
+
+
+def raw_objects(processes: int = 1) -> Counter[tuple[str, str, str]]:
+    """
+    Flatten activities and organisations into objects in _raw_objects.
+
+    With more than one process, the raw tables are split into id ranges, which
+    are flattened and copied into _raw_objects at the same time, each by its own
+    connection. _raw_objects then has the same rows as with one process, but not
+    in the same physical order, so postgres_tables sorts the rows of each object
+    type table by RAW_OBJECTS_ORDER_BY, the order one process writes them in.
+
+    Returns the number of values of each object type, field and value type, which
+    schema_analysis can use rather than scanning _raw_objects again.
+    """
+    logger.info("Flattening activities and organisations into objects")
+    get_codelists_lookup()
+    create_raw_objects_table("_raw_objects")
+
+    start = clock()
+    cache_counts: Counter[str] = Counter()
+    type_counts: Counter[tuple[str, str, str]] = Counter()
+    if processes <= 1:
+        take_path_cache_counts()
+        for filetype in ["activity", "organisation"]:
+            start = clock()
+            objects, rows = flatten_raw_objects(
+                filetype, None, "_raw_objects", type_counts=type_counts
+            )
+            logger.info(
+                f"Processed {objects} {filetype} objects "
+                f"({rows / (clock() - start):.0f} rows/s)"
+            )
+        cache_counts.update(take_path_cache_counts())
+        log_path_cache_counts(cache_counts)
+        return type_counts
+
+    partitions = [
+        (filetype, id_range)
+        for filetype in ["activity", "organisation"]
+        for id_range in get_id_ranges(
+            filetype, processes * RAW_OBJECTS_RANGES_PER_PROCESS
+        )
+    ]
+    objects = 0
+    rows = 0
+    # Each worker loads the codelists once, rather than for every range
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, initializer=get_codelists_lookup
+    ) as executor:
+        futures = [
+            executor.submit(flatten_raw_objects_task, filetype, id_range)
+            for filetype, id_range in partitions
+        ]
+        for done, future in enumerate(
+            concurrent.futures.as_completed(futures), start=1
+        ):
+            (
+                range_objects,
+                range_rows,
+                range_cache_counts,
+                range_type_counts,
+            ) = future.result()
+            objects += range_objects
+            rows += range_rows
+            cache_counts.update(range_cache_counts)
+            type_counts.update(range_type_counts)
+            logger.info(
+                f"Processed {objects} objects in {done}/{len(futures)} id ranges "
+                f"({rows / (clock() - start):.0f} rows/s)"
+            )
+    log_path_cache_counts(cache_counts)
+    return type_counts
 
 
 def flatten_schema_docs(cur, path=""):
@@ -330,14 +753,78 @@ def get_schema_docs():
     return schema_docs_lookup
 
 
-DATE_RE = r"^(\d{4})-(\d{2})-(\d{2})$"
-DATETIME_RE = r"^(\d{4})-(\d{2})-(\d{2})([T ](\d{2}):(\d{2}):(\d{2}(?:\.\d*)?)((-(\d{2}):(\d{2})|Z)?))?$"
+def get_object_type_fields(
+    type_counts: Counter[tuple[str, str, str]]
+) -> list[tuple[str, str, str, int]]:
+    """
+    Combine the value types of each field of each object type, in the same way as
+    _object_type_fields is made from _object_type_aggregate: null values are
+    ignored, and fields with values of more than one type are strings.
+    """
+    fields: dict[tuple[str, str], tuple[str, int]] = {}
+    for (object_type, key, value_type), count in sorted(type_counts.items()):
+        if value_type == "null":
+            continue
+        if (object_type, key) in fields:
+            _, total = fields[(object_type, key)]
+            fields[(object_type, key)] = ("string", total + count)
+        else:
+            fields[(object_type, key)] = (value_type, count)
+    return [
+        (object_type, key, value_type, count)
+        for (object_type, key), (value_type, count) in fields.items()
+    ]
 
 
-def schema_analysis():
-    logger.info("Analysing schema")
-    create_table(
+def write_object_type_tables(
+    type_counts: Counter[tuple[str, str, str]]
+) -> list[tuple[str, str, str, int]]:
+    """
+    Write _object_type_aggregate and _object_type_fields from the value type
+    counts collected by raw_objects, and return the fields.
+    """
+    object_type_fields = get_object_type_fields(type_counts)
+    engine = get_engine()
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                """
+                DROP TABLE IF EXISTS _object_type_aggregate;
+                CREATE TABLE _object_type_aggregate(
+                    object_type TEXT, key TEXT, value_type TEXT, count bigint
+                );
+                DROP TABLE IF EXISTS _object_type_fields;
+                CREATE TABLE _object_type_fields(
+                    object_type TEXT, key TEXT, value_type TEXT, count numeric
+                );
+                """
+            )
+        )
+        columns = ["object_type", "key", "value_type", "count"]
+        with CopyWriter(connection, "_object_type_aggregate", columns) as writer:
+            for (object_type, key, value_type), count in sorted(type_counts.items()):
+                writer.write((object_type, key, value_type, count))
+        with CopyWriter(connection, "_object_type_fields", columns) as writer:
+            for row in object_type_fields:
+                writer.write(row)
+    return object_type_fields
+
+
+def analyse_raw_objects(
+    connection: Optional[Connection] = None,
+) -> list[tuple[str, str, str, int]]:
+    """
+    Write _object_type_aggregate and _object_type_fields by scanning every object
+    in _raw_objects, and return the fields. With ``connection``, the tables are
+    written within its transaction.
+    """
+    if connection is None:
+        with get_engine().begin() as connection:
+            return analyse_raw_objects(connection)
+
+    _create_table(
         "_object_type_aggregate",
+        connection,
         f"""SELECT
               object_type,
               each.key,
@@ -357,8 +844,9 @@ def schema_analysis():
         """,
     )
 
-    create_table(
+    _create_table(
         "_object_type_fields",
+        connection,
         """SELECT
               object_type,
               key,
@@ -375,6 +863,28 @@ def schema_analysis():
         """,
     )
 
+    results = connection.execute(
+        text("SELECT object_type, key, value_type, count FROM _object_type_fields")
+    )
+    return [tuple(row) for row in results]
+
+
+def schema_analysis(
+    type_counts: Optional[Counter[tuple[str, str, str]]] = None
+) -> None:
+    """
+    Work out the type of each field of each object type, and write them to
+    _fields along with their docs.
+
+    With ``type_counts`` from raw_objects, the types come from those. Otherwise
+    they are worked out by scanning every object in _raw_objects.
+    """
+    logger.info("Analysing schema")
+    if type_counts is not None:
+        object_type_fields = write_object_type_tables(type_counts)
+    else:
+        object_type_fields = analyse_raw_objects()
+
     schema_lookup = get_schema_docs()
 
     engine = get_engine()
@@ -388,11 +898,7 @@ def schema_analysis():
             )
         )
 
-        results = connection.execute(
-            text("SELECT object_type, key, value_type, count FROM _object_type_fields")
-        )
-
-        for object_type, key, value_type, count in results:
+        for object_type, key, value_type, count in object_type_fields:
             order, docs = 9999, ""
 
             if object_type == "activity":
@@ -496,6 +1002,7 @@ def postgres_tables(drop_release_objects=False):
             SELECT {field_sql}
             FROM _raw_objects, jsonb_to_record(object) AS x({as_sql})
             WHERE object_type = :object_type
+            ORDER BY {RAW_OBJECTS_ORDER_BY}
             """
         create_table(object_type, table_sql, object_type=object_type)
 
@@ -510,7 +1017,7 @@ def postgres_tables(drop_release_objects=False):
                 """
             ),
             {
-                "data_dump_updated_at": iatikit.data().last_updated.isoformat(
+                "data_dump_updated_at": get_registry_index().last_updated.isoformat(
                     sep=" ", timespec="seconds"
                 ),
                 "iati_tables_updated_at": datetime.utcnow().isoformat(
@@ -965,8 +1472,8 @@ def sql_process():
         raise
 
 
-def process_registry() -> None:
-    raw_objects()
-    schema_analysis()
+def process_registry(processes: int = 1) -> None:
+    type_counts = raw_objects(processes)
+    schema_analysis(type_counts)
     postgres_tables()
     sql_process()
@@ -0,0 +1,136 @@
+"""
+A cache of parsed datasets, so that unchanged files don't need to be parsed,
+sorted and decoded again on the next load.
+
+Each entry is a gzipped file holding the dataset's version on the first line,
+then a line per activity or organisation with its validation errors and its
+decoded dict, both as JSON and separated by a tab. Entries are keyed by the hash
+of the file along with everything else that affects the output, such as the
+schema and the code used to parse it.
+"""
+
+import contextlib
+import gzip
+import json
+import logging
+import os
+import pathlib
+from typing import Iterator, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+class CacheReadError(Exception):
+    """
+    Raised when a cache entry can't be read, after it has been deleted.
+    """
+
+
+class CacheWriter:
+    def __init__(self, f: TextIO) -> None:
+        self.f = f
+
+    def write(self, error: str, object_json: str) -> None:
+        self.f.write(json.dumps(error))
+        self.f.write("\t")
+        self.f.write(object_json)
+        self.f.write("\n")
+
+
+class ParseCache:
+    def __init__(self, directory: pathlib.Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get_path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}.jsonl.gz"
+
+    @contextlib.contextmanager
+    def read(
+        self, key: str
+    ) -> Iterator[Optional[tuple[str, Iterator[tuple[str, str]]]]]:
+        """
+        Open an entry in the cache, giving the version of the cached dataset and an
+        iterator of the errors and JSON of each of its objects, or None if it isn't
+        in the cache. The entry is closed when the block exits.
+
+        If the entry turns out to be corrupt part way through, it is deleted and
+        the iterator raises CacheReadError.
+        """
+        path = self.get_path(key)
+        try:
+            f = gzip.open(path, "rt", encoding="utf-8")
+        except OSError:
+            yield None
+            return
+        with f:
+            try:
+                version = json.loads(f.readline())["version"]
+            except (OSError, EOFError, ValueError, KeyError):
+                version = None
+            if version is None:
+                yield None
+                return
+            # Mark the entry as recently used, so it is evicted last
+            os.utime(path)
+
+            def iter_objects() -> Iterator[tuple[str, str]]:
+                try:
+                    for line in f:
+                        error_json, object_json = line.rstrip("\n").split("\t", 1)
+                        yield json.loads(error_json), object_json
+                except (OSError, EOFError, ValueError) as e:
+                    path.unlink(missing_ok=True)
+                    raise CacheReadError(
+                        f"Parse cache entry {path.name} is corrupt: {e}"
+                    ) from e
+
+            yield version, iter_objects()
+
+    @contextlib.contextmanager
+    def write(self, key: str, version: str) -> Iterator[CacheWriter]:
+        """
+        Write an entry to the cache. The entry is only added once the block exits
+        without an exception, so partially parsed datasets are never cached.
+        """
+        path = self.get_path(key)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            # A low compression level, as this is on the critical path of loading
+            with gzip.open(tmp_path, "wt", compresslevel=1, encoding="utf-8") as f:
+                f.write(json.dumps({"version": version}))
+                f.write("\n")
+                yield CacheWriter(f)
+            tmp_path.replace(path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        if not self.directory.is_dir():
+            return
+        entries = []
+        for path in self.directory.glob("*.jsonl.gz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            evicted += 1
+        logger.info(
+            f"Parse cache is {total_bytes / 1e6:.0f} MB after evicting {evicted} entries"
+        )
@@ -0,0 +1,221 @@
+"""
+Run a reader, a pool of worker threads and a writer at the same time, with
+bounded queues between them, so that reading from the database, processing in
+Python and writing back to the database overlap.
+
+The reader runs on its own thread and groups items from the source into
+batches. The workers transform each batch, and the writer, which runs on the
+calling thread, passes the results to the sink in the same order as the source.
+Every queue is bounded, as is the number of batches in flight, so a slow stage
+holds back the stages before it rather than letting memory grow. If any stage
+fails, the others stop and the exception is raised from run_pipeline.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# How often blocked threads check whether another stage has failed
+POLL_INTERVAL = 0.1
+
+# The semaphore bounding the batches in flight, patched in tests
+Semaphore = threading.Semaphore
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Raised in a stage when another stage has failed.
+    """
+
+
+class StageQueue:
+    """
+    A bounded queue between two stages, which records how full it gets and how
+    long its producers and consumers spend blocked on it.
+    """
+
+    def __init__(self, name: str, maxsize: int, stop: threading.Event) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.stop = stop
+        self.queue: queue.Queue[Any] = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item: Any) -> None:
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.put_wait += waited
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+            if item is not _DONE:
+                self.batches += 1
+
+    def get(self) -> Any:
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped
+            try:
+                item = self.queue.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.get_wait += waited
+        return item
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name} queue: {self.batches} batches, "
+            f"max depth {self.max_depth}/{self.maxsize}, "
+            f"producers stalled {self.put_wait:.1f}s, "
+            f"consumers stalled {self.get_wait:.1f}s"
+        )
+
+
+class PipelineStats:
+    """
+    Queue depths and stall times of a pipeline, for tuning its thread count and
+    queue sizes. Producers stalling on a queue means the stage after it is the
+    bottleneck; consumers stalling means the stage before it is.
+    """
+
+    def __init__(self, read_queue: StageQueue, write_queue: StageQueue) -> None:
+        self.read_queue = read_queue
+        self.write_queue = write_queue
+        self.reader_wait = 0.0
+        self.elapsed = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.elapsed:.1f}s, reader waited {self.reader_wait:.1f}s for "
+            f"batches in flight; {self.read_queue}; {self.write_queue}"
+        )
+
+
+def run_pipeline(
+    source: Iterable[T],
+    transform: Callable[[T], R],
+    sink: Callable[[R], None],
+    threads: int = 1,
+    batch_size: int = 100,
+    queue_size: int = 8,
+) -> PipelineStats:
+    """
+    Call ``transform`` on each item of ``source`` on ``threads`` worker threads,
+    and ``sink`` on each result, in source order, on the calling thread.
+
+    Items are passed between stages in batches of ``batch_size``, through queues
+    that hold up to ``queue_size`` batches.
+    """
+    threads = max(threads, 1)
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    read_queue = StageQueue("read", queue_size, stop)
+    write_queue = StageQueue("write", queue_size, stop)
+    stats = PipelineStats(read_queue, write_queue)
+    # Results are written in order, so a slow batch holds the ones after it in
+    # the writer. Limit the batches in flight so they can't pile up without bound.
+    in_flight = Semaphore(queue_size * 2 + threads)
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        stop.set()
+
+    def acquire_batch() -> None:
+        start = time.perf_counter()
+        while not in_flight.acquire(timeout=POLL_INTERVAL):
+            if stop.is_set():
+                raise PipelineStopped
+        stats.reader_wait += time.perf_counter() - start
+
+    def read() -> None:
+        try:
+            sequence = 0
+            batch: list[T] = []
+            for item in source:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    acquire_batch()
+                    read_queue.put((sequence, batch))
+                    sequence += 1
+                    batch = []
+            if batch:
+                acquire_batch()
+                read_queue.put((sequence, batch))
+            for _ in range(threads):
+                read_queue.put(_DONE)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            fail(e)
+
+    def work() -> None:
+        try:
+            while True:
+                item = read_queue.get()
+                if item is _DONE:
+                    write_queue.put(_DONE)
+                    return
+                sequence, batch = item
+                write_queue.put((sequence, [transform(value) for value in batch]))
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            fail(e)
+
+    stage_threads = [threading.Thread(target=read, name="pipeline-read", daemon=True)]
+    stage_threads.extend(
+        threading.Thread(target=work, name=f"pipeline-work-{num}", daemon=True)
+        for num in range(threads)
+    )
+    start = time.perf_counter()
+    for thread in stage_threads:
+        thread.start()
+    try:
+        pending: dict[int, list[R]] = {}
+        next_sequence = 0
+        done = 0
+        while done < threads:
+            item = write_queue.get()
+            if item is _DONE:
+                done += 1
+                continue
+            sequence, results = item
+            pending[sequence] = results
+            while next_sequence in pending:
+                for result in pending.pop(next_sequence):
+                    sink(result)
+                next_sequence += 1
+                in_flight.release()
+    except PipelineStopped:
+        pass
+    except BaseException as e:
+        fail(e)
+    finally:
+        stop.set()
+        for thread in stage_threads:
+            thread.join()
+    stats.elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return stats
@@ -0,0 +1,198 @@
+"""
+An index of the datasets in the local copy of the registry.
+
+Listing datasets through iatikit scans the registry directory and reads each
+dataset's metadata JSON (or parses the file, if there is no metadata) to find its
+filetype. The index does that once after the registry is downloaded, and saves
+what later stages need to the cache directory.
+"""
+
+import datetime
+import functools
+import json
+import logging
+import os
+import pathlib
+from typing import Any, Optional
+
+import iatikit
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+
+cache_dir = pathlib.Path(
+    os.environ.get("IATI_TABLES_CACHE", "__iatikitcache__/iati_tables")
+)
+
+
+def get_cache_dir() -> pathlib.Path:
+    """
+    Return the cache directory. Other modules call this when they use the cache,
+    rather than importing cache_dir, so that changing it takes effect everywhere.
+    """
+    return cache_dir
+
+
+INDEX_FIELDS = [
+    "prefix",
+    "name",
+    "filetype",
+    "data_path",
+    "metadata_path",
+    "size",
+    "mtime",
+    "version",
+]
+
+
+def get_dataset_version(data_path: str) -> str:
+    """
+    Read the version attribute of a dataset's root element, without parsing the
+    rest of the file.
+    """
+    for _, root in etree.iterparse(data_path, events=("start",), huge_tree=True):
+        return root.get("version", "1.01")
+    return "1.01"
+
+
+class RegistryDataset(iatikit.Dataset):
+    """
+    An iatikit Dataset with its name, filetype, size and version taken from the
+    index, rather than worked out from the file and metadata.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        name: str,
+        filetype: Optional[str],
+        data_path: str,
+        metadata_path: Optional[str],
+        size: int,
+        mtime: float,
+        version: Optional[str],
+    ) -> None:
+        super().__init__(data_path, metadata_path)
+        self.prefix = prefix
+        self._name = name
+        self._filetype = filetype
+        self.size = size
+        self.mtime = mtime
+        self._version = version
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def filetype(self) -> Optional[str]:
+        return self._filetype
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
+
+    def to_row(self) -> list[Any]:
+        return [
+            self.prefix,
+            self.name,
+            self.filetype,
+            self.data_path,
+            self.metadata_path,
+            self.size,
+            self.mtime,
+            self.version,
+        ]
+
+
+class RegistryIndex:
+    def __init__(
+        self, last_updated: datetime.datetime, datasets: list[RegistryDataset]
+    ) -> None:
+        self.last_updated = last_updated
+        self.datasets = datasets
+
+
+def index_dataset(dataset: iatikit.Dataset) -> RegistryDataset:
+    data_path = dataset.data_path
+    stat = os.stat(data_path)
+    try:
+        version: Optional[str] = get_dataset_version(data_path)
+    except etree.XMLSyntaxError:
+        version = None
+    return RegistryDataset(
+        prefix=pathlib.Path(data_path).parts[-2],
+        name=dataset.name,
+        filetype=dataset.filetype,
+        data_path=data_path,
+        metadata_path=dataset.metadata_path,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        version=version,
+    )
+
+
+def build_registry_index() -> RegistryIndex:
+    registry = iatikit.data()
+    datasets = []
+    for dataset in registry.datasets:
+        if not dataset.data_path or not os.path.exists(dataset.data_path):
+            logger.warning(f"Dataset '{dataset}' not found")
+            continue
+        datasets.append(index_dataset(dataset))
+    return RegistryIndex(registry.last_updated, datasets)
+
+
+def get_index_path() -> pathlib.Path:
+    return cache_dir / "registry-index.json"
+
+
+def save_registry_index(index: RegistryIndex) -> None:
+    index_path = get_index_path()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(
+        json.dumps(
+            {
+                "last_updated": index.last_updated.isoformat(),
+                "fields": INDEX_FIELDS,
+                "datasets": [dataset.to_row() for dataset in index.datasets],
+            }
+        )
+    )
+    tmp_path.replace(index_path)
+
+
+def read_registry_index() -> Optional[RegistryIndex]:
+    try:
+        index_json = json.loads(get_index_path().read_text())
+    except (OSError, ValueError):
+        return None
+    if index_json.get("fields") != INDEX_FIELDS:
+        return None
+    return RegistryIndex(
+        datetime.datetime.fromisoformat(index_json["last_updated"]),
+        [RegistryDataset(*row) for row in index_json["datasets"]],
+    )
+
+
+def update_registry_index() -> RegistryIndex:
+    logger.info("Building registry index")
+    index = build_registry_index()
+    save_registry_index(index)
+    logger.info(f"Indexed {len(index.datasets)} datasets")
+    get_registry_index.cache_clear()
+    return index
+
+
+@functools.lru_cache
+def get_registry_index() -> RegistryIndex:
+    """
+    Return the saved registry index, rebuilding it if it is missing or was built
+    from an earlier download of the registry.
+    """
+    index = read_registry_index()
+    if index is not None and index.last_updated == iatikit.data().last_updated:
+        return index
+    return update_registry_index()
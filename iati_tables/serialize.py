@@ -0,0 +1,67 @@
+"""
+Serialise objects to JSON for the raw and object tables.
+
+orjson is used if it is installed, as it is several times faster than the json
+module, which is used otherwise. Set IATI_TABLES_JSON to "json" or "orjson" to
+choose one. Both give compact UTF-8 JSON with keys in insertion order, and the
+same text for the strings, integers and nested objects in our tables. Floats
+with small exponents are formatted differently (e.g. 1.5e-7 rather than
+1.5e-07), which load into JSONB as the same number.
+
+Either way the JSON decodes to the same value as that of json.dumps with its
+default arguments, which escapes non-ASCII characters and adds spaces, except
+for NaN and infinity. json.dumps writes those as NaN and Infinity, which aren't
+valid JSON and can't be loaded into JSONB, so both backends write null instead.
+"""
+
+import json
+import math
+import os
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+def replace_non_finite(value: Any) -> Any:
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [replace_non_finite(item) for item in value]
+    return value
+
+
+def dumps_json(value: Any) -> str:
+    try:
+        return json.dumps(
+            value, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+        )
+    except ValueError:
+        # Write NaN and infinity as null, as orjson does
+        return json.dumps(
+            replace_non_finite(value), ensure_ascii=False, separators=(",", ":")
+        )
+
+
+def dumps_orjson(value: Any) -> str:
+    try:
+        return orjson.dumps(value).decode()
+    except TypeError:
+        # orjson doesn't handle some values the json module does, such as integers
+        # over 64 bits
+        return dumps_json(value)
+
+
+BACKENDS: dict[str, Callable[[Any], str]] = {"json": dumps_json}
+if orjson is not None:
+    BACKENDS["orjson"] = dumps_orjson
+
+JSON_BACKEND = os.environ.get(
+    "IATI_TABLES_JSON", "orjson" if orjson is not None else "json"
+)
+
+dumps = BACKENDS[JSON_BACKEND]
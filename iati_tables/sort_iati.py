@@ -199,32 +199,52 @@ class IATISchemaWalker(object):
         )
 
 
-def sort_iati_element(element, schema_subdict):
+SchemaOrder = dict[str, tuple[int, "SchemaOrder"]]
+
+
+def compile_schema_order(schema_dict: OrderedDict[str, OrderedDict]) -> SchemaOrder:
     """
-    Sort the given elements children according to the order of schema_subdict.
+    Compile a nested OrderedDict from create_schema_dict into nested dicts of
+    tag -> (rank, child schema order), so each child's position is a single lookup.
     """
-    children = list(element)
-    for child in children:
-        element.remove(child)
-    for child in sorted(
-        children, key=lambda x: list(schema_subdict.keys()).index(x.tag)
+    return {
+        name: (rank, compile_schema_order(subdict))
+        for rank, (name, subdict) in enumerate(schema_dict.items())
+    }
+
+
+def sort_iati_element(element, schema_order):
+    """
+    Sort the given elements children according to the compiled schema_order.
+    """
+    ranked_children = [
+        (schema_order[child.tag][0], child) for child in element.iterchildren()
+    ]
+    if any(
+        ranked_children[num][0] > ranked_children[num + 1][0]
+        for num in range(len(ranked_children) - 1)
     ):
-        element.append(child)
-        sort_iati_element(child, schema_subdict[child.tag])
+        ranked_children.sort(key=lambda x: x[0])
+        for _, child in ranked_children:
+            element.append(child)
+    for _, child in ranked_children:
+        sort_iati_element(child, schema_order[child.tag][1])
 
 
 def sort_iati_xml_file(input_file, output_file):
     """
     Sort an IATI XML file according to the schema.
     """
-    schema_dict = IATISchemaWalker("iati-activities-schema.xsd").create_schema_dict(
-        "iati-activity"
+    schema_order = compile_schema_order(
+        IATISchemaWalker("iati-activities-schema.xsd").create_schema_dict(
+            "iati-activity"
+        )
     )
     tree = ET.parse(input_file)
     root = tree.getroot()
 
     for element in root:
-        sort_iati_element(element, schema_dict)
+        sort_iati_element(element, schema_order)
 
     with open(output_file, "wb") as fp:
         tree.write(fp, encoding="utf-8")
@@ -0,0 +1,153 @@
+"""
+Staged output of the load stage, so that datasets can be parsed without a
+database (or on several machines at once) and copied into the database later.
+
+Each dataset has a gzipped file of its raw table rows in PostgreSQL's COPY text
+format, and a JSON file with its manifest entry. The entry is written last, so a
+dataset is only merged into the database once all of its rows have been staged.
+"""
+
+import gzip
+import json
+import os
+import pathlib
+import shutil
+from typing import Any, Iterator, Optional
+
+from iati_tables.database import copy_text_row
+
+
+def get_staged_paths(
+    staging_dir: pathlib.Path, prefix: str, filename: str
+) -> tuple[pathlib.Path, pathlib.Path]:
+    """
+    Return the paths of the rows and the manifest entry of a staged dataset.
+    """
+    dataset_dir = staging_dir / "datasets" / prefix
+    return (
+        dataset_dir / f"{filename}.copy.gz",
+        dataset_dir / f"{filename}.json",
+    )
+
+
+def write_json_atomic(path: pathlib.Path, value: Any) -> None:
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(value))
+    tmp_path.replace(path)
+
+
+class StagingWriter:
+    """
+    Write the rows of a dataset to the staging directory, with the same interface
+    as CopyWriter. The rows are only kept, and the manifest entry written, if the
+    block exits without an exception.
+    """
+
+    def __init__(self, staging_dir: pathlib.Path, entry: dict[str, Any]) -> None:
+        self.entry = entry
+        self.rows_path, self.entry_path = get_staged_paths(
+            staging_dir, entry["prefix"], entry["filename"]
+        )
+        self.tmp_path = self.rows_path.with_suffix(f".{os.getpid()}.tmp")
+        self.rows_written = 0
+
+    def __enter__(self) -> "StagingWriter":
+        self.rows_path.parent.mkdir(parents=True, exist_ok=True)
+        # Stop the old rows being merged if this dataset isn't staged in full
+        self.entry_path.unlink(missing_ok=True)
+        # A low compression level, as this is on the critical path of loading
+        self.f = gzip.open(self.tmp_path, "wt", compresslevel=1, encoding="utf-8")
+        return self
+
+    def write(self, row: tuple[Any, ...]) -> None:
+        self.write_line(copy_text_row(row))
+
+    def write_line(self, line: str) -> None:
+        self.f.write(line)
+        self.rows_written += 1
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.f.close()
+        try:
+            if exc_type is None:
+                self.tmp_path.replace(self.rows_path)
+                write_json_atomic(
+                    self.entry_path, {**self.entry, "row_count": self.rows_written}
+                )
+        finally:
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def iter_staged_datasets(
+    staging_dir: pathlib.Path,
+) -> Iterator[tuple[dict[str, Any], pathlib.Path]]:
+    """
+    Yield the manifest entry and the path of the rows of each dataset that has
+    been staged in full.
+    """
+    for entry_path in sorted((staging_dir / "datasets").glob("*/*.json")):
+        entry = json.loads(entry_path.read_text())
+        rows_path, _ = get_staged_paths(staging_dir, entry["prefix"], entry["filename"])
+        yield entry, rows_path
+
+
+def open_staged_rows(rows_path: pathlib.Path) -> gzip.GzipFile:
+    """
+    Open the rows of a staged dataset as UTF-8 encoded COPY text, which can be
+    streamed straight into COPY ... FROM STDIN.
+    """
+    return gzip.open(rows_path, "rb")
+
+
+def iter_staged_lines(rows_path: pathlib.Path) -> Iterator[str]:
+    with gzip.open(rows_path, "rt", encoding="utf-8") as f:
+        yield from f
+
+
+def clear_staging_dir(staging_dir: pathlib.Path) -> None:
+    """
+    Remove anything staged by a previous load.
+    """
+    shutil.rmtree(staging_dir / "datasets", ignore_errors=True)
+    get_failures_path(staging_dir).unlink(missing_ok=True)
+    get_metadata_path(staging_dir).unlink(missing_ok=True)
+
+
+def get_failures_path(staging_dir: pathlib.Path) -> pathlib.Path:
+    return staging_dir / "failures.jsonl"
+
+
+def add_staged_failure(staging_dir: pathlib.Path, failure: dict[str, Any]) -> None:
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    with get_failures_path(staging_dir).open("a") as f:
+        f.write(json.dumps(failure))
+        f.write("\n")
+
+
+def iter_staged_failures(staging_dir: pathlib.Path) -> Iterator[dict[str, Any]]:
+    try:
+        with get_failures_path(staging_dir).open() as f:
+            for line in f:
+                yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def get_metadata_path(staging_dir: pathlib.Path) -> pathlib.Path:
+    return staging_dir / "load.json"
+
+
+def write_staged_metadata(staging_dir: pathlib.Path, metadata: dict[str, Any]) -> None:
+    """
+    Record how the datasets in the staging directory were loaded, e.g. whether
+    validation errors were collected.
+    """
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(get_metadata_path(staging_dir), metadata)
+
+
+def read_staged_metadata(staging_dir: pathlib.Path) -> Optional[dict[str, Any]]:
+    try:
+        return json.loads(get_metadata_path(staging_dir).read_text())
+    except FileNotFoundError:
+        return None
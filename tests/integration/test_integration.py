@@ -8,10 +8,11 @@ from unittest.mock import MagicMock
 import pytest
 from deepdiff import DeepDiff
 from iatikit.data.dataset import Dataset
-from sqlalchemy import text
+from sqlalchemy import Connection, text
 
 from iati_tables import run_all
 from iati_tables.database import get_engine
+from iati_tables.modelling import RAW_OBJECTS_ORDER_BY, analyse_raw_objects, raw_objects
 
 mock_iatikit_data = MagicMock()
 mock_iatikit_data.datasets = {
@@ -24,11 +25,11 @@ mock_iatikit.data.return_value = mock_iatikit_data
 
 
 @pytest.fixture(scope="module", autouse=True)
-@mock.patch("iati_tables.load.iatikit", mock_iatikit)
-@mock.patch("iati_tables.modelling.iatikit", mock_iatikit)
-@mock.patch("iati_tables.download_registry", MagicMock())
-def run_pipeline() -> None:
-    run_all(refresh=False)
+def run_pipeline(tmp_path_factory: pytest.TempPathFactory) -> None:
+    with mock.patch("iati_tables.registry.iatikit", mock_iatikit), mock.patch(
+        "iati_tables.registry.cache_dir", tmp_path_factory.mktemp("cache")
+    ), mock.patch("iati_tables.download_registry", MagicMock()):
+        run_all(refresh=False)
 
 
 def assert_table_contents(table_name: str, expected_rows: list[dict[str, Any]]) -> None:
@@ -229,3 +230,45 @@ def test_description_narrative():
             },
         ],
     )
+
+
+def read_rows(connection: Connection, table_name: str) -> set[tuple[Any, ...]]:
+    return {
+        tuple(row) for row in connection.execute(text(f"SELECT * FROM {table_name}"))
+    }
+
+
+def test_object_type_counts_match_sql() -> None:
+    # The connection's transaction is never committed, so the tables rebuilt by
+    # scanning _raw_objects are rolled back when it closes, and the other tests
+    # still see the tables written by run_all
+    with get_engine().connect() as connection:
+        counted_aggregate = read_rows(connection, "_object_type_aggregate")
+        counted_fields = read_rows(connection, "_object_type_fields")
+
+        analyse_raw_objects(connection)
+
+        assert counted_aggregate
+        assert counted_aggregate == read_rows(connection, "_object_type_aggregate")
+        assert counted_fields == read_rows(connection, "_object_type_fields")
+
+
+def test_raw_objects_in_parallel_sort_like_serial() -> None:
+    def read_raw_objects(order_by: str = "") -> list[tuple[Any, ...]]:
+        with get_engine().connect() as connection:
+            return [
+                tuple(row)
+                for row in connection.execute(
+                    text(f"SELECT * FROM _raw_objects {order_by}")
+                )
+            ]
+
+    # With one process, the rows are written to a new table in the order they are
+    # read back in
+    raw_objects(processes=1)
+    serial = read_raw_objects()
+    assert serial
+    assert read_raw_objects(f"ORDER BY {RAW_OBJECTS_ORDER_BY}") == serial
+
+    raw_objects(processes=2)
+    assert read_raw_objects(f"ORDER BY {RAW_OBJECTS_ORDER_BY}") == serial
@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from iati_tables.database import CopyWriter, copy_text_value
+
+
+def test_copy_text_value():
+    assert copy_text_value(None) == "\\N"
+    assert copy_text_value("") == ""
+    assert copy_text_value(1.5) == "1.5"
+    assert copy_text_value('{"a": "b\\"c"}') == '{"a": "b\\\\"c"}'
+    assert copy_text_value("line 1\nline 2\r\tend") == "line 1\\nline 2\\r\\tend"
+
+
+def test_copy_writer_flushes_in_chunks():
+    connection = MagicMock()
+    cursor = connection.connection.cursor.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, f: copied.append((sql, f.read()))
+
+    with CopyWriter(connection, "_raw_activity", ["a", "b"], flush_size=2) as writer:
+        writer.write(("1", None))
+        writer.write(("2", "x\ty"))
+        writer.write(("3", ""))
+
+    assert writer.rows_written == 3
+    cursor.close.assert_called_once()
+    assert copied == [
+        ("COPY _raw_activity (a, b) FROM STDIN", "1\t\\N\n2\tx\\ty\n"),
+        ("COPY _raw_activity (a, b) FROM STDIN", "3\t\n"),
+    ]
+
+
+def test_copy_writer_does_not_flush_on_error():
+    connection = MagicMock()
+    cursor = connection.connection.cursor.return_value
+
+    with pytest.raises(ValueError):
+        with CopyWriter(connection, "_raw_activity", ["a"]) as writer:
+            writer.write(("1",))
+            raise ValueError
+
+    cursor.copy_expert.assert_not_called()
+    cursor.close.assert_called_once()
+
+
+def test_copy_writer_closes_cursor_when_flush_fails():
+    connection = MagicMock()
+    cursor = connection.connection.cursor.return_value
+    cursor.copy_expert.side_effect = RuntimeError
+
+    with pytest.raises(RuntimeError):
+        with CopyWriter(connection, "_raw_activity", ["a"]) as writer:
+            writer.write(("1",))
+
+    cursor.close.assert_called_once()
@@ -0,0 +1,116 @@
+import pathlib
+
+import pytest
+import xmlschema
+from lxml import etree
+
+from iati_tables.decoder import FallbackRequired, SchemaDecoder
+
+SCHEMA_PATH = (
+    pathlib.Path(__file__).parent.parent
+    / "fixtures"
+    / "schema"
+    / "iati-activities-schema.xsd"
+)
+
+VALID_ACTIVITY = """
+<iati-activity xml:lang="en" default-currency="GBP" humanitarian="1" hierarchy="2"
+  last-updated-datetime="2020-01-01T00:00:00Z " linked-data-uri="http://example.com">
+ <iati-identifier> A-1 </iati-identifier>
+ <reporting-org ref="A" type="10"><narrative xml:lang="fr">x</narrative><narrative/></reporting-org>
+ <title><narrative>T</narrative><!-- comment --></title>
+ <description type="1"><narrative>D</narrative></description>
+ <description><narrative>D2</narrative></description>
+ <activity-status code="2"/>
+ <activity-date iso-date="2020-01-02" type="1"/>
+ <activity-date iso-date="2020-01-02Z" type="2"><narrative>n</narrative></activity-date>
+ <capital-spend percentage=" 10.50"/>
+ <transaction humanitarian="false">
+  <transaction-type code="1"/>
+  <transaction-date iso-date="2020-02-02"/>
+  <value value-date="2020-01-01" currency="USD">1000</value>
+ </transaction>
+ <transaction>
+  <transaction-type code="1"/>
+  <transaction-date iso-date="2020-02-02"/>
+  <value value-date="2020-01-01">-.5</value>
+  <description><narrative>x</narrative></description>
+ </transaction>
+ <conditions attached="0"><condition type="1"><narrative>c</narrative></condition></conditions>
+ <crs-add>
+  <other-flags code="1" significance="1"/>
+  <loan-status year="2020"><interest-received>5</interest-received></loan-status>
+  <channel-code></channel-code>
+ </crs-add>
+</iati-activity>
+"""
+
+MINIMAL_ACTIVITY = (
+    "<iati-identifier>A</iati-identifier>"
+    '<reporting-org ref="A" type="10"/>'
+    "<title><narrative>T</narrative></title>"
+)
+
+
+@pytest.fixture(scope="module")
+def xml_schema():
+    return xmlschema.XMLSchema(str(SCHEMA_PATH))
+
+
+def xmlschema_decode(xml_schema, element):
+    parent_element = etree.Element("iati-activities", version="2.03")
+    parent_element.append(element)
+    parent_dict, errors = xmlschema.to_dict(
+        parent_element, schema=xml_schema, validation="lax", decimal_type=float
+    )
+    return parent_dict["iati-activity"][0], errors
+
+
+def test_schema_decoder_matches_xmlschema(xml_schema):
+    element = etree.fromstring(VALID_ACTIVITY, etree.XMLParser(remove_blank_text=True))
+    decoder = SchemaDecoder(xml_schema, "iati-activity")
+
+    decoded = decoder.decode(element)
+    expected, errors = xmlschema_decode(xml_schema, element)
+
+    assert errors == []
+    assert decoded == expected
+    assert decoded["capital-spend"] == {"@percentage": 10.5}
+    assert decoded["reporting-org"]["narrative"] == [
+        {"@{http://www.w3.org/XML/1998/namespace}lang": "fr", "$": "x"},
+        None,
+    ]
+
+
+@pytest.mark.parametrize(
+    "activity_xml",
+    [
+        # Invalid values
+        f'<iati-activity>{MINIMAL_ACTIVITY}<capital-spend percentage="1e3"/></iati-activity>',
+        f'<iati-activity hierarchy="2147483648">{MINIMAL_ACTIVITY}</iati-activity>',
+        f'<iati-activity>{MINIMAL_ACTIVITY}<activity-date iso-date="2020-02-30" type="1"/></iati-activity>',
+        # Missing, unexpected and out of order elements and attributes
+        "<iati-activity><iati-identifier>A</iati-identifier><title><narrative>T</narrative></title></iati-activity>",
+        f"<iati-activity>{MINIMAL_ACTIVITY}<activity-status/></iati-activity>",
+        f'<iati-activity unknown="1">{MINIMAL_ACTIVITY}</iati-activity>',
+        f'<iati-activity>{MINIMAL_ACTIVITY}<capital-spend percentage="1"/><activity-status code="1"/></iati-activity>',
+        (
+            "<iati-activity><iati-identifier>A</iati-identifier>"
+            '<reporting-org ref="A" type="10"/><title/></iati-activity>'
+        ),
+        # Character data in element-only content
+        f"<iati-activity>{MINIMAL_ACTIVITY}text</iati-activity>",
+        # Namespaced extensions are left to xmlschema
+        f'<iati-activity xmlns:foo="http://foo">{MINIMAL_ACTIVITY}<foo:x>1</foo:x></iati-activity>',
+    ],
+)
+def test_schema_decoder_falls_back(xml_schema, activity_xml):
+    element = etree.fromstring(activity_xml)
+    decoder = SchemaDecoder(xml_schema, "iati-activity")
+
+    with pytest.raises(FallbackRequired):
+        decoder.decode(element)
+
+    if "xmlns" not in activity_xml:
+        _, errors = xmlschema_decode(xml_schema, element)
+        assert errors
@@ -1,8 +1,50 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import signal
+import subprocess
+import sys
+import time
 from collections import OrderedDict
+from datetime import datetime
+from unittest.mock import MagicMock
 
+import pytest
+import xmlschema
+from iatikit.data.dataset import Dataset
 from lxml import etree
 
+from iati_tables import load, registry
+from iati_tables.database import copy_text_row
 from iati_tables.load import sort_iati_element
+from iati_tables.registry import RegistryDataset
+from iati_tables.sort_iati import compile_schema_order
+from iati_tables.staging import (
+    StagingWriter,
+    get_staged_paths,
+    iter_staged_datasets,
+    iter_staged_failures,
+    iter_staged_lines,
+    read_staged_metadata,
+)
+
+SCHEMA_FIXTURES_DIR = pathlib.Path(__file__).parent.parent / "fixtures" / "schema"
+
+
+@pytest.fixture
+def schema_cwd(tmp_path, monkeypatch):
+    """
+    Run the test in a directory with the fixture schemas where the downloaded
+    standard would be, so that worker processes are set up as in a real load.
+    """
+    schema_dir = tmp_path / load.SCHEMA_DIR
+    schema_dir.mkdir(parents=True)
+    for path in SCHEMA_FIXTURES_DIR.glob("*.xsd"):
+        shutil.copy(path, schema_dir)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
 
 
 def test_sort_iati_element():
@@ -32,7 +74,7 @@ def test_sort_iati_element():
         ]
     )
 
-    sort_iati_element(element, schema_dict)
+    sort_iati_element(element, compile_schema_order(schema_dict))
 
     expected_xml = (
         b"<iati-activity>"
@@ -43,3 +85,786 @@ def test_sort_iati_element():
         b"</iati-activity>"
     )
     assert etree.tostring(element) == expected_xml
+
+
+def test_sort_iati_element_in_order_and_non_schema_elements():
+    input_xml = (
+        "<iati-activity>"
+        "<iati-identifier>XXXXXXXX</iati-identifier>"
+        "<other-element/>"
+        '<activity-status code="2"/>'
+        "</iati-activity>"
+    )
+    element = etree.fromstring(input_xml)
+    schema_order = compile_schema_order(
+        OrderedDict(
+            [("iati-identifier", OrderedDict()), ("activity-status", OrderedDict())]
+        )
+    )
+    assert schema_order == {"iati-identifier": (0, {}), "activity-status": (1, {})}
+
+    sort_iati_element(element, schema_order)
+
+    assert etree.tostring(element) == (
+        b"<iati-activity>"
+        b"<iati-identifier>XXXXXXXX</iati-identifier>"
+        b'<activity-status code="2"/>'
+        b"<other-element/>"
+        b"</iati-activity>"
+    )
+
+    children = list(element)
+    sort_iati_element(element, schema_order)
+    assert list(element) == children
+
+
+ACTIVITY_XSD = """<?xml version="1.0" encoding="UTF-8"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <xsd:element name="iati-activity">
+    <xsd:complexType>
+      <xsd:sequence>
+        <xsd:element ref="iati-identifier"/>
+        <xsd:element name="title" type="textRequiredType"/>
+      </xsd:sequence>
+    </xsd:complexType>
+  </xsd:element>
+</xsd:schema>
+"""
+
+COMMON_XSD = """<?xml version="1.0" encoding="UTF-8"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <xsd:element name="iati-identifier" type="xsd:string"/>
+  <xsd:complexType name="textRequiredType">
+    <xsd:sequence>
+      <xsd:element name="narrative" type="xsd:string" maxOccurs="unbounded"/>
+    </xsd:sequence>
+  </xsd:complexType>
+</xsd:schema>
+"""
+
+
+def test_get_sorted_schema_dict_persists(tmp_path, monkeypatch):
+    activity_schema_path = tmp_path / "iati-activities-schema.xsd"
+    activity_schema_path.write_text(ACTIVITY_XSD)
+    common_schema_path = tmp_path / "iati-common.xsd"
+    common_schema_path.write_text(COMMON_XSD)
+    monkeypatch.setattr(load, "ACTIVITY_SCHEMA_PATH", activity_schema_path)
+    monkeypatch.setattr(load, "COMMON_SCHEMA_PATH", common_schema_path)
+    monkeypatch.setattr(registry, "cache_dir", tmp_path / "cache")
+
+    expected = OrderedDict(
+        [
+            ("iati-identifier", OrderedDict()),
+            ("title", OrderedDict([("narrative", OrderedDict())])),
+        ]
+    )
+    assert load.get_sorted_schema_dict.__wrapped__() == expected
+    assert len(list((tmp_path / "cache").glob("schema-order-*.json"))) == 1
+
+    # A second build should come from disk, without walking the schema again
+    monkeypatch.setattr(load, "IATISchemaWalker", None)
+    schema_dict = load.get_sorted_schema_dict.__wrapped__()
+    assert schema_dict == expected
+    assert list(schema_dict) == ["iati-identifier", "title"]
+
+
+def test_iter_dataset_elements_stream(tmp_path):
+    data_path = tmp_path / "test_stream.xml"
+    data_path.write_text(
+        '<iati-activities version="2.03">'
+        "<iati-activity><iati-identifier>A</iati-identifier></iati-activity>"
+        "<!-- comment -->"
+        "<iati-activity><iati-identifier>B</iati-identifier></iati-activity>"
+        "</iati-activities>"
+    )
+    dataset = Dataset(data_path=str(data_path))
+
+    streamed = [
+        (version, etree.tostring(element))
+        for version, element in load.iter_dataset_elements(dataset, stream=True)
+    ]
+    whole_tree = [
+        (version, etree.tostring(element))
+        for version, element in load.iter_dataset_elements(dataset, stream=False)
+    ]
+
+    assert streamed == whole_tree
+    assert streamed == [
+        (
+            "2.03",
+            b"<iati-activity><iati-identifier>A</iati-identifier></iati-activity>",
+        ),
+        (
+            "2.03",
+            b"<iati-activity><iati-identifier>B</iati-identifier></iati-activity>",
+        ),
+    ]
+    assert load.get_dataset_version(str(data_path)) == "2.03"
+
+
+def test_iter_dataset_elements_caches_transform(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "cache_dir", tmp_path / "cache")
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    data_path = prefix_dir / "test_v1.xml"
+    data_path.write_text(
+        '<iati-activities version="1.05">'
+        "<iati-activity><iati-identifier>A</iati-identifier>"
+        "<title>Title A</title></iati-activity>"
+        "</iati-activities>"
+    )
+    load.take_cache_counts()
+
+    def elements(stream):
+        dataset = Dataset(data_path=str(data_path))
+        return [
+            (version, etree.tostring(element))
+            for version, element in load.iter_dataset_elements(dataset, stream)
+        ]
+
+    transformed = elements(stream=True)
+    assert load.take_cache_counts() == {"transform cache misses": 1}
+    assert b"<narrative>Title A</narrative>" in transformed[0][1]
+    assert elements(stream=True) == transformed
+    assert elements(stream=False) == transformed
+    assert load.take_cache_counts() == {"transform cache hits": 2}
+
+    data_path.write_text(data_path.read_text().replace("Title A", "Title B"))
+    assert b"Title B" in elements(stream=True)[0][1]
+    assert load.take_cache_counts() == {"transform cache misses": 1}
+    assert len(list((tmp_path / "cache" / "transformed").glob("*/*/*.xml"))) == 1
+
+
+def test_iter_dataset_elements_skips_parse_on_transform_cache_hit(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(registry, "cache_dir", tmp_path / "cache")
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    data_path = prefix_dir / "test_v1.xml"
+    data_path.write_text(
+        '<iati-activities version="1.05">'
+        "<iati-activity><iati-identifier>A</iati-identifier>"
+        "<title>Title A</title></iati-activity>"
+        "</iati-activities>"
+    )
+    sha1 = load.file_sha1(data_path)
+    transformed = [
+        etree.tostring(element)
+        for _, element in load.iter_dataset_elements(
+            Dataset(data_path=str(data_path)), stream=False, sha1=sha1
+        )
+    ]
+    load.take_cache_counts()
+
+    # With the transform cached and the hash known, the original file is neither
+    # parsed as a whole nor hashed again
+    def fail(*args):
+        raise AssertionError("Original file read")
+
+    monkeypatch.setattr(Dataset, "etree", property(fail))
+    monkeypatch.setattr(load, "file_sha1", fail)
+    dataset = RegistryDataset(
+        "test_prefix", "test_v1", "activity", str(data_path), None, 0, 0.0, "1.05"
+    )
+    assert [
+        etree.tostring(element)
+        for _, element in load.iter_dataset_elements(dataset, stream=False, sha1=sha1)
+    ] == transformed
+    assert load.take_cache_counts() == {"transform cache hits": 1}
+
+
+def test_find_changed_datasets(tmp_path):
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    names = ["unchanged", "touched", "resettled", "new"]
+    for name in names:
+        (prefix_dir / f"{name}.xml").write_text(
+            f"<iati-activities>{name}</iati-activities>"
+        )
+    unchanged_stat = (prefix_dir / "unchanged.xml").stat()
+    resettled_stat = (prefix_dir / "resettled.xml").stat()
+    manifest = {
+        ("test_prefix", "unchanged.xml"): (
+            "abc",
+            unchanged_stat.st_size,
+            unchanged_stat.st_mtime,
+            "settings",
+        ),
+        ("test_prefix", "touched.xml"): ("def", 0, 0.0, "settings"),
+        # Loaded with other settings, so reparsed even though the file is the same
+        ("test_prefix", "resettled.xml"): (
+            "jkl",
+            resettled_stat.st_size,
+            resettled_stat.st_mtime,
+            "old settings",
+        ),
+        ("test_prefix", "removed.xml"): ("ghi", 0, 0.0, "settings"),
+    }
+    datasets = [Dataset(data_path=str(prefix_dir / f"{name}.xml")) for name in names]
+
+    changed, removed = load.find_changed_datasets(datasets, manifest, "settings")
+
+    assert [(dataset.name, sha1) for dataset, sha1 in changed] == [
+        ("touched", "def"),
+        ("resettled", None),
+        ("new", None),
+    ]
+    assert removed == {("test_prefix", "removed.xml")}
+
+
+def test_get_load_settings(monkeypatch):
+    monkeypatch.setattr(load, "get_parse_cache_version", lambda: "version_1")
+    settings = load.get_load_settings("xmlschema", True)
+    assert settings == load.get_load_settings("xmlschema", True)
+    assert settings != load.get_load_settings("xmlschema", False)
+    assert settings != load.get_load_settings("fast", True)
+
+    monkeypatch.setattr(load, "get_parse_cache_version", lambda: "version_2")
+    assert settings != load.get_load_settings("xmlschema", True)
+
+
+@pytest.mark.parametrize(
+    "finished_at, expected",
+    [
+        (None, (datetime(2024, 1, 2), True)),
+        # An older load that didn't finish has been replaced by this one
+        (datetime(2024, 1, 3), None),
+    ],
+)
+def test_get_unfinished_load(monkeypatch, finished_at, expected):
+    engine = MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    latest = MagicMock(
+        started_at=datetime(2024, 1, 2), validated=True, finished_at=finished_at
+    )
+    connection.execute.return_value.first.return_value = latest
+    monkeypatch.setattr(load, "get_engine", lambda: engine)
+
+    assert load.get_unfinished_load() == expected
+    [sql], _ = connection.execute.call_args
+    assert "WHERE" not in sql.text
+
+
+def test_file_sha1(tmp_path):
+    path = tmp_path / "test.xml"
+    path.write_bytes(b"<iati-activities/>")
+    assert load.file_sha1(path) == hashlib.sha1(b"<iati-activities/>").hexdigest()
+
+
+def test_schedule_datasets(tmp_path):
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    sizes = {"huge": 100, "large": 50, "small_1": 5, "small_2": 4, "small_3": 3}
+    for name, size in sizes.items():
+        (prefix_dir / f"{name}.xml").write_bytes(b"x" * size)
+    datasets = [
+        (Dataset(data_path=str(prefix_dir / f"{name}.xml")), None)
+        for name in ["small_1", "large", "small_3", "huge", "small_2"]
+    ]
+
+    tasks = load.schedule_datasets(datasets, batch_bytes=8)
+
+    assert [(size, [dataset.name for dataset, _ in task]) for size, task in tasks] == [
+        (100, ["huge"]),
+        (50, ["large"]),
+        (9, ["small_1", "small_2"]),
+        (3, ["small_3"]),
+    ]
+
+
+def test_dataset_time_limit():
+    with pytest.raises(load.DatasetTimeout):
+        with load.dataset_time_limit(0.01):
+            while True:
+                pass
+
+    with load.dataset_time_limit(0.01):
+        pass
+    # The alarm is cancelled when the block exits
+    time.sleep(0.02)
+
+
+def test_load_task_retries_failed_datasets(tmp_path):
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    datasets = []
+    for name, size in [("a", 10), ("b", 20), ("c", 30)]:
+        (prefix_dir / f"{name}.xml").write_bytes(b"x" * size)
+        datasets.append((Dataset(data_path=str(prefix_dir / f"{name}.xml")), name))
+    task = load.LoadTask(
+        60,
+        load.load_dataset_task,
+        (datasets, True, "fast", True),
+        [dataset for dataset, _ in datasets],
+    )
+    failures = [(0, "Timed out after 1s", 1.0), (2, "Timed out after 1s", 1.0)]
+
+    retry_task = task.retry_task(failures)
+
+    assert retry_task.attempts == 2
+    assert retry_task.size == 40
+    assert retry_task.args == ([datasets[0], datasets[2]], True, "fast", True)
+    assert [dataset.name for dataset in retry_task.datasets] == ["a", "c"]
+    assert [dataset.name for dataset in task.get_failed_datasets(failures)] == [
+        "a",
+        "c",
+    ]
+
+
+def test_load_task_partition(tmp_path):
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    datasets = []
+    for name, size in [("a", 10), ("b", 20), ("c", 30)]:
+        (prefix_dir / f"{name}.xml").write_bytes(b"x" * size)
+        datasets.append((Dataset(data_path=str(prefix_dir / f"{name}.xml")), name))
+    task = load.LoadTask(
+        60,
+        load.load_dataset_task,
+        (datasets, True, "fast", True),
+        [dataset for dataset, _ in datasets],
+        attempts=2,
+    )
+
+    before, rest = task.partition(1)
+
+    assert before.size == 10
+    assert before.args == (datasets[:1], True, "fast", True)
+    assert rest.size == 50
+    assert [dataset.name for dataset in rest.datasets] == ["b", "c"]
+    assert before.attempts == rest.attempts == 2
+    assert task.partition(0)[0] is None
+    assert task.partition(3)[1] is None
+
+    # Other tasks count as a single dataset
+    merge_task = load.LoadTask(0, load.merge_dataset_chunks, (), [])
+    assert merge_task.partition(0) == (None, merge_task)
+    assert merge_task.partition(1) == (merge_task, None)
+
+
+def test_check_split_dataset(schema_cwd, monkeypatch):
+    path = schema_cwd / "test_prefix" / "big.xml"
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b"<iati-activities/>")
+    dataset = Dataset(data_path=str(path))
+    sha1 = hashlib.sha1(b"<iati-activities/>").hexdigest()
+    hashed = []
+    file_sha1 = load.file_sha1
+    monkeypatch.setattr(
+        load, "file_sha1", lambda path: hashed.append(path) or file_sha1(path)
+    )
+    monkeypatch.setattr(load, "get_parse_cache_key", lambda *args: None)
+    loaded = []
+    monkeypatch.setattr(
+        load, "load_task_dataset", lambda *args: loaded.append(args) or (3, None)
+    )
+
+    # Changed, so it is left to be split, with its hash for the chunks and merge
+    (_, rows, _, failures), split_sha1 = load.check_split_dataset(dataset, "old")
+    assert (split_sha1, rows, failures, loaded) == (sha1, 0, [], [])
+
+    split_dataset = load.SplitDataset(dataset, 2, schema_cwd)
+    chunk_tasks = split_dataset.chunk_tasks(split_sha1)
+    assert [task.args[-1] for task in chunk_tasks] == [sha1, sha1]
+    assert split_dataset.merge_task().args[:2] == (dataset, sha1)
+
+    # Unchanged, so it is loaded whole without being hashed again
+    (_, rows, _, failures), split_sha1 = load.check_split_dataset(dataset, sha1)
+    assert (split_sha1, rows, failures) == (None, 3, [])
+    [(_, _, manifest_sha1, *_, known_sha1)] = loaded
+    assert manifest_sha1 == known_sha1 == sha1
+    assert len(hashed) == 2
+
+
+def test_run_load_tasks_splits_checked_datasets(schema_cwd):
+    path = schema_cwd / "test_prefix" / "big.xml"
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(
+        '<iati-activities version="2.03">'
+        + "".join(
+            f"<iati-activity><iati-identifier>A-{num}</iati-identifier>"
+            '<reporting-org ref="A" type="10"/></iati-activity>'
+            for num in range(4)
+        )
+        + "</iati-activities>"
+    )
+    dataset = Dataset(data_path=str(path))
+    staging_dir = schema_cwd / "staging"
+    chunk_dir = schema_cwd / "chunks"
+    chunk_dir.mkdir()
+    split_dataset = load.SplitDataset(
+        dataset, 2, chunk_dir, decoder="xmlschema", staging_dir=staging_dir
+    )
+
+    load.run_load_tasks(
+        [split_dataset.check_task()],
+        2,
+        load.LoadProgress(1, path.stat().st_size),
+        None,
+        staging_dir=staging_dir,
+    )
+
+    [(entry, _)] = iter_staged_datasets(staging_dir)
+    assert entry["sha1"] == load.file_sha1(path)
+    assert entry["row_count"] == 4
+    assert list(chunk_dir.iterdir()) == []
+
+
+def hang_task() -> load.TaskResult:
+    load.report_dataset_start(0)
+    # As if stuck in a call into C, which the worker's alarm can't interrupt
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    time.sleep(60)
+    return 60, 0, {}, []
+
+
+def die_task(report: bool) -> load.TaskResult:
+    if report:
+        load.report_dataset_start(0)
+    # As if the worker was killed by the OOM killer, or segfaulted
+    os.kill(os.getpid(), signal.SIGKILL)
+    return 0, 0, {}, []
+
+
+def marker_task(path: str, seconds: float, report: bool = False) -> load.TaskResult:
+    if report:
+        load.report_dataset_start(0)
+    time.sleep(seconds)
+    pathlib.Path(path).write_text("done")
+    return seconds, 1, {}, []
+
+
+def test_run_load_tasks_kills_stuck_workers(schema_cwd, monkeypatch):
+    monkeypatch.setattr(load, "DATASET_TIMEOUT", 0.5)
+    monkeypatch.setattr(load, "DATASET_KILL_GRACE", 0)
+    monkeypatch.setattr(load, "WATCHDOG_INTERVAL", 0.1)
+    stuck = Dataset(data_path=str(schema_cwd / "test_prefix" / "stuck.xml"))
+    staging_dir = schema_cwd / "staging"
+    tasks = [
+        load.LoadTask(1, hang_task, (), [stuck], attempts=load.MAX_DATASET_ATTEMPTS),
+        # Running or queued when the stuck worker is killed, so run again
+        load.LoadTask(1, marker_task, (str(schema_cwd / "slow"), 1), []),
+        load.LoadTask(1, marker_task, (str(schema_cwd / "quick"), 0), []),
+    ]
+
+    start = time.perf_counter()
+    load.run_load_tasks(
+        tasks, 2, load.LoadProgress(3, 3), None, staging_dir=staging_dir
+    )
+
+    assert time.perf_counter() - start < 30
+    [failure] = iter_staged_failures(staging_dir)
+    assert failure["dataset"] == "stuck"
+    assert failure["attempts"] == load.MAX_DATASET_ATTEMPTS
+    assert "Timed out" in failure["reason"]
+    assert (schema_cwd / "slow").read_text() == "done"
+    assert (schema_cwd / "quick").read_text() == "done"
+
+
+def test_run_load_tasks_blames_dead_workers(schema_cwd, monkeypatch):
+    monkeypatch.setattr(load, "DATASET_TIMEOUT", 0)
+    dead = Dataset(data_path=str(schema_cwd / "test_prefix" / "dead.xml"))
+    staging_dir = schema_cwd / "staging"
+    tasks = [
+        # Loading a dataset, so running again on the same worker
+        load.LoadTask(1, marker_task, (str(schema_cwd / "slow"), 1, True), []),
+        load.LoadTask(1, die_task, (True,), [dead], attempts=load.MAX_DATASET_ATTEMPTS),
+    ]
+
+    load.run_load_tasks(
+        tasks, 2, load.LoadProgress(2, 2), None, staging_dir=staging_dir
+    )
+
+    [failure] = iter_staged_failures(staging_dir)
+    assert failure["dataset"] == "dead"
+    assert failure["reason"] == "Worker process died"
+    assert (schema_cwd / "slow").read_text() == "done"
+
+
+def test_run_load_tasks_logs_unexplained_deaths(schema_cwd, caplog, monkeypatch):
+    monkeypatch.setattr(load, "DATASET_TIMEOUT", 0)
+    lost = Dataset(data_path=str(schema_cwd / "test_prefix" / "lost.xml"))
+    staging_dir = schema_cwd / "staging"
+    tasks = [
+        # Finished by the only worker before it starts the other task
+        load.LoadTask(1, marker_task, (str(schema_cwd / "quick"), 0), []),
+        load.LoadTask(1, die_task, (False,), [lost]),
+    ]
+
+    load.run_load_tasks(
+        tasks, 1, load.LoadProgress(2, 2), None, staging_dir=staging_dir
+    )
+
+    # The pool breaks before the task can be blamed, so it is loaded again a few
+    # times and then given up on
+    assert list(iter_staged_failures(staging_dir)) == []
+    assert (
+        caplog.messages.count(
+            "A worker process died while not loading a dataset, so the tasks in flight "
+            "will be loaded again"
+        )
+        == load.MAX_DATASET_ATTEMPTS + 1
+    )
+    assert any(
+        message.startswith("Dataset 'lost' caused error") for message in caplog.messages
+    )
+    assert (schema_cwd / "quick").read_text() == "done"
+
+
+def test_expected_makespan():
+    assert load.expected_makespan([100, 50, 40, 10], 2) == 100
+    assert load.expected_makespan([50, 40, 30, 20], 2) == 70
+    assert load.expected_makespan([], 2) == 0
+
+
+def test_load_progress(caplog, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(load.time, "perf_counter", lambda: now[0])
+    progress = load.LoadProgress(total_datasets=10, total_bytes=4_000_000, interval=30)
+
+    now[0] = 110.0
+    progress.update(datasets=2, bytes=1_000_000, rows=50)
+    assert caplog.messages == []
+
+    now[0] = 140.0
+    with caplog.at_level("INFO"):
+        progress.update(datasets=2, bytes=1_000_000, rows=70)
+    assert caplog.messages == [
+        "Loaded 4/10 datasets: 0.1 datasets/s, 3 activities/s, 0.1 MB/s, ETA 40s"
+    ]
+
+
+def test_dataset_chunks_merge_in_order(tmp_path, monkeypatch):
+    xml_schema = xmlschema.XMLSchema("tests/fixtures/schema/iati-activities-schema.xsd")
+    monkeypatch.setattr(load, "get_schema_order", lambda: {})
+    monkeypatch.setattr(load, "get_xml_schema", lambda filetype: xml_schema)
+    monkeypatch.setattr(load, "CHUNK_BLOCK_SIZE", 2)
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    data_path = prefix_dir / "test_chunks.xml"
+    data_path.write_text(
+        '<iati-activities version="2.03">'
+        + "".join(
+            f"<iati-activity><iati-identifier>{identifier}</iati-identifier>"
+            '<reporting-org ref="A" type="10"/><title><narrative>Tést</narrative></title>'
+            "</iati-activity>"
+            for identifier in range(7)
+        )
+        + "</iati-activities>",
+        encoding="utf-8",
+    )
+    dataset = Dataset(data_path=str(data_path))
+
+    chunk_paths = [str(tmp_path / f"{chunk}.copy") for chunk in range(3)]
+    chunk_rows = [
+        load.load_dataset_chunk(dataset, (chunk, 3), chunk_path, decoder="xmlschema")[1]
+        for chunk, chunk_path in enumerate(chunk_paths)
+    ]
+
+    assert chunk_rows == [3, 2, 2]
+    assert list(load.iter_chunk_lines(chunk_paths)) == [
+        copy_text_row(row) for row in load.iter_raw_rows(dataset, decoder="xmlschema")
+    ]
+    assert [
+        json.loads(line.split("\t")[-1])["iati-identifier"]
+        for line in load.iter_chunk_lines(chunk_paths)
+    ] == [str(identifier) for identifier in range(7)]
+    # The JSON isn't ASCII escaped, so the chunk files must be read as UTF-8
+    # whatever the locale
+    assert "Tést" in next(load.iter_chunk_lines(chunk_paths))
+
+
+def staged_row_counts(staging_dir):
+    return {
+        entry["filename"]: entry["row_count"]
+        for entry, _ in iter_staged_datasets(staging_dir)
+    }
+
+
+def test_load_dataset_reparses_corrupt_cache_entry(tmp_path, monkeypatch):
+    xml_schema = xmlschema.XMLSchema("tests/fixtures/schema/iati-activities-schema.xsd")
+    monkeypatch.setattr(registry, "cache_dir", tmp_path / "cache")
+    monkeypatch.setattr(load, "get_schema_order", lambda: {})
+    monkeypatch.setattr(load, "get_xml_schema", lambda filetype: xml_schema)
+    monkeypatch.setattr(load, "get_parse_cache_version", lambda: "test")
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    data_path = prefix_dir / "test_cached.xml"
+    data_path.write_text(
+        '<iati-activities version="2.03">'
+        + "".join(
+            f"<iati-activity><iati-identifier>{identifier}</iati-identifier>"
+            f'<reporting-org ref="A" type="10"/><title><narrative>{identifier}</narrative>'
+            "</title></iati-activity>"
+            for identifier in range(500)
+        )
+        + "</iati-activities>"
+    )
+    dataset = Dataset(data_path=str(data_path))
+    staging_dir = tmp_path / "staging"
+    assert (
+        load.load_dataset(dataset, decoder="xmlschema", staging_dir=staging_dir) == 500
+    )
+    [cache_path] = (tmp_path / "cache" / "parsed").glob("*.jsonl.gz")
+    cache_path.write_bytes(cache_path.read_bytes()[: cache_path.stat().st_size // 2])
+    load.take_cache_counts()
+
+    assert (
+        load.load_dataset(dataset, decoder="xmlschema", staging_dir=staging_dir) == 500
+    )
+
+    assert load.take_cache_counts() == {"parse cache hits": 1, "parse cache misses": 1}
+    assert staged_row_counts(staging_dir) == {"test_cached.xml": 500}
+    # The entry is written again from the new parse
+    with load.get_parse_cache().read(cache_path.name.split(".")[0]) as cached:
+        assert cached is not None
+        assert len(list(cached[1])) == 500
+
+
+def test_load_dataset_records_parse_errors_only(tmp_path, monkeypatch):
+    xml_schema = xmlschema.XMLSchema("tests/fixtures/schema/iati-activities-schema.xsd")
+    monkeypatch.setattr(load, "get_schema_order", lambda: {})
+    monkeypatch.setattr(load, "get_xml_schema", lambda filetype: xml_schema)
+    monkeypatch.setattr(load, "get_parse_cache_version", lambda: "test")
+    monkeypatch.setattr(load, "PARSE_CACHE_BYTES", 0)
+    prefix_dir = tmp_path / "test_prefix"
+    prefix_dir.mkdir()
+    (prefix_dir / "invalid.xml").write_text("<iati-activities><iati-activity>")
+    (prefix_dir / "valid.xml").write_text(
+        '<iati-activities version="2.03"><iati-activity>'
+        '<iati-identifier>A</iati-identifier><reporting-org ref="A" type="10"/>'
+        "<title><narrative>T</narrative></title></iati-activity></iati-activities>"
+    )
+    staging_dir = tmp_path / "staging"
+
+    # Invalid XML is recorded with no rows, so it isn't parsed again until it changes
+    invalid = Dataset(data_path=str(prefix_dir / "invalid.xml"))
+    assert load.load_dataset(invalid, decoder="xmlschema", staging_dir=staging_dir) == 0
+    assert staged_row_counts(staging_dir) == {"invalid.xml": 0}
+
+    # But errors writing the rows aren't parse errors, so nothing is recorded
+    def write(self, row):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(StagingWriter, "write", write)
+    valid = Dataset(data_path=str(prefix_dir / "valid.xml"))
+    with pytest.raises(OSError, match="No space left"):
+        load.load_dataset(valid, decoder="xmlschema", staging_dir=staging_dir)
+    assert staged_row_counts(staging_dir) == {"invalid.xml": 0}
+
+
+def test_in_shard(tmp_path):
+    datasets = [
+        Dataset(data_path=str(tmp_path / f"prefix_{prefix}" / f"{name}.xml"))
+        for prefix in range(5)
+        for name in range(20)
+    ]
+
+    shards = [
+        {dataset.data_path for dataset in datasets if load.in_shard(dataset, (i, 3))}
+        for i in range(3)
+    ]
+
+    assert sum(len(shard) for shard in shards) == len(datasets)
+    assert set.union(*shards) == {dataset.data_path for dataset in datasets}
+    assert all(shards)
+
+
+def test_sharded_staged_load(schema_cwd):
+    registry_dir = schema_cwd / "__iatikitcache__" / "registry"
+    for prefix in ["prefix_a", "prefix_b"]:
+        (registry_dir / "data" / prefix).mkdir(parents=True)
+        for name in range(4):
+            (registry_dir / "data" / prefix / f"{prefix}-{name}.xml").write_text(
+                '<iati-activities version="2.03">'
+                f"<iati-activity><iati-identifier>{prefix}-{name}</iati-identifier>"
+                '<reporting-org ref="A" type="10"/><title><narrative>T</narrative></title>'
+                "</iati-activity></iati-activities>"
+            )
+    (registry_dir / "metadata.json").write_text(
+        json.dumps({"updated_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")})
+    )
+
+    # Each shard is loaded at the same time by its own process, with its own pool
+    # of workers, as it would be on separate machines. They only share the
+    # working directory, with the registry and standard, and the environment.
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(pathlib.Path(load.__file__).parent.parent),
+        "IATI_TABLES_PARSE_CACHE_BYTES": "0",
+    }
+    staging_dirs = [schema_cwd / f"shard_{i}" for i in range(2)]
+    shards = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from iati_tables.load import load_datasets; "
+                f"load_datasets(1, decoder='xmlschema', shard=({i}, 2), "
+                f"staging_dir={str(staging_dir)!r})",
+            ],
+            cwd=schema_cwd,
+            env=env,
+        )
+        for i, staging_dir in enumerate(staging_dirs)
+    ]
+    assert [shard.wait(timeout=120) for shard in shards] == [0, 0]
+
+    staged = {}
+    for i, staging_dir in enumerate(staging_dirs):
+        assert read_staged_metadata(staging_dir)["shard"] == [i, 2]
+        for entry, rows_path in iter_staged_datasets(staging_dir):
+            assert entry["row_count"] == 1
+            [line] = iter_staged_lines(rows_path)
+            staged[entry["prefix"], entry["filename"]] = json.loads(
+                line.rstrip("\n").split("\t")[-1]
+            )["iati-identifier"]
+    assert staged == {
+        (prefix, f"{prefix}-{name}.xml"): f"{prefix}-{name}"
+        for prefix in ["prefix_a", "prefix_b"]
+        for name in range(4)
+    }
+
+
+def test_batch_staged_datasets(tmp_path, monkeypatch):
+    monkeypatch.setattr(load, "STAGED_BATCH_BYTES", 10)
+    for name, size in [("a", 4), ("b", 8), ("c", 3), ("d", 0)]:
+        with StagingWriter(
+            tmp_path,
+            {"prefix": "test_prefix", "filename": name, "filetype": "activity"},
+        ) as writer:
+            if size:
+                writer.write_line("x")
+        rows_path, _ = get_staged_paths(tmp_path, "test_prefix", name)
+        rows_path.write_bytes(b"x" * size)
+
+    batches = load.batch_staged_datasets([tmp_path])
+
+    assert [[entry["filename"] for entry, _ in batch] for batch in batches] == [
+        ["b"],
+        ["a", "c", "d"],
+    ]
+
+
+def test_copy_staged_dataset(tmp_path):
+    entry = {"prefix": "test_prefix", "filename": "test.xml", "filetype": "activity"}
+    with StagingWriter(tmp_path, entry) as writer:
+        writer.write(("test_prefix", "test", "test.xml", "", "2.03", "{}"))
+    [(entry, rows_path)] = iter_staged_datasets(tmp_path)
+    connection = MagicMock()
+    cursor = connection.connection.cursor.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, f, size: copied.append((sql, f.read()))
+
+    load.copy_staged_dataset(connection, entry, rows_path, replace=False)
+
+    assert copied == [
+        (
+            "COPY _raw_activity (prefix, dataset, filename, error, version, object) FROM STDIN",
+            b"test_prefix\ttest\ttest.xml\t\t2.03\t{}\n",
+        )
+    ]
+    cursor.close.assert_called_once()
+    # Existing rows aren't deleted, so only the manifest entry is written
+    assert connection.execute.call_count == 2
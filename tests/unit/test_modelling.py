@@ -1,4 +1,10 @@
-from iati_tables.modelling import path_info, traverse_object
+from collections import Counter
+from unittest.mock import MagicMock
+
+import pytest
+
+from iati_tables import modelling
+from iati_tables.modelling import flatten_object, path_info, traverse_object
 
 
 def test_traverse_object_strings():
@@ -154,14 +160,13 @@ def test_traverse_object_lists_of_dicts():
 
 def test_path_info():
     full_path = ("result", 12, "indicator", 3, "period", 0, "actual", 0)
-    no_index_path = ("result", "indicator", "period", "actual")
     (
         object_key,
         parent_keys_list,
         parent_keys_no_index,
         object_type,
         parent_keys,
-    ) = path_info(full_path, no_index_path, "activity")
+    ) = path_info(full_path, "activity")
 
     assert object_key == "result.12.indicator.3.period.0.actual.0"
     assert parent_keys_list == [
@@ -175,6 +180,8 @@ def test_path_info():
         "result_indicator_period",
     ]
     assert object_type == "result_indicator_period_actual"
+    assert path_info(("reporting-org",), "activity")[3] == "reporting-org"
+    assert path_info((), "activity")[3] == "activity"
     assert parent_keys == (
         {
             "result": "result.12",
@@ -182,3 +189,213 @@ def test_path_info():
             "result_indicator_period": "result.12.indicator.3.period.0",
         },
     )
+
+
+def test_path_info_caches_paths_not_indices():
+    modelling.take_path_cache_counts()
+
+    for num in range(2000):
+        object_key, parent_keys_list, _, object_type, _ = path_info(
+            ("transaction", num, "sector", 0), "activity"
+        )
+        assert object_key == f"transaction.{num}.sector.0"
+        assert parent_keys_list == [f"transaction.{num}"]
+        assert object_type == "transaction_sector"
+    assert path_info(("{x}", 1), "activity")[0] == "{x}.1"
+
+    counts = modelling.take_path_cache_counts()
+    assert counts["path template hits"] >= 1999
+    assert counts["path template misses"] <= 2
+    assert modelling.take_path_cache_counts()["path template hits"] == 0
+
+
+@pytest.mark.parametrize("pipeline_threads", [0, 2])
+def test_flatten_raw_objects_copies_rows(monkeypatch, pipeline_threads):
+    engine = MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    connection.execution_options.return_value.execute.return_value = [
+        (
+            1,
+            "dataset-1",
+            "prefix",
+            {"iati-identifier": "A", "sector": [{"@code": "1"}]},
+        ),
+        (2, "dataset-1", "prefix", {"iati-identifier": "B"}),
+    ]
+    copied = []
+    connection.connection.cursor.return_value.copy_expert.side_effect = (
+        lambda sql, f: copied.append((sql, f.read()))
+    )
+    monkeypatch.setattr(modelling, "get_engine", lambda: engine)
+    type_counts = Counter()
+
+    assert modelling.flatten_raw_objects(
+        "activity",
+        (1, 2),
+        "_raw_objects",
+        flush_size=2,
+        pipeline_threads=pipeline_threads,
+        type_counts=type_counts,
+    ) == (2, 3)
+
+    copy_sql = (
+        "COPY _raw_objects "
+        "(id, object_key, parent_keys, object_type, object, filetype, object_index) "
+        "FROM STDIN"
+    )
+    assert [sql for sql, _ in copied] == [copy_sql, copy_sql]
+    lines = "".join(data for _, data in copied).splitlines()
+    assert [line.split("\t")[:4] for line in lines] == [
+        ["1", "sector.0", "[{}]", "sector"],
+        ["1", "", "[{}]", "activity"],
+        ["2", "", "[{}]", "activity"],
+    ]
+    assert type_counts[("activity", "iatiidentifier", "string")] == 2
+    assert type_counts[("sector", "code", "string")] == 1
+    assert type_counts[("sector", "_link", "string")] == 1
+
+
+def copy_raw_objects(monkeypatch, filetype, raw_rows, id_range=None):
+    engine = MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    connection.execution_options.return_value.execute.return_value = [
+        raw_row
+        for raw_row in raw_rows
+        if not id_range or id_range[0] <= raw_row[0] <= id_range[1]
+    ]
+    copied = []
+    connection.connection.cursor.return_value.copy_expert.side_effect = (
+        lambda sql, f: copied.append(f.read())
+    )
+    monkeypatch.setattr(modelling, "get_engine", lambda: engine)
+    modelling.flatten_raw_objects(filetype, id_range, "_raw_objects")
+    return [line.split("\t") for line in "".join(copied).splitlines()]
+
+
+def test_raw_objects_order_matches_serial(monkeypatch):
+    def copy_rows(filetype, id_range=None):
+        # create_rows changes the objects it is given, so make new ones each time
+        raw_rows = [
+            (
+                id,
+                "dataset-1",
+                "prefix",
+                {
+                    "iati-identifier": str(id),
+                    "transaction": [
+                        {"value": "1", "sector": [{"@code": str(num)}, {"@code": "2"}]}
+                        for num in range(12)
+                    ],
+                },
+            )
+            for id in range(1, 11)
+        ]
+        return copy_raw_objects(monkeypatch, filetype, raw_rows, id_range)
+
+    serial = copy_rows("activity") + copy_rows("organisation")
+    # Id ranges copied in whatever order their workers finish
+    parallel = (
+        copy_rows("organisation", (6, 10))
+        + copy_rows("activity", (6, 10))
+        + copy_rows("organisation", (1, 5))
+        + copy_rows("activity", (1, 5))
+    )
+
+    def sort_key(row):
+        key = []
+        for column in modelling.RAW_OBJECTS_ORDER_BY.split(", "):
+            value = row[modelling.RAW_OBJECTS_COLUMNS.index(column.split(".")[1])]
+            key.append(value if column.endswith(".filetype") else int(value))
+        return key
+
+    assert len(serial) == 2 * 10 * (1 + 12 + 24)
+    assert parallel != serial
+    assert sorted(parallel, key=sort_key) == serial
+
+
+def test_flatten_raw_objects_logs_buffered_rows(caplog, monkeypatch):
+    engine = MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    connection.execution_options.return_value.execute.return_value = [
+        (
+            id,
+            "dataset-1",
+            "prefix",
+            {"iati-identifier": "A", "sector": [{"@code": "1"}]},
+        )
+        for id in range(10000)
+    ]
+    monkeypatch.setattr(modelling, "get_engine", lambda: engine)
+    monkeypatch.setattr(modelling, "clock", iter([0.0, 2.0]).__next__)
+
+    with caplog.at_level("INFO"):
+        modelling.flatten_raw_objects(
+            "activity", None, "_raw_objects", flush_size=10**6, pipeline_threads=0
+        )
+
+    # Nothing has been copied yet, but the 20000 rows buffered are counted
+    assert caplog.messages == ["Processed 10000 activity objects so far (10000 rows/s)"]
+
+
+def test_get_value_type():
+    assert modelling.get_value_type("2020-01-31") == "date"
+    assert modelling.get_value_type("2020-01-31T12:00:00Z") == "datetime"
+    assert modelling.get_value_type("2020-01-31 12:00:00.5-05:00") == "datetime"
+    # PostgreSQL's $ doesn't match before a trailing newline, and \d is ASCII
+    assert modelling.get_value_type("2020-01-31\n") == "string"
+    assert modelling.get_value_type("\u0662\u0660\u0662\u0660-01-31") == "string"
+    assert modelling.get_value_type("2020-1-31") == "string"
+    assert modelling.get_value_type(None) == "null"
+    assert modelling.get_value_type(float("nan")) == "null"
+    assert modelling.get_value_type(True) == "boolean"
+    assert modelling.get_value_type(1) == "number"
+    assert modelling.get_value_type(1.5) == "number"
+    assert modelling.get_value_type(["a"]) == "array"
+
+
+def test_get_object_type_fields():
+    type_counts = Counter(
+        {
+            ("activity", "title", "string"): 3,
+            ("activity", "title", "null"): 1,
+            ("activity", "start", "date"): 2,
+            ("activity", "start", "datetime"): 1,
+            ("activity", "empty", "null"): 4,
+            ("sector", "percentage", "number"): 5,
+        }
+    )
+
+    assert sorted(modelling.get_object_type_fields(type_counts)) == [
+        ("activity", "start", "string", 3),
+        ("activity", "title", "string", 3),
+        ("sector", "percentage", "number", 5),
+    ]
+
+
+def test_flatten_object(monkeypatch):
+    monkeypatch.setattr(
+        modelling,
+        "CODELIST_LOOKUP",
+        {("sector", "@code"): {"111": "Education, Level Unspecified"}},
+    )
+    modelling.get_flatten_plan.cache_clear()
+    sector = {
+        "@code": "111",
+        "@vocabulary": "1",
+        "@{http://www.w3.org/XML/1998/namespace}lang": "en",
+        "$": "Education",
+        "budget-line": {"$": "A", "@ref": "1"},
+    }
+
+    for _ in range(2):
+        assert dict(flatten_object(sector, no_index_path=("sector",))) == {
+            "codename": "Education, Level Unspecified",
+            "code": "111",
+            "vocabulary": "1",
+            "lang": "en",
+            "_": "Education",
+            "budgetline": "A",
+            "budgetline_ref": "1",
+        }
+    assert dict(flatten_object({"@code": "111"})) == {"code": "111"}
+    modelling.get_flatten_plan.cache_clear()
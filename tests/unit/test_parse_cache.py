@@ -0,0 +1,98 @@
+import gzip
+import os
+
+import pytest
+
+from iati_tables.parse_cache import CacheReadError, ParseCache
+
+
+def read_entry(cache, key):
+    with cache.read(key) as cached:
+        if cached is None:
+            return None
+        version, objects = cached
+        return version, list(objects)
+
+
+def test_parse_cache_read_write(tmp_path):
+    cache = ParseCache(tmp_path / "parsed", max_bytes=1024 * 1024)
+    assert read_entry(cache, "key") is None
+
+    with cache.write("key", "2.03") as writer:
+        writer.write("", '{"iati-identifier": "A"}')
+        writer.write("error 1\nerror 2\twith tab", '{"iati-identifier": "B"}')
+
+    assert read_entry(cache, "key") == (
+        "2.03",
+        [
+            ("", '{"iati-identifier": "A"}'),
+            ("error 1\nerror 2\twith tab", '{"iati-identifier": "B"}'),
+        ],
+    )
+
+
+def test_parse_cache_skips_failed_writes(tmp_path):
+    cache = ParseCache(tmp_path / "parsed", max_bytes=1024 * 1024)
+
+    with pytest.raises(ValueError):
+        with cache.write("key", "2.03") as writer:
+            writer.write("", "{}")
+            raise ValueError
+
+    assert read_entry(cache, "key") is None
+    assert list((tmp_path / "parsed").iterdir()) == []
+
+
+def test_parse_cache_deletes_truncated_entries(tmp_path):
+    cache = ParseCache(tmp_path / "parsed", max_bytes=1024 * 1024)
+    with cache.write("key", "2.03") as writer:
+        for number in range(1000):
+            writer.write("", f'{{"iati-identifier": "{number}"}}' + " " * 100)
+    path = cache.get_path("key")
+    path.write_bytes(path.read_bytes()[: path.stat().st_size // 2])
+
+    with pytest.raises(CacheReadError):
+        read_entry(cache, "key")
+
+    assert not path.exists()
+    assert read_entry(cache, "key") is None
+
+
+def test_parse_cache_closes_abandoned_entries(tmp_path, monkeypatch):
+    cache = ParseCache(tmp_path / "parsed", max_bytes=1024 * 1024)
+    with cache.write("key", "2.03") as writer:
+        writer.write("", "{}")
+        writer.write("", "{}")
+    opened = []
+    gzip_open = gzip.open
+
+    def open_entry(*args, **kwargs):
+        opened.append(gzip_open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(gzip, "open", open_entry)
+
+    # Stop reading part way through the entry
+    with cache.read("key") as cached:
+        assert cached is not None
+        _, objects = cached
+        next(objects)
+
+    [f] = opened
+    assert f.closed
+
+
+def test_parse_cache_evicts_least_recently_used(tmp_path):
+    cache = ParseCache(tmp_path / "parsed", max_bytes=1024 * 1024)
+    for number, key in enumerate(["old", "used", "new"]):
+        with cache.write(key, "2.03") as writer:
+            writer.write("", "{}")
+        os.utime(cache.get_path(key), (number, number))
+    read_entry(cache, "used")
+    cache.max_bytes = sum(cache.get_path(key).stat().st_size for key in ["used", "new"])
+
+    cache.evict()
+
+    assert read_entry(cache, "old") is None
+    assert read_entry(cache, "used") is not None
+    assert read_entry(cache, "new") is not None
@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+
+import pytest
+
+from iati_tables import pipeline
+from iati_tables.pipeline import run_pipeline
+
+
+def test_run_pipeline_keeps_source_order():
+    def transform(value):
+        # Finish batches out of order
+        time.sleep(random.random() / 1000)
+        return value * 2
+
+    results = []
+    stats = run_pipeline(
+        range(1000), transform, results.append, threads=4, batch_size=7, queue_size=2
+    )
+
+    assert results == [value * 2 for value in range(1000)]
+    assert stats.read_queue.batches == stats.write_queue.batches == 143
+    assert stats.read_queue.max_depth <= 2
+    assert stats.write_queue.max_depth <= 2
+
+
+def test_run_pipeline_applies_backpressure(monkeypatch):
+    read = []
+    release = threading.Event()
+    blocked = threading.Event()
+
+    class BatchSemaphore(threading.Semaphore):
+        def acquire(self, blocking=True, timeout=None):
+            acquired = super().acquire(blocking, timeout)
+            if not acquired:
+                blocked.set()
+            return acquired
+
+    # The reader waits on the semaphore once the maximum batches are in flight
+    monkeypatch.setattr(pipeline, "Semaphore", BatchSemaphore)
+
+    def source():
+        for value in range(100):
+            read.append(value)
+            yield value
+
+    def sink(value):
+        release.wait()
+
+    thread = threading.Thread(
+        target=run_pipeline,
+        args=(source(), lambda value: value, sink),
+        kwargs={"batch_size": 1, "queue_size": 2},
+    )
+    thread.start()
+    try:
+        assert blocked.wait(timeout=10)
+        # 2 * 2 + 1 batches in flight, including the one in the sink, and the one
+        # the reader is waiting to send
+        assert len(read) == 6
+    finally:
+        release.set()
+        thread.join()
+    assert len(read) == 100
+
+
+def test_run_pipeline_raises_transform_errors():
+    def transform(value):
+        if value == 50:
+            raise ValueError("bad value")
+        return value
+
+    results = []
+    with pytest.raises(ValueError, match="bad value"):
+        run_pipeline(range(1000), transform, results.append, threads=2, batch_size=5)
+
+    # Only the results before the error are written, in order
+    assert results == list(range(len(results)))
+    assert len(results) <= 50
+
+
+def test_run_pipeline_raises_sink_errors():
+    def sink(value):
+        raise ValueError("can't write")
+
+    with pytest.raises(ValueError, match="can't write"):
+        run_pipeline(iter(range(10**9)), lambda value: value, sink, threads=2)
+
+    assert not [
+        thread
+        for thread in threading.enumerate()
+        if thread.name == "pipeline-read" or thread.name.startswith("pipeline-work-")
+    ]
+
+
+def test_run_pipeline_raises_source_errors():
+    def source():
+        yield 1
+        raise ValueError("can't read")
+
+    with pytest.raises(ValueError, match="can't read"):
+        run_pipeline(source(), lambda value: value, lambda value: None)
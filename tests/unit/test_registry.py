@@ -0,0 +1,44 @@
+import datetime
+from unittest.mock import MagicMock
+
+from iatikit.data.dataset import Dataset
+
+from iati_tables import registry
+
+
+def test_get_registry_index(tmp_path, monkeypatch):
+    mock_iatikit = MagicMock()
+    mock_iatikit.data.return_value.datasets = [
+        Dataset(data_path="tests/fixtures/test_prefix/test_activity.xml"),
+        Dataset(data_path="tests/fixtures/test_prefix/test_organisation.xml"),
+        Dataset(data_path="tests/fixtures/test_prefix/missing.xml"),
+    ]
+    mock_iatikit.data.return_value.last_updated = datetime.datetime(2024, 1, 1)
+    monkeypatch.setattr(registry, "iatikit", mock_iatikit)
+    monkeypatch.setattr(registry, "cache_dir", tmp_path)
+    registry.get_registry_index.cache_clear()
+
+    index = registry.get_registry_index()
+
+    assert index.last_updated == datetime.datetime(2024, 1, 1)
+    assert [
+        (dataset.prefix, dataset.name, dataset.filetype, dataset.version)
+        for dataset in index.datasets
+    ] == [
+        ("test_prefix", "test_activity", "activity", "2.03"),
+        ("test_prefix", "test_organisation", "organisation", "2.03"),
+    ]
+    assert index.datasets[0].size > 0
+
+    # The saved index is used while the registry is unchanged
+    mock_iatikit.data.return_value.datasets = []
+    registry.get_registry_index.cache_clear()
+    assert [dataset.to_row() for dataset in registry.get_registry_index().datasets] == [
+        dataset.to_row() for dataset in index.datasets
+    ]
+
+    # And rebuilt when it's downloaded again
+    mock_iatikit.data.return_value.last_updated = datetime.datetime(2024, 1, 2)
+    registry.get_registry_index.cache_clear()
+    assert registry.get_registry_index().datasets == []
+    registry.get_registry_index.cache_clear()
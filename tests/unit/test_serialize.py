@@ -0,0 +1,71 @@
+import json
+import math
+
+import pytest
+
+from iati_tables import serialize
+
+VALUES = [
+    {
+        "iati-identifier": "XM-EXAMPLE-1",
+        "title": {"narrative": [{"$": "Tést ✓ 中文 😀", "@xml:lang": "fr"}]},
+        "activity-status": {"@code": "2"},
+    },
+    {"b": 1, "a": 2, "@z": None, "$": True, "": False},
+    'quote " backslash \\ slash / newline \n tab \t \x00 \x01 \x1f \x7f    ',
+    [
+        0,
+        -1,
+        2**63,
+        2**70,
+        1.5,
+        0.1,
+        100.0,
+        1e16,
+        1.5e-7,
+        1e300,
+        -0.0,
+        123456789012.25,
+    ],
+    [],
+    {},
+]
+
+
+@pytest.fixture(params=sorted(serialize.BACKENDS))
+def dumps(request):
+    return serialize.BACKENDS[request.param]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_dumps_round_trips_like_json_dumps(dumps, value):
+    text = dumps(value)
+
+    # Decodes to the same value as the JSON written by json.dumps with its default
+    # arguments, with floats (including the sign of zero) and keys in the same order
+    assert json.dumps(json.loads(text)) == json.dumps(json.loads(json.dumps(value)))
+
+
+def test_dumps_compact_unicode(dumps):
+    assert dumps({"b": "é", "a": ["✓", 1]}) == '{"b":"é","a":["✓",1]}'
+
+
+def test_dumps_writes_non_finite_floats_as_null(dumps):
+    value = {"a": [math.nan, 1.5, {"b": math.inf}], "c": -math.inf}
+
+    # Unlike json.dumps, which writes NaN and Infinity, which aren't valid JSON
+    assert json.dumps(value) == ('{"a": [NaN, 1.5, {"b": Infinity}], "c": -Infinity}')
+    assert json.loads(dumps(value)) == {"a": [None, 1.5, {"b": None}], "c": None}
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_dumps_orjson_matches_json(value):
+    pytest.importorskip("orjson")
+
+    assert serialize.dumps_orjson(value) == serialize.dumps_json(value)
+
+
+def test_dumps_orjson_falls_back_to_json():
+    pytest.importorskip("orjson")
+
+    assert serialize.dumps_orjson({"a": 2**70}) == '{"a":1180591620717411303424}'
@@ -0,0 +1,37 @@
+import pytest
+
+from iati_tables.staging import (
+    StagingWriter,
+    iter_staged_datasets,
+    iter_staged_lines,
+    open_staged_rows,
+)
+
+ENTRY = {"prefix": "test_prefix", "filename": "test.xml", "filetype": "activity"}
+
+
+def test_staging_writer(tmp_path):
+    with StagingWriter(tmp_path, ENTRY) as writer:
+        writer.write(("test_prefix", "tést", None))
+        writer.write_line("a\tb\n")
+
+    [(entry, rows_path)] = iter_staged_datasets(tmp_path)
+    assert entry == {**ENTRY, "row_count": 2}
+    assert list(iter_staged_lines(rows_path)) == ["test_prefix\ttést\t\\N\n", "a\tb\n"]
+    with open_staged_rows(rows_path) as f:
+        assert f.read() == "test_prefix\ttést\t\\N\na\tb\n".encode()
+
+
+def test_staging_writer_discards_dataset_on_error(tmp_path):
+    with StagingWriter(tmp_path, ENTRY) as writer:
+        writer.write_line("a\n")
+
+    with pytest.raises(ValueError):
+        with StagingWriter(tmp_path, ENTRY) as writer:
+            writer.write_line("b\n")
+            raise ValueError
+
+    assert list(iter_staged_datasets(tmp_path)) == []
+    assert [
+        path.name for path in (tmp_path / "datasets" / "test_prefix").iterdir()
+    ] == ["test.xml.copy.gz"]